@@ -1,43 +1,58 @@
 import argparse
+import numpy as np
 import pandas as pd
 
+from hermes_export import COMPRESSION_SUFFIXES, get_export_path, write_frame
+from location_registry import LocationRegistry, read_location_files
 
-def main(villages):
-    factories = pd.DataFrame(
+FACTORY_COLUMNS = ['idcode', 'Name', 'Targets', 'Vaccines', 'StartupLatencyDays', 'ProductionIntervalDays',
+                   'OverstockScale', 'DemandType']
+
+
+def main(villages, compression=None, registry=None):
+    if registry is None:
+        registry = LocationRegistry.from_frames(villages)
+    factories = finish_factories(build_village_factories(villages, registry))
+    write_frame(factories, get_export_path('factories.csv', compression), FACTORY_COLUMNS, compression)
+
+
+def build_village_factories(villages, registry):
+    """Returns each village's factory, with its production interval."""
+    # Each village's factory targets its farm; both IDs come from the registry shared with the other generators.
+    # Ensure weekly/daily production intervals are maintained.
+    return pd.DataFrame(
         {
-            'idcode': 'f_1' + villages.Location_ID.str[1:],
-            'Name': villages.Village_Name.values,
+            'idcode': registry.ids('factory'),
+            'Name': registry.names('factory'),
+            'Targets': registry.parent_ids('factory'),
+            'ProductionIntervalDays': np.where(villages.Market_Frequency.values == "Daily", "1", "7").astype(object),
         },
-        columns=['idcode', 'Name'],
+        columns=['idcode', 'Name', 'Targets', 'ProductionIntervalDays'],
     )
-    factories['Targets'] = '2' + factories['idcode'].str[3:]
-    # Hard-code in the state-level imports before adding the consistent columns.
-    factories = factories.append({'idcode': 'f_10000001',
-                                  'Name': 'Aiginia_Imports',
-                                  'Targets': '71905001', }, ignore_index=True)
+
+
+def finish_factories(village_factories):
+    """Adds the state-level imports to the villages' factories and fills in the consistent columns."""
+    # Hard-code in the state-level imports (producing daily) before adding the consistent columns.
+    imports = pd.DataFrame([{'idcode': 'f_10000001',
+                             'Name': 'Aiginia_Imports',
+                             'Targets': '71905001',
+                             'ProductionIntervalDays': 1, }])
+    factories = pd.concat([village_factories, imports], ignore_index=True)
     factories['Vaccines'] = 'All'
     factories['StartupLatencyDays'] = 0
-
-    # Ensure weekly/daily production intervals are maintained and handle Aiginia Imports.
-    production_intervals = []
-    for village in villages.itertuples():
-        if village.Market_Frequency == "Daily":
-            production_intervals.append("1")
-        else:
-            production_intervals.append("7")
-    factories['ProductionIntervalDays'] = pd.Series(production_intervals)
-    factories.loc[factories['idcode'] == 'f_10000001', 'ProductionIntervalDays'] = 1
     factories['OverstockScale'] = 1
     factories['DemandType'] = 'Projection'
-    factories.to_csv('factories.csv', index=False)
+    return factories
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Creates the factories.csv file using the village data file.')
     parser.add_argument('village_data_file', type=str,
                         help='The path to the input csv file of village markets data.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the factories file.')
     args = parser.parse_args()
 
-    village_file = pd.read_csv(args.village_data_file, dtype=str)
+    village_file, _, _ = read_location_files(args.village_data_file)
 
-    main(village_file)
+    main(village_file, args.compression)
@@ -1,11 +1,21 @@
 import argparse
-import calendar
-
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from hermes_export import COMPRESSION_SUFFIXES
+from manifest_rle import ManifestRuns
+from manifest_store import ManifestStore
+from manifest_tables import PRODUCTS, ManifestDays, get_import_production, get_manifest_routes, get_market_calendars
+from manifest_tables import get_production_scenarios, get_scenario_multipliers, get_tonnage, get_village_production
+from manifest_tables import write_manifest
 
 ''' This code parses a file of Odisha Villages with lat/lons, blocks, and Hermes-accessible IDs to build a list of 
     produce shipping details based upon production and seasonality data. 
 
+    The manifest is worked out as whole arrays by manifest_tables.py, and villages in blocks with no production don't
+    ship at all.
+
     Runtime arguments: 
     village_data_file -- CSV file containing basic location and market data for villages within Odisha, India.
     block_production_file -- CSV file containing data on produce quantities from each block in Odisha. 
@@ -13,153 +23,114 @@ import pandas as pd
 
     Output: 
     manifest - CSV file containing produce shipment/market data for each village in Odisha. 
+    manifest runs - with --runs, a run-length encoded copy of the manifest (see manifest_rle.py) as a .npz file.
+    manifest store - with --store, a folder of the manifest's rows indexed by route (see manifest_store.py).
+
+    With --multipliers, a manifest (and runs/store) is written for each production scenario instead, numbered as in
+    manifest_scenarios.csv, which also gives each scenario's total tonnage of each product.
     '''
 
+# Column types of the block production file, as read by the command line (and incremental_build.py).
+BLOCK_PRODUCTION_DTYPES = {
+    'District_Name': str,
+    'Block_Name': str,
+    'Search': str,
+    'Potato_Tons': float,
+    'Onion_Tons': float,
+    'Tomato_Tons': float,
+    'Cabbage_Tons': float,
+    'Brinjal_Tons': float,
+}
+
+
+# The inputs shared by every scenario's manifest, set once in each worker process (see set_scenario_inputs).
+_scenario_inputs = {}
 
-def main(villages, block_production, seasonality):
+
+def main(villages, block_production, seasonality, compression=None, save_runs=False, save_store=False,
+         scenarios=None, workers=None):
     # Modify beyond 1.0 and empty string to handle multiplying factors for Production Surplus/Deficit.
     multiplying_factor = 1.0
     scenario = ''
 
-    factory_manifests = []
-    villages_per_block = villages.groupby('Block_Name').size().to_dict()
-
-    # Create the year data to handle Daily and Weekly Markets
-    year_range = pd.date_range(start='1/1/2019', end='12/28/2019')
-    year = year_range.to_frame(index=False)
-
-    year["Month"] = year_range.month
-    year["Days"] = year_range.day
-    # Remove any days numbered 29, 30, 31 and reset the index to accommodate the missing rows
-    year = year[(year.Days <= 28)]
-    year = year.reset_index(drop=True)
-    # Manually set the Weekday using the index
-    year["Weekdays"] = year.index % 7
-    # Deliveries must be bumped to X.1 to X.2 since time 0.0 breaks HERMES
-    year["Start_Days"] = year.index + 0.1
-    year["End_Days"] = year["Start_Days"] + 0.1
-
-    months = calendar.month_abbr[1:]
-    manifest_columns = ['RouteId', 'StartDay', 'EndDay', 'Month',
-                        'Potato', 'Onion', 'Tomato', 'Brinjal', 'Cabbage', 'Notes']
-
-    mondays = year.loc[year["Weekdays"].values == 0]
-
-    progress = 0
-    for village in villages.itertuples():
-        # get the village's unique district_block search text
-        # then get overall block production amounts for the year and if there's nothing, don't add to manifest
-        block = village.Block_Name
-        search = "{}_{}".format(village.District_Name, block)
-
-        # "Cuttack_Cuttack Sadar" has VMs but no production, "Cuttack_Cuttack" has production but no VMs, so combine.
-        if search == "Cuttack_Cuttack Sadar":
-            village_production = block_production.loc[block_production['Combo'] == "Cuttack_Cuttack"]
-        else:
-            village_production = block_production.loc[block_production['Combo'] == search]
-
-        # Setup the DataFrame for this village and the set of days it's shipping on
-        factory_manifest = pd.DataFrame(columns=manifest_columns)
-
-        # empty DFs (no shipping) can't be processed normally, must be manually set to 0 across all produce columns
-        if village_production.empty:
-            factory_manifest["Potato":"Cabbage"] = 0.0
-        else:
-            # setup the days the village is shipping on
-            if village.Market_Frequency == 'Daily':
-                # all days
-                days = year
-            else:  # Weekly
-                # Only Mondays
-                days = mondays
-
-            # attach list of this village's market days to factory manifest- this is what makes this file huge
-            factory_manifest['StartDay'] = days["Start_Days"]
-            factory_manifest['EndDay'] = days["End_Days"]
-            factory_manifest['Month'] = days["Month"]
-
-            # get breakdowns of number of village market days by month
-            sale_days_by_month = days['Month'].value_counts()
-
-            # go product by product and then month by month to fill in the data one column at a time
-            for product in ["Potato", "Onion", "Tomato", "Brinjal", "Cabbage"]:
-                # get a dataframe of what's available each month and a list to hold the data
-                seasonal_year = seasonality.loc[product, 'Jan':'Dec']
-                produce_production = []
-
-                for month in months:
-                    # figure out if peak/lean/off and only do production calculations if peak/lean, get month sales
-                    availability = seasonal_year[month]
-                    daily_production = 0.0
-                    month_index = months.index(month) + 1
-                    monthly_market_days = sale_days_by_month[month_index]
-
-                    if availability != 'off':
-                        # then grab the total production per month and prune it down for the single market & day
-                        production_column = "{}_{}".format(product, availability)
-                        production_per_month = village_production[production_column].values[0]
-                        daily_production_fraction = 1 / (villages_per_block[block] * monthly_market_days)
-                        daily_production = daily_production_fraction * production_per_month * multiplying_factor
-
-                    # and now we append the value some X times based on how many days this month the market is running
-                    produce_production.append([daily_production] * monthly_market_days)
-
-                # flatten the nested list into something we can incorporate into the village's manifest
-                flat_production = [item for monthly in produce_production for item in monthly]
-                factory_manifest[product] = flat_production
-
-        # set the Route_ID and then append to list of manifests
-        factory_manifest['RouteId'] = 'wh2' + village.Location_ID[1:] + "_vm" + village.Location_ID
-        factory_manifests.append(factory_manifest)
-        print("complete: {}, {} of {}".format(village.Village_Name, progress+1, len(villages)))
-        progress += 1
-
-    # Now we add Aiginia Imports to the manifest using a daily market schedule and the same algorithm as before.
-    import_days = year
-    import_production = block_production.loc[block_production['Combo'] == "Aiginia_Imports"]
-    import_manifest = pd.DataFrame(columns=manifest_columns)
-    import_manifest['StartDay'] = import_days["Start_Days"]
-    import_manifest['EndDay'] = import_days["End_Days"]
-    import_manifest['Month'] = import_days["Month"]
-
-    # get breakdowns of number of village market days by month
-    import_days_by_month = import_days['Month'].value_counts()
-
-    # go product by product and then month by month to fill in the data one column at a time
-    for product in ["Potato", "Onion", "Tomato", "Brinjal", "Cabbage"]:
-        # get a dataframe of what's available each month and a list to hold the data
-        seasonal_year = seasonality.loc[product, 'Jan':'Dec']
-        produce_production = []
-
-        for month in months:
-            # figure out if peak/lean/off and get month sales
-            availability = seasonal_year[month]
-            month_index = months.index(month) + 1
-            monthly_market_days = import_days_by_month[month_index]
-
-            # then grab the total production per month and prune it down for the single market & day
-            # unlike with the block production, we're calculating regardless of peak/lean/off
-            production_column = "{}_{}".format(product, availability)
-            production_per_month = import_production[production_column].values[0]
-            daily_production_fraction = 1 / monthly_market_days  # Only one importing location!
-            daily_production = daily_production_fraction * production_per_month
-
-            # and now we append the value some X times based on how many days this month the market is running
-            produce_production.append([daily_production] * monthly_market_days)
-
-        # flatten the nested list into something we can incorporate into the village's manifest
-        flat_production = [item for monthly in produce_production for item in monthly]
-        import_manifest[product] = flat_production
-
-    # set the Route_ID and then append to list of manifests
-    import_manifest['RouteId'] = 'f10000001_wm71905002'
-    factory_manifests.append(import_manifest)
-
-    # consolidate list of manifests, set notes to blank string, and write to file
-    manifest = pd.concat(factory_manifests, ignore_index=True)
-    manifest['Notes'] = ''
-    manifest = manifest.drop(columns=['Month'])
-    manifest.to_csv('odisha_manifest{}.csv'.format(scenario), index=False)
+    # The daily amounts are worked out once, then scaled for this run or for each scenario.
+    calendars = get_market_calendars()
+    shipping, village_production = get_village_production(villages, block_production, seasonality, 1.0, calendars)
+    import_production = get_import_production(block_production, seasonality, calendars)
+
+    # Now we add Aiginia Imports to the manifest using a daily market schedule, after all of the villages.
+    route_ids, weekly_market, districts = get_manifest_routes(villages, shipping)
+
+    if scenarios is None:
+        daily_production = np.concatenate([village_production * multiplying_factor, import_production])
+        rows = write_manifest('odisha_manifest{}.csv'.format(scenario), route_ids, weekly_market, daily_production,
+                              calendars, compression)
+        print("Manifest: {} of {} villages shipping, {} rows".format(shipping.sum(), len(villages), rows))
+        save_copies(scenario, route_ids, weekly_market, daily_production, districts, calendars, save_runs, save_store)
+        return
+
+    # Otherwise write one manifest (and runs/store) per scenario in parallel, plus the list of scenarios and their
+    # total tonnage. The market days of the manifest rows (and of the store's rows) are laid out once, up front, and
+    # handed to each worker process along with the rest of the shared inputs.
+    store_days = None
+    if save_store:
+        store_days = ManifestDays.for_routes(weekly_market[ManifestStore.get_route_order(districts)], calendars)
+    shared_inputs = {
+        'scenarios': scenarios,
+        'route_ids': route_ids,
+        'weekly_market': weekly_market,
+        'districts': districts,
+        'village_production': village_production,
+        'import_production': import_production,
+        'calendars': calendars,
+        'days': ManifestDays.for_routes(weekly_market, calendars),
+        'store_days': store_days,
+        'compression': compression,
+        'save_runs': save_runs,
+        'save_store': save_store,
+    }
+    with ProcessPoolExecutor(workers, initializer=set_scenario_inputs, initargs=(shared_inputs,)) as executor:
+        tonnage = list(executor.map(write_scenario, range(len(scenarios))))
+
+    summary = scenarios.copy()
+    for product, column in enumerate(PRODUCTS):
+        summary[column + '_Tons'] = [scenario_tonnage[product] for scenario_tonnage in tonnage]
+    summary['Total_Tons'] = [scenario_tonnage.sum() for scenario_tonnage in tonnage]
+    summary.to_csv('manifest_scenarios.csv', index=False)
+    print("Manifests: {} scenarios, {} of {} villages shipping".format(len(scenarios), shipping.sum(), len(villages)))
+
+
+def set_scenario_inputs(shared_inputs):
+    """Keeps the inputs shared by every scenario in a worker process, so they're only sent to it once."""
+    _scenario_inputs.update(shared_inputs)
+
+
+def write_scenario(position):
+    """
+    Writes the manifest (and runs/store, if asked for) of the scenario at the given position in the shared scenarios,
+        returning its total tonnage of each product.
+    """
+    inputs = _scenario_inputs
+    scenario = inputs['scenarios'].iloc[position]
+    multipliers = get_scenario_multipliers(scenario, inputs['districts'][:-1])
+    daily_production = np.concatenate([inputs['village_production'] * multipliers, inputs['import_production']])
+    write_manifest('odisha_manifest_{}.csv'.format(scenario.Scenario), inputs['route_ids'], inputs['weekly_market'],
+                   daily_production, inputs['calendars'], inputs['compression'], days=inputs['days'])
+    save_copies('_' + scenario.Scenario, inputs['route_ids'], inputs['weekly_market'], daily_production,
+                inputs['districts'], inputs['calendars'], inputs['save_runs'], inputs['save_store'],
+                inputs['store_days'])
+    return get_tonnage(inputs['weekly_market'], daily_production, inputs['calendars'])
+
+
+def save_copies(scenario, route_ids, weekly_market, daily_production, districts, calendars, save_runs, save_store,
+                store_days=None):
+    """Saves the run-length encoded copy and/or the route store of a manifest, if asked for."""
+    if save_runs:
+        ManifestRuns.from_production(route_ids, weekly_market, daily_production, calendars).save(
+            'odisha_manifest{}.npz'.format(scenario))
+    if save_store:
+        ManifestStore.build('odisha_manifest{}_store'.format(scenario), route_ids, weekly_market, daily_production,
+                            districts, calendars, days=store_days)
 
 
 if __name__ == '__main__':
@@ -171,6 +142,13 @@ if __name__ == '__main__':
                         help='The path to the input csv file of block production amounts.')
     parser.add_argument('seasonality_file', type=str,
                         help='The path to the input csv file of seasonal produce availability.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the manifest file.')
+    parser.add_argument('--runs', action='store_true', help='Also save a run-length encoded copy of the manifest.')
+    parser.add_argument('--store', action='store_true', help='Also save the manifest as a store indexed by route.')
+    parser.add_argument('--multipliers', type=float, nargs='+', help='Production multipliers to sweep.')
+    parser.add_argument('--per_product', action='store_true', help='Sweep the multipliers for each product in turn.')
+    parser.add_argument('--districts', type=str, nargs='+', help='Sweep the multipliers for each of these districts.')
+    parser.add_argument('--workers', type=int, help='Worker processes for writing scenario manifests.')
     args = parser.parse_args()
 
     villages = pd.read_csv(
@@ -185,22 +163,27 @@ if __name__ == '__main__':
             'Latitude': float,
         }
     )
-    block_production = pd.read_csv(
-        args.block_production_file,
-        dtype={
-            'District_Name': str,
-            'Block_Name': str,
-            'Search': str,
-            'Potato_Tons': float,
-            'Onion_Tons': float,
-            'Tomato_Tons': float,
-            'Cabbage_Tons': float,
-            'Brinjal_Tons': float,
-        },
-    )
+    block_production = pd.read_csv(args.block_production_file, dtype=BLOCK_PRODUCTION_DTYPES)
     seasonality = pd.read_csv(
         args.seasonality_file,
         index_col=0,
     )
 
-    main(villages, block_production, seasonality)
+    production_scenarios = None
+    if args.multipliers:
+        production_scenarios = get_production_scenarios(
+            args.multipliers,
+            PRODUCTS if args.per_product else None,
+            args.districts,
+        )
+
+    main(
+        villages,
+        block_production,
+        seasonality,
+        args.compression,
+        args.runs,
+        args.store,
+        production_scenarios,
+        args.workers,
+    )
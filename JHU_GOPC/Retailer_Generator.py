@@ -1,13 +1,14 @@
 import argparse
-import math
 import numpy as np
 import os
 import pandas as pd
-import random
 import shapefile as sf
-from shapely import geometry
 
-from utils import compute_distance as haversine
+from block_resolver import BlockRaster, BlockResolver
+from combo_lookup import ComboIndex
+from location_ids import allocate_location_ids, match_existing_ids, zero_pad
+from retailer_data_collector import GridLocator
+from utils import GeoPoints, NearestIndex
 
 ''' This code generates a list of retailers within a given radius from a given center point. 
     For example: 60km radius from the city of Bhadrak (lat and lon) in Odisha.
@@ -23,6 +24,10 @@ from utils import compute_distance as haversine
         - Periurban areas are given 1 retailer per 600 people.
         - Urban areas are given 1 retailer per 400 people. 
 
+    Locations within each pixel are drawn from numpy's random Generator. They follow the same distribution as in
+    earlier versions of this script, but the values (and the Blocks and closest wholesalers that depend on them) differ
+    from retailers files made by those versions, and runs are only reproducible with --seed.
+
     NOTE: Cities aren't included in our data, only villages, so I've included a sample arguments below.     
     Bhadrak Centerpoint: 21.0583 86.4658 34.0
     Bhadrak Snapshot Bounds: 
@@ -38,6 +43,11 @@ from utils import compute_distance as haversine
     block_shapes -- Shapefile for Odisha divided on the Block level. 
     block_names -- CSV file containing data-to-shapefile translations for Districts/Blocks. 
     codebook -- CSV file containing corresponding codes for Blocks/Districts within the naming convention. 
+    --seed -- Seed for the random placement of retailers, for reproducible runs.
+    --block_raster -- Pixel size (in degrees) for rasterising the blocks, which speeds up assigning Blocks/Districts
+        to very large numbers of retailers. The raster is cached in block_raster_cache/ for later runs.
+    --previous -- Retailers CSV from an earlier run (e.g. with the same seed), whose retailers keep their IDs and
+        Names, with new retailers numbered after them.
 
     Output: 
     retailers.csv -- CSV containing a retailer's name, location, closest wholesaler and its distance, urbanicity, and
@@ -46,241 +56,143 @@ from utils import compute_distance as haversine
     '''
 
 
-def get_retailer_closest_wholesalers(retailer, wholesalers):
-    # Shamelessly pulled from the GeoRasterViewer code because it works really well.
+# Columns identifying the same retailer between runs.
+RETAILER_KEYS = ['District', 'Block', 'Latitude', 'Longitude', 'Urbanicity']
 
-    # Convert the wholesalers into arrays of lats/lons.
-    wholesale_lats = wholesalers.Latitude.values
-    wholesale_lons = wholesalers.Longitude.values
-    wholesale_names = wholesalers.Wholesale_Name.values
-    wholesale_ids = wholesalers.Location_ID.values
 
-    # Calculate the distances and prune out the farther ones and isolate variables.
-    distances = np.ndarray.flatten(haversine(retailer[0], retailer[1], wholesale_lats, wholesale_lons))
-    closest_index = np.argmin(distances)
-    closest_distance = distances[closest_index]
+def get_closest_wholesalers(lats, lons, wholesalers, wholesale_index):
+    # Look up every retailer's closest wholesaler in one batched query against the prebuilt spatial index.
+    distances, closest_indices = wholesale_index.nearest(lats, lons)
 
-    # Consolidate into a dictionary and return
+    # Consolidate into a dictionary of columns and return
     closest = {
-        "Wholesaler": [wholesale_lats[closest_index], wholesale_lons[closest_index]],
-        "Wholesaler_Name": wholesale_names[closest_index],
-        "Wholesaler_ID": wholesale_ids[closest_index],
-        "Distance": closest_distance
+        "Closest_Wholesaler": np.column_stack([
+            wholesalers.Latitude.values[closest_indices],
+            wholesalers.Longitude.values[closest_indices],
+        ]).tolist(),
+        "Wholesaler_Name": wholesalers.Wholesale_Name.values[closest_indices],
+        "Wholesaler_ID": wholesalers.Location_ID.values[closest_indices],
+        "Distance": distances,
     }
     return closest
 
 
-def main(villages, file_name, aggregate, wholesalers, block_shapes, shapefile_conversion, codes):
-    retail_labels = ["ID", "Name", "Block", "District", "Latitude", "Longitude", "Urbanicity",
-                     "Closest_Wholesaler", "Wholesaler_Name", "Wholesaler_ID", "Distance"]
-    urban_list = []
-    periurban_list = []
-    rural_list = []
+def place_retailers(pixels, num_stores, urbanicity, wholesalers, wholesale_index, rng):
+    """
+    Generates num_stores[i] retailers at random locations within each pixel i of the aggregation, all at once.
+    Pixel bounds are expanded to one entry per retailer, every coordinate is drawn in a single call to the random
+        number generator, and the closest wholesalers are found in a single batched query.
+    """
+    num_stores = np.asarray(num_stores, dtype=int)
+    lat_lower = np.repeat(pixels['Lat_Lower'].values, num_stores)
+    lat_upper = np.repeat(pixels['Lat_Upper'].values, num_stores)
+    lon_lower = np.repeat(pixels['Lon_Lower'].values, num_stores)
+    lon_upper = np.repeat(pixels['Lon_Upper'].values, num_stores)
+
+    # Randomly generate retailer coords within area boundaries
+    coords = rng.uniform(
+        np.column_stack([lat_lower, lon_lower]),
+        np.column_stack([lat_upper, lon_upper]),
+    )
+    lats = coords[:, 0]
+    lons = coords[:, 1]
+
+    retailers = pd.DataFrame({
+        "ID": "",
+        "Name": "",
+        "Block": "",
+        "District": "",
+        "Latitude": lats,
+        "Longitude": lons,
+        "Urbanicity": urbanicity,
+    }, index=pd.RangeIndex(len(lats)))
+    if len(lats) > 0:
+        for column, values in get_closest_wholesalers(lats, lons, wholesalers, wholesale_index).items():
+            retailers[column] = values
+    else:
+        for column in ["Closest_Wholesaler", "Wholesaler_Name", "Wholesaler_ID", "Distance"]:
+            retailers[column] = []
+    return retailers
+
+
+def main(villages, file_name, aggregate, wholesalers, block_shapes, shapefile_conversion, codes, seed=None,
+         block_raster_size=None, previous=None):
+    rng = np.random.default_rng(seed)
     aggregate['has_retailer'] = False
 
+    # Every retailer is paired with its closest wholesaler, so index the wholesalers once up front.
+    wholesale_index = NearestIndex(GeoPoints.from_frame(wholesalers))
+
     # PART ONE: GENERATE RETAILERS BY URBANICITY
-    # First let's handle the Urban locations
+    # First let's handle the Urban locations, creating a retailer for every 350 people.
     urban = aggregate.loc[aggregate["Density"] == 3]
     urban_pop = urban["Population"].sum()
-    for i, row in enumerate(urban.itertuples(), 0):
-        # Create a retailer for every 350 people
-        num_stores = math.floor(row.Population / 350)
-        for store in range(num_stores):
-            # Randomly generate retailer coords within area boundaries
-            lat = random.uniform(row.Lat_Lower, row.Lat_Upper)
-            lon = random.uniform(row.Lon_Lower, row.Lon_Upper)
-
-            closest = get_retailer_closest_wholesalers([lat, lon], wholesalers)
-            urban_list.append(["", "", "", "", lat, lon, 3, closest["Wholesaler"],
-                               closest["Wholesaler_Name"], closest["Wholesaler_ID"], closest["Distance"], ])
-
-    # Create dataframe and set population as mean across urban residents
-    urban_retailers = pd.DataFrame(urban_list, columns=retail_labels)
+    urban_stores = np.floor(urban["Population"].values / 350)
+    urban_retailers = place_retailers(urban, urban_stores, 3, wholesalers, wholesale_index, rng)
+
+    # Set population as mean across urban residents
     urban_retailers["Population_Served"] = urban_pop / len(urban_retailers.index)
 
-    # Next are the Periurban locations
+    # Next are the Periurban locations, also with a retailer for every 350 people.
     periurban = aggregate.loc[aggregate["Density"] == 2]
     periurban_pop = periurban["Population"].sum()
-    for i, row in enumerate(periurban.itertuples(), 0):
-        # Create a retailer for every 350 people
-        num_stores = math.floor(row.Population / 350)
-        for store in range(num_stores):
-            # Randomly generate retailer coords within area boundaries
-            lat = random.uniform(row.Lat_Lower, row.Lat_Upper)
-            lon = random.uniform(row.Lon_Lower, row.Lon_Upper)
-
-            closest = get_retailer_closest_wholesalers([lat, lon], wholesalers)
-            periurban_list.append(["", "", "", "", lat, lon, 2, closest["Wholesaler"],
-                                   closest["Wholesaler_Name"], closest["Wholesaler_ID"], closest["Distance"], ])
-
-    # Create dataframe and set population as mean across periurban residents
-    periurban_retailers = pd.DataFrame(periurban_list, columns=retail_labels)
+    periurban_stores = np.floor(periurban["Population"].values / 350)
+    periurban_retailers = place_retailers(periurban, periurban_stores, 2, wholesalers, wholesale_index, rng)
+
+    # Set population as mean across periurban residents
     periurban_retailers["Population_Served"] = periurban_pop / len(periurban_retailers.index)
 
     # Last are the Rural locations, where there's one retailer per 400 people OR one per village market in the region.
     rural = aggregate.loc[aggregate["Density"] == 1]
     rural_pop = rural["Population"].sum()
 
-    # First we add one rural retailer for each rural village.
-    for i, village in enumerate(villages.itertuples(), 0):
-        # Find the corresponding rural block, ignoring if a village is beyond the blocky bounds of the grid. (Rare)
-        valid_up = village.Longitude <= rural['Lon_Upper'].max()
-        valid_down = rural['Lon_Lower'].min() <= village.Longitude
-        valid_left = rural['Lat_Lower'].min() <= village.Latitude
-        valid_right = village.Latitude <= rural['Lat_Upper'].max()
-        in_bounds = valid_up and valid_down and valid_left and valid_right
-
-        # An empty row indicates a village isn't contained within a rural area.
-        row = rural.loc[
-            (rural['Lat_Lower'] <= village.Latitude)
-            & (village.Latitude <= rural['Lat_Upper'])
-            & (rural['Lon_Lower'] <= village.Longitude)
-            & (village.Longitude <= rural['Lon_Upper'])
-            ]
-
-        # Add the retailer's information to a the list if it's rural and within the region.
-        if in_bounds and not row.empty:
-            # Create a retailer within that block
-            lat = random.uniform(row['Lat_Lower'].values[0], row['Lat_Upper'].values[0])
-            lon = random.uniform(row['Lon_Lower'].values[0], row['Lon_Upper'].values[0])
-
-            closest = get_retailer_closest_wholesalers([lat, lon], wholesalers)
-            rural_list.append(["", "", "", "", lat, lon, 1, closest["Wholesaler"],
-                               closest["Wholesaler_Name"], closest["Wholesaler_ID"], closest["Distance"], ])
-            row_index = row.index.values.astype(int)[0]
-            rural.loc[row_index, "has_retailer"] = True
-
-    # Then we add one retailer for each rural pixel at or above the population cutoff.
-    for i, row in enumerate(rural.itertuples(), 0):
-        # If the pixel hasn't had a retailer assigned to it, assign one per 400 people.
-        if not row.has_retailer:
-            num_stores = math.floor(row.Population / 400)
-            for store in range(num_stores):
-                # Randomly generate retailer coords within area boundaries
-                lat = random.uniform(row.Lat_Lower, row.Lat_Upper)
-                lon = random.uniform(row.Lon_Lower, row.Lon_Upper)
-
-                closest = get_retailer_closest_wholesalers([lat, lon], wholesalers)
-                rural_list.append(["", "", "", "", lat, lon, 1, closest["Wholesaler"],
-                                   closest["Wholesaler_Name"], closest["Wholesaler_ID"], closest["Distance"], ])
-
-    # Create dataframe and set population as mean across rural residents, and combine all three urbanicities!
-    rural_retailers = pd.DataFrame(rural_list, columns=retail_labels)
+    # First we add one rural retailer for each rural village, so find the pixel holding each village by its lat/lon.
+    # Villages beyond the blocky bounds of the grid (rare) or within non-rural pixels are ignored.
+    locator = GridLocator(aggregate)
+    village_positions = locator.locate(villages['Latitude'].values, villages['Longitude'].values)
+    village_positions = village_positions[village_positions >= 0]
+    village_positions = village_positions[aggregate['Density'].values[village_positions] == 1]
+    village_pixels = aggregate.index.values[village_positions]
+
+    # Create a retailer within each of those pixels, and mark that they've been given one.
+    village_retailers = place_retailers(
+        rural.loc[village_pixels], np.ones(len(village_pixels)), 1, wholesalers, wholesale_index, rng)
+    rural.loc[village_pixels, "has_retailer"] = True
+
+    # Then we add one retailer per 400 people for each rural pixel that hasn't had a retailer assigned to it.
+    rural_stores = np.where(rural["has_retailer"].values, 0, np.floor(rural["Population"].values / 400))
+    pixel_retailers = place_retailers(rural, rural_stores, 1, wholesalers, wholesale_index, rng)
+
+    # Set population as mean across rural residents, and combine all three urbanicities!
+    rural_retailers = pd.concat([village_retailers, pixel_retailers], ignore_index=True)
     rural_retailers["Population_Served"] = rural_pop / len(rural_retailers.index)
     retailers = pd.concat([urban_retailers, periurban_retailers, rural_retailers], ignore_index=True, sort=False)
 
     # PART TWO: Generate Blocks and Districts for each retailer.
-    # First we generate the Records(data) and Shapes(coordinates), as well as dicts to hold data.
-    block_rec = block_shapes.records()
-    block_list = block_shapes.shapes()
-    block_dict = {}
-    block_externals = {}
-
-    # Then we go through each Shape and Record and toss the data into the DataFrame or dictionaries.
-    for shape, rec in zip(block_list, block_rec):
-        block_name = rec[5]
-        district_name = rec[3]
-        combo = district_name + "_" + block_name
-
-        poly = geometry.Polygon([p for p in shape.points])
-        poly_ext = geometry.LinearRing(poly.exterior.coords)
-        block_dict[combo] = poly
-        block_externals[combo] = poly_ext
-
-    # Loop through all retailers and pair each with its corresponding block and district.
-    blocks = []
-    districts = []
-    block_misspelling = shapefile_conversion['Shape_Block'].tolist()
-    district_misspelling = shapefile_conversion['Shape_Dist'].tolist()
-    for retailer in retailers.itertuples():
-        # We need Lat/Lon of the retailer, formatted specifically as Lon/Lat.
-        latitude = retailer.Latitude
-        longitude = retailer.Longitude
-        pinpoint = geometry.Point(float(longitude), float(latitude))
-
-        # Now we loop through the shapes until we find one that the point is within.
-        for shape in block_dict.keys():
-            if block_externals[shape].contains(pinpoint):
-                divisions = shape.split("_")
-                district_name = divisions[0]
-                block_name = divisions[1]
-
-                # If District isn't viable, find its equivalent name:
-                if district_name in district_misspelling:
-                    for mismatch in shapefile_conversion.itertuples():
-                        if district_name == mismatch.Shape_Dist:
-                            district_name = mismatch.Data_Dist
-                # If Block isn't viable, find its equivalent name:
-                if block_name in block_misspelling:
-                    for mismatch in shapefile_conversion.itertuples():
-                        if block_name == mismatch.Shape_Block:
-                            block_name = mismatch.Data_Block
-
-                # Then append both to the corresponding lists and break out.
-                blocks.append(block_name)
-                districts.append(district_name)
-                break
-
-        # Now we use a for-else to handle if we don't have a match within any of the block polygons.
-        # In this case, we match our point to the block with the closest external/border ring.
-        else:
-            # We create a dummied point and block/district to hold and update data.
-            closest_point = geometry.Point(0, 0)
-            found_block = ""
-            found_district = ""
-
-            # Loop through the blocks and figure out which external point is closest to our retailer.
-            for shape in block_externals.keys():
-                # Get the coordinate of the closest point of a given block outline.
-                exterior = block_externals[shape]
-                projection = exterior.project(pinpoint)
-                iter_nearest = exterior.interpolate(projection)
-
-                # Compare and update if closer than saved point/block data.
-                if pinpoint.distance(closest_point) > pinpoint.distance(iter_nearest):
-                    divisions = shape.split("_")
-                    closest_point = iter_nearest
-                    found_block = divisions[1]
-                    found_district = divisions[0]
-
-            # If District/Block isn't viable, find their equivalents:
-            if found_district in district_misspelling:
-                for mismatch in shapefile_conversion.itertuples():
-                    if found_district == mismatch.Shape_Dist:
-                        found_district = mismatch.Data_Dist
-
-            if found_block in block_misspelling:
-                for mismatch in shapefile_conversion.itertuples():
-                    if found_block == mismatch.Shape_Block:
-                        found_block = mismatch.Data_Block
-
-            # Then we append both found names to the list.
-            blocks.append(found_block)
-            districts.append(found_district)
+    # Every retailer is resolved against the block polygons in one bulk query, which also converts the shapefile's
+    # District/Block spellings into ours.
+    # Optionally, the blocks are rasterised (and cached) first so most retailers are resolved by a single array lookup.
+    resolver = BlockResolver.from_reader(block_shapes, shapefile_conversion)
+    if block_raster_size is not None:
+        resolver = BlockRaster.for_bounds(resolver, block_raster_size)
+    districts, blocks = resolver.resolve(retailers['Latitude'].values, retailers['Longitude'].values)
 
     # PART THREE: Save Blocks/Districts before doing lookups for ID Code generation
     retailers['Block'] = blocks
     retailers['District'] = districts
 
+    # Now we assign the full code, 9 (retailer) + dist/block codes + 3 digits for index, and name each retailer after
+    # its block and index. Retailers from a previous run keep their IDs.
     retailers['code'] = retailers.District + "_" + retailers.Block
-    for code in retailers.groupby('code').groups.items():
-        # Set index to 1 and isolate dist_block codes and indices of relevant wholesales.
-        index = 1
-        unique_code = code[0]
-        retailers_with_code = list(code[1])
-
-        # Access the ID directory and get the four digits code set up.
-        combo = codes.loc[codes["Combo"] == unique_code]
-        district_code = combo.iloc[0]['District_Code']
-        block_code = combo.iloc[0]['Block_Code']
-        block = combo.iloc[0]['Block']
-
-        # Now we assign the full code, 7 (wholesale market) + dist/block codes + 3 digits for index.
-        for retailers_index in retailers_with_code:
-            full_id = '9{:02}{:02}{:03}'.format(district_code, block_code, index)
-            retailers.loc[retailers_index, 'ID'] = full_id
-            retailers.loc[retailers_index, 'Name'] = "{}_{:03}".format(block, index)
-            index = index + 1
+    existing_ids = reserved_ids = None
+    if previous is not None:
+        existing_ids = match_existing_ids(retailers, previous, RETAILER_KEYS, id_column='ID')
+        reserved_ids = previous['ID'].values
+    ids, numbers = allocate_location_ids(retailers['code'].values, codes, '9', existing_ids, reserved_ids)
+    has_id = numbers > 0
+    blocks = ComboIndex(codes, name='ID codebook').gather('Block', retailers['code'].values[has_id])
+    retailers.loc[has_id, 'ID'] = ids[has_id]
+    retailers.loc[has_id, 'Name'] = blocks + '_' + zero_pad(numbers[has_id], 3)
 
     # Finalize file and print breakdown by Urbanicity.
     retailers = retailers.drop(columns='code')
@@ -299,6 +211,9 @@ if __name__ == '__main__':
     parser.add_argument('block_shape', type=str, help="The path to the block shape file.")
     parser.add_argument('block_names', type=str, help="The path to the block-to-data translation file.")
     parser.add_argument('codebook', type=str, help="The path to the Location ID codebook.")
+    parser.add_argument('--seed', type=int, help="Seed for the random retailer placement, for reproducible runs.")
+    parser.add_argument('--block_raster', type=float, help="Pixel size in degrees for a cached raster of the blocks.")
+    parser.add_argument('--previous', type=str, help="The path to a retailers csv file whose IDs should be kept.")
     args = parser.parse_args()
 
     villages = pd.read_csv(
@@ -319,5 +234,9 @@ if __name__ == '__main__':
     block_data = sf.Reader(args.block_shape)
     block_fixes = pd.read_csv(args.block_names)
     codebook = pd.read_csv(args.codebook)
+    previous_retailers = pd.read_csv(args.previous, dtype={'ID': str}) if args.previous else None
 
-    main(villages, file_name, aggregate_file, wholesaler_file, block_data, block_fixes, codebook)
+    main(
+        villages, file_name, aggregate_file, wholesaler_file, block_data, block_fixes, codebook, args.seed,
+        args.block_raster, previous_retailers,
+    )
@@ -2,7 +2,14 @@ import argparse
 import numpy as np
 import pandas as pd
 
-from utils import compute_distance as haversine
+from combo_lookup import ComboIndex, make_combos
+from hermes_export import COMPRESSION_SUFFIXES, HermesWriter, get_export_path, iter_row_blocks
+from location_registry import LocationRegistry, read_location_files
+from route_tables import DEFAULT_DETOUR_INDEX, DEFAULT_TRUCK_SPEEDS_KMPH, ROUTE_COLUMNS, build_route_table
+from route_tables import get_route_scenarios, get_topology_key, iter_route_scenarios, load_topology, save_topology
+from route_tables import expand_routes, transit_hours
+from utils import GeoPoints, NearestIndex
+from wholesale_hierarchy import TIER_ONE_MESHES, get_hierarchy_links
 
 ''' This code parses a file of Odisha Villages with lat/lons, blocks, and Hermes-accessible IDs to build a network of
     bi-directional supply chain routes. Distances are augmented by a Detour Index calculated elsewhere. 
@@ -12,469 +19,244 @@ from utils import compute_distance as haversine
     wholesale_data_file -- CSV file containing data for wholesale markets within each district of Odisha, India. 
     retailer_data_file -- CSV file containing data for retailers within Odisha, India.  
     loc_id_dict -- CSV file containing location-based ID codes and route-per-VM info. 
+    --tier_one_mesh -- How Tier 1 wholesales are linked: 'full' (default, every pair), 'knn' (each one's
+        --mesh_neighbours nearest), 'delaunay' (Delaunay triangulation), or 'threshold' (within --mesh_radius km).
+        Sparse meshes print a summary of the routes saved and the distance they add.
+    --detour_indices, --speeds, --latency_scales -- Values to sweep for a transit time sensitivity analysis. Every
+        combination is a scenario; speeds are given per truck type, like --speeds 4wheel=25,30 moto=20.
+    --topology_cache -- File to keep the route topology in, so later runs on the same inputs skip rebuilding it.
 
     Output: 
     routes - CSV file containing data for each direction of a shipping route between locations. 
+    When sweeping, routes_XXX.csv is written for each scenario instead, listed in route_scenarios.csv.
     '''
 
 
-def main(villages, wholesales, retailers, loc_ids):
-    route_columns = [
-        'RouteName', 'idcode', 'LocName', 'Type', 'RouteOrder', 'TransitHours', 'DistanceKM', 'TruckType',
-        'ShipIntervalDays',
-        'PullOrderAmountDays', 'ShipLatencyDays', 'PerDiemType', 'PickupDelayFrequency', 'PickupDelayMagnitude',
-        'PickupDelaySigma', 'Conditions', 'Notes',
-    ]
-    detour_index = 1.425
-
-    # Add routes from village warehouses to village markets
-    village_routes = []
-    for village in villages.itertuples():
-        route_name = 'wh2' + village.Location_ID[1:] + "_vm" + village.Location_ID
-        start = {
-            'RouteName': route_name,
-            'idcode': '2' + village.Location_ID[1:],
-            'LocName': 'wh_' + village.Village_Name,
-            'Type': 'manifestpush',
-            'RouteOrder': 0,
-            'TransitHours': 0.001,
-            'DistanceKM': 0,
-            'TruckType': 'multi',
-            'ShipLatencyDays': 0.2,
-            'ShipIntervalDays': 1,
-            'PullOrderAmountDays': 1,
-            'PerDiemType': 'Std_PerDiem_None',
-        }
-        end = {
-            'RouteName': route_name,
-            'idcode': village.Location_ID,
-            'LocName': 'vm_' + village.Village_Name,
-            'Type': 'manifestpush',
-            'RouteOrder': 1,
-            'TransitHours': 0.001,
-            'DistanceKM': 0,
-            'TruckType': 'multi',
-            'ShipLatencyDays': 0.2,
-            'ShipIntervalDays': 1,
-            'PullOrderAmountDays': 1,
-            'PerDiemType': 'Std_PerDiem_None',
-        }
-        # Make specialized changes to these for Weekly markets
-        if village.Market_Frequency == 'Weekly':
-            start['ShipIntervalDays'] = 7
-            start['PullOrderAmountDays'] = 7
-            end['ShipIntervalDays'] = 7
-            end['PullOrderAmountDays'] = 7
-        village_routes.append(start)
-        village_routes.append(end)
-    farm_to_vm_routes = pd.DataFrame(village_routes)
+def get_closest_wholesales(lats, lons, wholesales):
+    """Returns the distance to and row of each location's closest wholesale."""
+    return NearestIndex(GeoPoints.from_frame(wholesales)).nearest(lats, lons)
+
+
+def get_routes_per_vm(villages, loc_ids):
+    """
+    Returns how many times each village's route to its wholesale is created, to account for shipping quantities: the
+        village's district_block code's routes per VM in loc_ids, depending on the village's Market Frequency.
+    """
+    loc_index = ComboIndex(loc_ids, name='routes per VM')
+    village_codes = make_combos(villages['District_Name'].values, villages['Block_Name'].values)
+    return np.where(
+        (villages['Market_Frequency'] == 'Daily').values,
+        loc_index.gather('DailyRoutesPerVM', village_codes),
+        loc_index.gather('WeeklyRoutesPerVM', village_codes),
+    ).astype(int)
+
+
+def build_route_topology(villages, wholesales, retailers, loc_ids, tier_one_mesh='full', mesh_neighbours=3,
+                         mesh_radius=50.0, registry=None):
+    """
+    Returns the table of every route leg, timed with the default detour index and truck speeds. Repeated routes are
+        kept as one route with a Multiplicity, see route_tables.expand_routes(). Location IDs and names are read from
+        the registry (built from the inputs if not given).
+    """
+    if registry is None:
+        registry = LocationRegistry.from_frames(villages, wholesales, retailers)
+    sections = build_village_routes(villages, wholesales, loc_ids, registry)
+    sections.update(build_wholesale_routes(
+        wholesales, retailers, registry, tier_one_mesh, mesh_neighbours, mesh_radius))
+    return finish_routes(sections)
+
+
+def build_village_routes(villages, wholesales, loc_ids, registry):
+    """
+    Returns the sections of the routes table that start at each village (farm to village market, village market to
+        clinic, and village market to its closest wholesale), in order. Each village has two rows in each section.
+    """
+    detour_index = DEFAULT_DETOUR_INDEX
+    farm_ids = registry.ids('farm')
+    vm_ids = registry.ids('village_market')
+    vm_names = registry.names('village_market')
+    weekly = (villages['Market_Frequency'] == 'Weekly').values
+
+    # Add routes from village warehouses to village markets, with specialized changes for Weekly markets.
+    farm_to_vm_routes = build_route_table(
+        route_names='wh' + farm_ids + '_vm' + vm_ids,
+        start_ids=farm_ids,
+        start_names=registry.names('farm'),
+        end_ids=vm_ids,
+        end_names=vm_names,
+        route_type='manifestpush',
+        transit_hours=0.001,
+        distance_km=0,
+        truck_type='multi',
+        ship_latency_days=0.2,
+        ship_interval_days=np.where(weekly, 7, 1),
+        pull_order_amount_days=np.where(weekly, 7, 1),
+        per_diem_type='Std_PerDiem_None',
+    )
 
     # Add routes from village markets to village market attached clinics
-    village_to_clinic_routes = []
-    for village in villages.itertuples():
-        route_name = 'vm' + village.Location_ID + "_vc4" + village.Location_ID[1:]
-        start = {
-            'RouteName': route_name,
-            'idcode': village.Location_ID,
-            'LocName': 'vm_' + village.Village_Name,
-            'Type': 'attached',
-            'RouteOrder': 0,
-            'TransitHours': '',
-            'DistanceKM': '',
-            'TruckType': '',
-            'ShipLatencyDays': '',
-            'ShipIntervalDays': '',
-            'PullOrderAmountDays': '',
-            'PerDiemType': '',
-        }
-        end = {
-            'RouteName': route_name,
-            'idcode': '4' + village.Location_ID[1:],
-            'LocName': 'vc_' + village.Village_Name,
-            'Type': 'attached',
-            'RouteOrder': 1,
-            'TransitHours': '',
-            'DistanceKM': '',
-            'TruckType': '',
-            'ShipLatencyDays': '',
-            'ShipIntervalDays': '',
-            'PullOrderAmountDays': '',
-            'PerDiemType': '',
-        }
-        village_to_clinic_routes.append(start)
-        village_to_clinic_routes.append(end)
-    vm_to_clinic_routes = pd.DataFrame(village_to_clinic_routes)
-
-    # Add routes from villages to wholesales
-    distances = haversine(
-        villages["Latitude"].values,
-        villages["Longitude"].values,
-        wholesales["Latitude"].values,
-        wholesales["Longitude"].values
+    vm_to_clinic_routes = build_route_table(
+        route_names='vm' + vm_ids + '_vc' + registry.ids('village_clinic'),
+        start_ids=vm_ids,
+        start_names=vm_names,
+        end_ids=registry.ids('village_clinic'),
+        end_names=registry.names('village_clinic'),
+        route_type='attached',
     )
-    min_distances = np.min(distances, axis=0)
-    closest = np.argmin(distances, axis=0)
-    wholesale_names = wholesales.iloc[closest[0, :]]["Wholesale_Name"].values
-    wholesale_ids = wholesales.iloc[closest[0, :]]["Location_ID"].values
 
-    vm_to_wholesale_routes = []
-    vm_to_wholesale_data_iterator = zip(villages.itertuples(), wholesale_names, wholesale_ids, min_distances[0])
+    # Add routes from villages to wholesales, using the spatial index to find each village's closest wholesale.
+    min_distances, closest = get_closest_wholesales(
+        registry.lats('village_market'), registry.lons('village_market'), wholesales)
+    wholesale_names = registry.names('wholesale')[closest]
+    wholesale_ids = registry.ids('wholesale')[closest]
 
     # Each route must be created some X times to account for shipping quantities.
-    for village, wholesale_name, wholesale_id, distance in vm_to_wholesale_data_iterator:
-        # Find the district_block code and reference against loc_ids using village's Market Frequency.
-        village_unique_code = "{}_{}".format(village.District_Name, village.Block_Name)
-        if village.Market_Frequency == "Daily":
-            num_routes = loc_ids.loc[loc_ids['Combo'] == village_unique_code, 'DailyRoutesPerVM'].values[0]
-        else:
-            num_routes = loc_ids.loc[loc_ids['Combo'] == village_unique_code, 'WeeklyRoutesPerVM'].values[0]
-
-        # Then we loop some X number of times to create the route again and again.
-        for route_num in range(num_routes):
-            route_name = 'vm' + village.Location_ID + '_wm' + wholesale_id + '_{}'.format(route_num)
-            transit_time = round(float(distance * detour_index) / 30.0, 3)  # 30 kmph
-            if distance == 0:
-                distance = 0.001
-            if transit_time == 0:
-                transit_time == 0.001
-            start = {
-                'RouteName': route_name,
-                'idcode': village.Location_ID,
-                'LocName': 'vm_' + village.Village_Name,
-                'Type': 'schedpersistentfetch',
-                'RouteOrder': 0,
-                'TransitHours': transit_time,
-                'DistanceKM': distance,
-                'TruckType': '4wheel',
-                'ShipLatencyDays': 0.291,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            end = {
-                'RouteName': route_name,
-                'idcode': wholesale_id,
-                'LocName': 'wm_' + wholesale_name,
-                'Type': 'schedpersistentfetch',
-                'RouteOrder': 1,
-                'TransitHours': transit_time,
-                'DistanceKM': distance,
-                'TruckType': '4wheel',
-                'ShipLatencyDays': 0.291,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            # Make specialized changes to these for Weekly markets
-            if village.Market_Frequency == 'Weekly':
-                start['ShipIntervalDays'] = 7
-                start['PullOrderAmountDays'] = 7
-                end['ShipIntervalDays'] = 7
-                end['PullOrderAmountDays'] = 7
-            vm_to_wholesale_routes.append(start)
-            vm_to_wholesale_routes.append(end)
-    vm_to_wholesale_routes = pd.DataFrame(vm_to_wholesale_routes)
+    num_routes = get_routes_per_vm(villages, loc_ids)
+
+    # Each village's route is kept once, with a count of how many numbered copies to write out.
+    village_transit_hours = transit_hours(min_distances, detour_index, DEFAULT_TRUCK_SPEEDS_KMPH['4wheel'])
+    village_distances = np.where(min_distances == 0, 0.001, min_distances)
+    vm_to_wholesale_routes = build_route_table(
+        route_names='vm' + vm_ids + '_wm' + wholesale_ids,
+        start_ids=vm_ids,
+        start_names=vm_names,
+        end_ids=wholesale_ids,
+        end_names=wholesale_names,
+        route_type='schedpersistentfetch',
+        transit_hours=village_transit_hours,
+        distance_km=village_distances,
+        truck_type='4wheel',
+        ship_latency_days=0.291,
+        ship_interval_days=np.where(weekly, 7, 1),
+        pull_order_amount_days=np.where(weekly, 7, 1),
+        per_diem_type='Std_PerDiem_None',
+        transit_distance_km=min_distances,
+        multiplicity=num_routes,
+    )
+    return {
+        'farm_to_vm': farm_to_vm_routes,
+        'vm_to_clinic': vm_to_clinic_routes,
+        'vm_to_wholesale': vm_to_wholesale_routes,
+    }
+
+
+def build_wholesale_routes(wholesales, retailers, registry, tier_one_mesh='full', mesh_neighbours=3, mesh_radius=50.0):
+    """
+    Returns the sections of the routes table that start at wholesales (to their clinics, retailers, and other
+        wholesales), in order.
+    """
+    detour_index = DEFAULT_DETOUR_INDEX
 
     # Add routes from wholesales to attached clinics
-    wholesale_to_attached_clinic_routes = []
-    for wholesale in wholesales.itertuples():
-        route_name = 'wm' + wholesale.Location_ID + '_wc8' + wholesale.Location_ID[1:]
-        start = {
-            'RouteName': route_name,
-            'idcode': wholesale.Location_ID,
-            'LocName': 'wm_' + wholesale.Wholesale_Name,
-            'Type': 'attached',
-            'RouteOrder': 0,
-            'TransitHours': '',
-            'DistanceKM': '',
-            'TruckType': '',
-            'ShipLatencyDays': '',
-            'ShipIntervalDays': '',
-            'PullOrderAmountDays': '',
-            'PerDiemType': '',
-        }
-        end = {
-            'RouteName': route_name,
-            'idcode': '8' + wholesale.Location_ID[1:],
-            'LocName': 'wc_' + wholesale.Wholesale_Name,
-            'Type': 'attached',
-            'RouteOrder': 1,
-            'TransitHours': '',
-            'DistanceKM': '',
-            'TruckType': '',
-            'ShipLatencyDays': '',
-            'ShipIntervalDays': '',
-            'PullOrderAmountDays': '',
-            'PerDiemType': '',
-        }
-        wholesale_to_attached_clinic_routes.append(start)
-        wholesale_to_attached_clinic_routes.append(end)
-    wholesale_to_attached_clinic_routes = pd.DataFrame(wholesale_to_attached_clinic_routes)
+    wholesale_to_attached_clinic_routes = build_route_table(
+        route_names='wm' + registry.ids('wholesale') + '_wc' + registry.ids('wholesale_clinic'),
+        start_ids=registry.ids('wholesale'),
+        start_names=registry.names('wholesale'),
+        end_ids=registry.ids('wholesale_clinic'),
+        end_names=registry.names('wholesale_clinic'),
+        route_type='attached',
+    )
 
     # Add routes from wholesales to retailers
-    wholesale_to_retail_routes = []
-    for retailer in retailers.itertuples():
-        route_name = 'wm{}_re{}'.format(retailer.Wholesaler_ID, retailer.ID)
-        transit_time = round(float(retailer.Distance * detour_index) / 30.0, 3)  # 30 kmph
-        start = {
-            'RouteName': route_name,
-            'idcode': retailer.ID,
-            'LocName': 're_{}'.format(retailer.Name),
-            'Type': 'schedvarfetch',
-            'RouteOrder': 0,
-            'TransitHours': transit_time,
-            'DistanceKM': retailer.Distance,
-            'TruckType': 'moto',
-            'ShipLatencyDays': 0.5,
-            'ShipIntervalDays': 1,
-            'PullOrderAmountDays': 1,
-            'PerDiemType': 'Std_PerDiem_None',
-        }
-        end = {
-            'RouteName': route_name,
-            'idcode': retailer.Wholesaler_ID,
-            'LocName': 'wm_' + retailer.Wholesaler_Name,
-            'Type': 'schedvarfetch',
-            'RouteOrder': 1,
-            'TransitHours': transit_time,
-            'DistanceKM': retailer.Distance,
-            'TruckType': 'moto',
-            'ShipLatencyDays': 0.5,
-            'ShipIntervalDays': 1,
-            'PullOrderAmountDays': 1,
-            'PerDiemType': 'Std_PerDiem_None',
-        }
-        wholesale_to_retail_routes.append(start)
-        wholesale_to_retail_routes.append(end)
-    wholesale_to_retail_routes = pd.DataFrame(wholesale_to_retail_routes)
-
-    tier_ones = wholesales.loc[wholesales['Tier'] == 1]
-    tier_twos = wholesales.loc[wholesales['Tier'] == 2]
-    tier_threes = wholesales.loc[wholesales['Tier'] == 3]
-    tier_nonthrees = wholesales.loc[wholesales['Tier'] != 3]
-    wholesale_hierarchy_routes = []
-
-    # First, we need to create bidirectional routes between all Tier 1 wholesalers.
-    # Since we're doing a basic loop, each route will get two bidirectional loops.
-    for one in tier_ones.itertuples():
-        # So we get all the distances from a Tier 1 and all other Tier 1s...
-        distances = haversine(one.Latitude, one.Longitude, tier_ones["Latitude"], tier_ones["Longitude"])
-        for distance in distances:
-            # Then we loop through and build routes for each Tier 1:1 connection that has a nonzero distance.
-            where_index = np.where(distances == distance)[0][0]
-            raw_distance = distance[0][0]
-
-            # If nonzero distance, then we're not making a route from a wholesaler to itself.
-            if raw_distance != 0:
-                end_id = tier_ones.iloc[where_index]["Location_ID"]
-                end_name = tier_ones.iloc[where_index]["Wholesale_Name"]
-                route_name = 'wm{}_wm{}'.format(one.Location_ID, end_id)
-                transit_time = round(float(raw_distance * detour_index) / 30.0, 3)  # 30 kmph
-
-                start = {
-                    'RouteName': route_name,
-                    'idcode': one.Location_ID,
-                    'LocName': 'wm_{}_wm_{}'.format(one.Wholesale_Name, end_name),
-                    'Type': 'pull',
-                    'RouteOrder': 0,
-                    'TransitHours': transit_time,
-                    'DistanceKM': raw_distance,
-                    'TruckType': 'multi',
-                    'ShipLatencyDays': 0.833,
-                    'ShipIntervalDays': 1,
-                    'PullOrderAmountDays': 1,
-                    'PerDiemType': 'Std_PerDiem_None',
-                }
-                end = {
-                    'RouteName': route_name,
-                    'idcode': end_id,
-                    'LocName': 'wm_{}_wm_{}_return'.format(one.Wholesale_Name, end_name),
-                    'Type': 'pull',
-                    'RouteOrder': 1,
-                    'TransitHours': transit_time,
-                    'DistanceKM': raw_distance,
-                    'TruckType': 'multi',
-                    'ShipLatencyDays': 0.833,
-                    'ShipIntervalDays': 1,
-                    'PullOrderAmountDays': 1,
-                    'PerDiemType': 'Std_PerDiem_None',
-                }
-                wholesale_hierarchy_routes.append(start)
-                wholesale_hierarchy_routes.append(end)
-
-    # Next, each Tier 2 needs a bidirectional route with its closest Tier 1.
-    # Since we aren't dealing with a uniform subset like Tier 1-1, we manually produce both route loops.
-    for two in tier_twos.itertuples():
-        distances = haversine(two.Latitude, two.Longitude, tier_ones["Latitude"], tier_ones["Longitude"])
-        closest = np.argmin(np.ndarray.flatten(distances))
-        raw_distance = distances[closest][0][0]
-
-        # If nonzero distance, then we're not making a route from a wholesaler to itself.
-        if raw_distance != 0:
-            end_name = tier_ones.iloc[closest]['Wholesale_Name']
-            end_id = tier_ones.iloc[closest]['Location_ID']
-            route_name = 'wm{}_wm{}'.format(two.Location_ID, end_id)
-            transit_time = round(float(raw_distance * detour_index) / 30.0, 3)  # 30 kmph
-
-            # First we go from Tier 2 to Tier 1 and back.
-            start = {
-                'RouteName': route_name,
-                'idcode': two.Location_ID,
-                'LocName': 'wm_{}_wm_{}'.format(two.Wholesale_Name, end_name),
-                'Type': 'pull',
-                'RouteOrder': 0,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.833,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            end = {
-                'RouteName': route_name,
-                'idcode': end_id,
-                'LocName': 'wm_{}_wm_{}_return'.format(two.Wholesale_Name, end_name),
-                'Type': 'pull',
-                'RouteOrder': 1,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.833,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            wholesale_hierarchy_routes.append(start)
-            wholesale_hierarchy_routes.append(end)
-
-            # Now we go from Tier 1 to Tier 2 and back.
-            route_name = 'wm{}_wm{}'.format(end_id, two.Location_ID)
-            start = {
-                'RouteName': route_name,
-                'idcode': end_id,
-                'LocName': 'wm_{}_wm_{}'.format(end_name, two.Wholesale_Name),
-                'Type': 'pull',
-                'RouteOrder': 0,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.854,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            end = {
-                'RouteName': route_name,
-                'idcode': two.Location_ID,
-                'LocName': 'wm_{}_wm_{}_return'.format(end_name, two.Wholesale_Name),
-                'Type': 'pull',
-                'RouteOrder': 1,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.854,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            wholesale_hierarchy_routes.append(start)
-            wholesale_hierarchy_routes.append(end)
-
-    # Finally, each Tier 3 needs a bidirectional route with its closest Tier 1 OR 2, hence tier_nonthrees.
-    # We still manually produce both bidirectional loops.
-    for three in tier_threes.itertuples():
-        distances = haversine(three.Latitude, three.Longitude, tier_nonthrees["Latitude"], tier_nonthrees["Longitude"])
-        closest = np.argmin(np.ndarray.flatten(distances))
-        raw_distance = distances[closest][0][0]
-
-        # If nonzero distance, then we're not making a route from a wholesaler to itself.
-        if raw_distance != 0:
-            end_name = tier_nonthrees.iloc[closest]['Wholesale_Name']
-            end_id = tier_nonthrees.iloc[closest]['Location_ID']
-            route_name = 'wm_{}_wm_{}'.format(three.Location_ID, end_id)
-            transit_time = round(float(raw_distance * detour_index) / 30.0, 3)  # 30 kmph
-
-            # First we go from Tier 3 to Tier 1/2 and back.
-            start = {
-                'RouteName': route_name,
-                'idcode': three.Location_ID,
-                'LocName': 'wm_{}_wm_{}'.format(three.Wholesale_Name, end_name),
-                'Type': 'pull',
-                'RouteOrder': 0,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.833,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            end = {
-                'RouteName': route_name,
-                'idcode': end_id,
-                'LocName': 'wm_{}_wm_{}_return'.format(three.Wholesale_Name, end_name),
-                'Type': 'pull',
-                'RouteOrder': 1,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.833,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            wholesale_hierarchy_routes.append(start)
-            wholesale_hierarchy_routes.append(end)
-
-            # Now we go from Tier 1/2 to Tier 3 and back.
-            route_name = 'wm_{}_wm_{}'.format(end_id, three.Location_ID)
-            start = {
-                'RouteName': route_name,
-                'idcode': end_id,
-                'LocName': 'wm_{}_wm_{}'.format(end_name, three.Wholesale_Name),
-                'Type': 'pull',
-                'RouteOrder': 0,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.854,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            end = {
-                'RouteName': route_name,
-                'idcode': three.Location_ID,
-                'LocName': 'wm_{}_wm_{}_return'.format(end_name, three.Wholesale_Name),
-                'Type': 'pull',
-                'RouteOrder': 1,
-                'TransitHours': transit_time,
-                'DistanceKM': raw_distance,
-                'TruckType': 'multi',
-                'ShipLatencyDays': 0.854,
-                'ShipIntervalDays': 1,
-                'PullOrderAmountDays': 1,
-                'PerDiemType': 'Std_PerDiem_None',
-            }
-            wholesale_hierarchy_routes.append(start)
-            wholesale_hierarchy_routes.append(end)
-
-    wholesale_to_wholesale_routes = pd.DataFrame(wholesale_hierarchy_routes)
-
-    # Combine all routes and fill in the common column values
-    routes = pd.concat([farm_to_vm_routes,
-                        vm_to_clinic_routes,
-                        vm_to_wholesale_routes,
-                        wholesale_to_attached_clinic_routes,
-                        wholesale_to_retail_routes,
-                        wholesale_to_wholesale_routes], ignore_index=True)
+    wholesale_to_retail_routes = build_route_table(
+        route_names=('wm' + retailers['Wholesaler_ID'].astype(str)).values + '_re' + registry.ids('retailer'),
+        start_ids=registry.ids('retailer'),
+        start_names=registry.names('retailer'),
+        end_ids=retailers['Wholesaler_ID'].values,
+        end_names=('wm_' + retailers['Wholesaler_Name']).values,
+        route_type='schedvarfetch',
+        transit_hours=transit_hours(retailers['Distance'].values, detour_index, DEFAULT_TRUCK_SPEEDS_KMPH['moto']),
+        distance_km=retailers['Distance'].values,
+        truck_type='moto',
+        ship_latency_days=0.5,
+        ship_interval_days=1,
+        pull_order_amount_days=1,
+        per_diem_type='Std_PerDiem_None',
+        transit_distance_km=retailers['Distance'].values,
+    )
+
+    # Add routes between tiers of wholesales: a full mesh between Tier 1s, then each Tier 2 with its closest Tier 1 and
+    # each Tier 3 with its closest Tier 1 or 2, in both directions. The Tier 1 mesh can optionally be made sparse.
+    hierarchy, mesh_summary = get_hierarchy_links(
+        wholesales, GeoPoints.from_frame(wholesales), tier_one_mesh, mesh_neighbours, mesh_radius
+    )
+    if mesh_summary is not None:
+        print("Tier 1 {} mesh: {} routes instead of {} ({} saved), adding at most {:.3f} km ({:.2f}x) to any trip "
+              "between Tier 1s. {} pairs of Tier 1s can't reach each other.".format(
+                  tier_one_mesh,
+                  mesh_summary['Sparse_Mesh_Routes'],
+                  mesh_summary['Full_Mesh_Routes'],
+                  mesh_summary['Routes_Saved'],
+                  mesh_summary['Max_Added_Hop_KM'],
+                  mesh_summary['Max_Hop_Ratio'],
+                  mesh_summary['Unreachable_Pairs'],
+              ))
+    hierarchy_names = 'wm_' + hierarchy['Start_Name'] + '_wm_' + hierarchy['End_Name']
+    wholesale_to_wholesale_routes = build_route_table(
+        route_names=hierarchy['Route'].values,
+        start_ids=hierarchy['Start_ID'].values,
+        start_names=hierarchy_names.values,
+        end_ids=hierarchy['End_ID'].values,
+        end_names=(hierarchy_names + '_return').values,
+        route_type='pull',
+        transit_hours=transit_hours(hierarchy['Distance'].values, detour_index, DEFAULT_TRUCK_SPEEDS_KMPH['multi']),
+        distance_km=hierarchy['Distance'].values,
+        truck_type='multi',
+        ship_latency_days=hierarchy['Latency'].values,
+        ship_interval_days=1,
+        pull_order_amount_days=1,
+        per_diem_type='Std_PerDiem_None',
+        transit_distance_km=hierarchy['Distance'].values,
+    )
+    return {
+        'wholesale_to_clinic': wholesale_to_attached_clinic_routes,
+        'wholesale_to_retail': wholesale_to_retail_routes,
+        'wholesale_to_wholesale': wholesale_to_wholesale_routes,
+    }
+
+
+def finish_routes(sections):
+    """Combines the sections of the routes table, in order, and fills in the common column values."""
+    routes = pd.concat(list(sections.values()), ignore_index=True)
     routes['PickupDelayFrequency'] = ''
     routes['PickupDelayMagnitude'] = ''
     routes['PickupDelaySigma'] = ''
     routes['Conditions'] = ''
     routes['Notes'] = ''
-    routes[route_columns].to_csv('routes.csv', index=False)
+    return routes
+
+
+def write_routes(routes, path, compression=None, routes_per_chunk=50000):
+    """Writes the routes file, expanding the repeated routes (see expand_routes) a block of routes at a time."""
+    with HermesWriter(get_export_path(path, compression), ROUTE_COLUMNS, compression) as writer:
+        # Each route is a start and end leg, so blocks must hold whole pairs of rows.
+        for block in iter_row_blocks(routes, 2 * routes_per_chunk, step=2):
+            writer.write(expand_routes(block))
+
+
+def main(villages, wholesales, retailers, loc_ids, tier_one_mesh='full', mesh_neighbours=3, mesh_radius=50.0,
+         scenarios=None, topology_cache=None, compression=None, registry=None):
+    # The route topology only depends on the inputs, so it can be reused between runs (e.g. sensitivity sweeps).
+    topology_key = get_topology_key(
+        villages, wholesales, retailers, loc_ids,
+        tier_one_mesh=tier_one_mesh, mesh_neighbours=mesh_neighbours, mesh_radius=mesh_radius,
+    )
+    routes = load_topology(topology_cache, topology_key)
+    if routes is None:
+        routes = build_route_topology(
+            villages, wholesales, retailers, loc_ids, tier_one_mesh, mesh_neighbours, mesh_radius, registry
+        )
+        if topology_cache is not None:
+            save_topology(topology_cache, topology_key, routes)
+
+    if scenarios is None:
+        write_routes(routes, 'routes.csv', compression)
+        return
+
+    # Otherwise write one routes file per scenario, plus the list of scenarios.
+    scenarios.to_csv('route_scenarios.csv', index=False)
+    for scenario, scenario_routes in iter_route_scenarios(routes, scenarios):
+        write_routes(scenario_routes, 'routes_{}.csv'.format(scenario.Scenario), compression)
 
 
 if __name__ == '__main__':
@@ -486,31 +268,42 @@ if __name__ == '__main__':
                         help='The path to the input csv file of the retailer data.')
     parser.add_argument('loc_id_file', type=str,
                         help='The path to the csv file containing location-based ID codes and route-per-VM info.')
+    parser.add_argument('--tier_one_mesh', type=str, default='full', choices=TIER_ONE_MESHES,
+                        help='How to link Tier 1 wholesales with each other.')
+    parser.add_argument('--mesh_neighbours', type=int, default=3, help='Nearest Tier 1s to link in the knn mesh.')
+    parser.add_argument('--mesh_radius', type=float, default=50.0, help='Max km between linked Tier 1s for threshold.')
+    parser.add_argument('--detour_indices', type=float, nargs='+', help='Detour indices to sweep.')
+    parser.add_argument('--speeds', type=str, nargs='+', help='Truck speeds to sweep, as truck_type=kmph,kmph,...')
+    parser.add_argument('--latency_scales', type=float, nargs='+', help='Multipliers of ShipLatencyDays to sweep.')
+    parser.add_argument('--topology_cache', type=str, help='Path of a file for caching the route topology.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the routes files.')
     args = parser.parse_args()
 
-    villages = pd.read_csv(
-        args.village_data_file,
-        dtype={
-            'Location_ID': str,
-            'Village_Name': str,
-            'District_Name': str,
-            'Block': str,
-            'Market_Frequency': str,
-            'Longitude': float,
-            'Latitude': float,
-        }
-    )
-    wholesales = pd.read_csv(
-        args.wholesale_data_file,
-        dtype={
-            'Location_ID': str,
-            'Wholesale_Name': str,
-            'District_Name': str,
-            'Longitude': float,
-            'Latitude': float,
-        }
-    )
-    retailers = pd.read_csv(args.retailer_data_file)
+    route_scenarios = None
+    if args.detour_indices or args.speeds or args.latency_scales:
+        truck_speeds = {}
+        for truck_speed in args.speeds or []:
+            truck, speeds = truck_speed.split('=')
+            truck_speeds[truck] = [float(speed) for speed in speeds.split(',')]
+        route_scenarios = get_route_scenarios(
+            args.detour_indices or [DEFAULT_DETOUR_INDEX],
+            truck_speeds,
+            args.latency_scales or [1.0],
+        )
+
+    villages, wholesales, retailers = read_location_files(
+        args.village_data_file, args.wholesale_data_file, args.retailer_data_file)
     loc_ids = pd.read_csv(args.loc_id_file)
 
-    main(villages, wholesales, retailers, loc_ids)
+    main(
+        villages,
+        wholesales,
+        retailers,
+        loc_ids,
+        args.tier_one_mesh,
+        args.mesh_neighbours,
+        args.mesh_radius,
+        route_scenarios,
+        args.topology_cache,
+        args.compression,
+    )
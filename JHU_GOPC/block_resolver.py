@@ -0,0 +1,230 @@
+import hashlib
+import numpy as np
+import os
+import shapely
+
+from geometry_cache import GEOMETRY_CACHE, BlockGeometries
+
+''' This code resolves which Odisha block (and district) each of a set of Lat/Lon points falls within, using the block
+    shapefile. It's shared by wholesale_data_collector and Retailer_Generator, which used to test every point against
+    every block polygon in turn.
+
+    All block polygons go into an STRtree, so a whole array of points is matched to its containing polygon in one bulk
+    query. Points inside no polygon (just offshore, or in a gap between two blocks) are matched to the block with the
+    nearest border instead, again in bulk. Finally, the shapefile's spellings are converted to the ones our data uses
+    with the Shape_Block/Shape_Dist -> Data_Block/Data_Dist corrections file.
+
+    For very large batches of points, BlockRaster burns the blocks onto a regular lat/lon grid (the GPW grid, or a finer
+    one) as integer labels, so most lookups are a single array index. Only points in pixels that aren't wholly inside
+    one block go back to the exact polygon tests. The labels are cached on disk, keyed by the shapefile's contents and
+    the grid, and also give GeoRasterViewer its per-block zonal statistics. Those only count pixels whose centroid lies
+    within a block, so the nearest border fallback never pulls in pixels from neighbouring states or the sea.
+    '''
+
+BLOCK_RASTER_CACHE = 'block_raster_cache'
+
+
+class BlockResolver:
+    """
+    Spatial index over the block polygons of a shapefile, for resolving points to their District and Block names.
+
+    Points exactly on a border count as outside every polygon, and so are given the block with the nearest border.
+        Where overlapping polygons (or equally near borders) match a point, the first block in the shapefile wins.
+    """
+
+    def __init__(self, polygons, districts, blocks, shapefile_conversion=None):
+        self.polygons = np.asarray(polygons, dtype=object)
+        self.exteriors = shapely.get_exterior_ring(self.polygons)
+        self.districts = np.asarray(districts, dtype=object)
+        self.blocks = np.asarray(blocks, dtype=object)
+        self.source_hash = None
+
+        # Prepared geometries make the repeated point-in-polygon tests much cheaper.
+        shapely.prepare(self.polygons)
+        self.polygon_tree = shapely.STRtree(self.polygons)
+        self.exterior_tree = shapely.STRtree(self.exteriors)
+
+        # Shapefile -> data spelling corrections, for blocks and districts separately. Since they only depend on the
+        # polygon, they're applied once here rather than per point.
+        block_fixes = {}
+        district_fixes = {}
+        if shapefile_conversion is not None:
+            block_fixes = dict(zip(shapefile_conversion['Shape_Block'], shapefile_conversion['Data_Block']))
+            district_fixes = dict(zip(shapefile_conversion['Shape_Dist'], shapefile_conversion['Data_Dist']))
+        self.data_districts = np.array([district_fixes.get(name, name) for name in self.districts] + [''], dtype=object)
+        self.data_blocks = np.array([block_fixes.get(name, name) for name in self.blocks] + [''], dtype=object)
+
+    @classmethod
+    def from_reader(cls, block_shapes, shapefile_conversion=None, district_field=3, block_field=5,
+                    cache_dir=GEOMETRY_CACHE):
+        """
+        Builds a resolver from a shapefile.Reader of blocks, with names taken from the given record fields. The parsed
+            polygons are kept in cache_dir (see geometry_cache.py) so later runs skip parsing the shapefile.
+        """
+        geometries = BlockGeometries.cached(block_shapes, cache_dir, district_field, block_field)
+        resolver = cls(geometries.polygons, geometries.districts, geometries.blocks, shapefile_conversion)
+        resolver.source_hash = geometries.source_hash
+        return resolver
+
+    def locate(self, lats, lons, nearest=True):
+        """Returns the index of the block polygon holding each lat/lon, falling back to the block with the nearest
+            border for points inside none of them (or giving them -1, with nearest=False). Points with a missing
+            lat/lon get -1."""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        found = np.full(len(lats), -1, dtype=np.intp)
+        valid = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+        if valid.size == 0 or self.polygons.size == 0:
+            return found
+
+        # Shapely wants Lon/Lat ordering for its points.
+        points = shapely.points(lons[valid], lats[valid])
+
+        # Bulk point-in-polygon, keeping the first polygon (in shapefile order) for each point.
+        point_indices, polygon_indices = self.polygon_tree.query(points, predicate='within')
+        matches = np.full(len(points), len(self.polygons), dtype=np.intp)
+        np.minimum.at(matches, point_indices, polygon_indices)
+
+        # Whatever is left over gets the block with the nearest border, ties again going to the first block.
+        unmatched = np.flatnonzero(matches == len(self.polygons))
+        if not nearest:
+            matches[unmatched] = -1
+        elif unmatched.size:
+            point_indices, ring_indices = self.exterior_tree.query_nearest(points[unmatched], all_matches=True)
+            np.minimum.at(matches, unmatched[point_indices], ring_indices)
+
+        found[valid] = matches
+        return found
+
+    def resolve(self, lats, lons):
+        """Returns arrays of the corrected (District, Block) names for each lat/lon, with '' for missing lat/lons."""
+        # The names arrays end in '', which is what index -1 picks out.
+        indices = self.locate(lats, lons)
+        return self.data_districts[indices], self.data_blocks[indices]
+
+
+class BlockRaster:
+    """
+    Integer label raster of a BlockResolver's blocks, on a grid laid out like GeoRasterViewer's (top-left corner at
+        lat_max/lon_min, with a negative lat_pixel_size).
+
+    labels holds the polygon index for pixels lying wholly inside a single block, and -1 for pixels on a border, inside
+        no block, or covered by overlapping blocks. Points in those pixels (or off the grid) are resolved exactly.
+        pixel_blocks fills those pixels in with the block holding their centroid, for summing whole pixels by block,
+        leaving -1 for pixels whose centroid is inside no block (there's no nearest border fallback for these).
+    """
+
+    def __init__(self, resolver, lon_min, lon_pixel_size, lat_max, lat_pixel_size, labels, pixel_blocks):
+        self.resolver = resolver
+        self.lon_min = lon_min
+        self.lon_pixel_size = lon_pixel_size
+        self.lat_max = lat_max
+        self.lat_pixel_size = lat_pixel_size
+        self.labels = labels
+        self.pixel_blocks = pixel_blocks
+
+    @property
+    def grid(self):
+        return self.labels.shape, self.lon_min, self.lon_pixel_size, self.lat_max, self.lat_pixel_size
+
+    @classmethod
+    def for_bounds(cls, resolver, cell_size, cache_dir=BLOCK_RASTER_CACHE):
+        """Builds (or loads) a raster with square pixels of cell_size degrees, covering all of the resolver's blocks."""
+        lon_min, lat_min, lon_max, lat_max = shapely.total_bounds(resolver.polygons)
+        shape = (int(np.ceil((lat_max - lat_min) / cell_size)), int(np.ceil((lon_max - lon_min) / cell_size)))
+        return cls.for_grid(resolver, shape, lon_min, cell_size, lat_max, -cell_size, cache_dir)
+
+    @classmethod
+    def for_viewer(cls, resolver, viewer, cache_dir=BLOCK_RASTER_CACHE):
+        """Builds (or loads) a raster on the same grid as a GeoRasterViewer, such as the GPW population raster."""
+        return cls.for_grid(
+            resolver,
+            viewer.pixel_array.shape,
+            viewer.lon_min,
+            viewer.lon_pixel_size,
+            viewer.lat_max,
+            viewer.lat_pixel_size,
+            cache_dir,
+        )
+
+    @classmethod
+    def for_grid(cls, resolver, shape, lon_min, lon_pixel_size, lat_max, lat_pixel_size, cache_dir=BLOCK_RASTER_CACHE):
+        """
+        Returns the raster for the given grid, loading it from cache_dir if this shapefile has been rasterised onto the
+            same grid before. Pass cache_dir=None (or a resolver not read from a shapefile on disk) to skip the cache.
+        """
+        shape = tuple(int(n) for n in shape)
+        grid = (shape, float(lon_min), float(lon_pixel_size), float(lat_max), float(lat_pixel_size))
+        cache_file = None
+        if cache_dir is not None and resolver.source_hash is not None:
+            grid_hash = hashlib.sha1(repr(grid).encode()).hexdigest()
+            # (Rasters cached as blocks_*.npz gave pixels outside every block to the nearest one, so aren't reused.)
+            cache_file = os.path.join(cache_dir, 'block_labels_{}_{}.npz'.format(
+                resolver.source_hash[:16], grid_hash[:16]))
+            if os.path.isfile(cache_file):
+                cached = np.load(cache_file)
+                return cls(resolver, *grid[1:], cached['labels'], cached['pixel_blocks'])
+
+        raster = cls._rasterise(resolver, *grid)
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez_compressed(cache_file, labels=raster.labels, pixel_blocks=raster.pixel_blocks)
+        return raster
+
+    @classmethod
+    def _rasterise(cls, resolver, shape, lon_min, lon_pixel_size, lat_max, lat_pixel_size, rows_per_chunk=256):
+        """Labels each pixel with the single block that wholly contains it (or -1), a band of rows at a time."""
+        num_rows, num_cols = shape
+        labels = np.full(shape, -1, dtype=np.int32)
+        lon_edges = lon_min + np.arange(num_cols + 1) * lon_pixel_size
+        for first_row in range(0, num_rows, rows_per_chunk):
+            rows = np.arange(first_row, min(first_row + rows_per_chunk, num_rows))
+            lat_edges = lat_max + np.arange(rows[0], rows[-1] + 2) * lat_pixel_size
+            boxes = shapely.box(
+                np.tile(lon_edges[:-1], len(rows)),
+                np.repeat(np.minimum(lat_edges[:-1], lat_edges[1:]), num_cols),
+                np.tile(lon_edges[1:], len(rows)),
+                np.repeat(np.maximum(lat_edges[:-1], lat_edges[1:]), num_cols),
+            )
+
+            # Only pixels touching exactly one block can take its label, and then only if it covers the whole pixel.
+            box_indices, polygon_indices = resolver.polygon_tree.query(boxes, predicate='intersects')
+            single = np.bincount(box_indices, minlength=len(boxes))[box_indices] == 1
+            box_indices = box_indices[single]
+            polygon_indices = polygon_indices[single]
+            inside = shapely.contains_properly(resolver.polygons[polygon_indices], boxes[box_indices])
+
+            band = labels[rows[0]:rows[-1] + 1].reshape(-1)
+            band[box_indices[inside]] = polygon_indices[inside]
+
+        # Every other pixel goes to whichever block its centroid lies within, if any.
+        pixel_blocks = labels.copy()
+        unlabelled_rows, unlabelled_cols = np.nonzero(labels < 0)
+        pixel_blocks[unlabelled_rows, unlabelled_cols] = resolver.locate(
+            lat_max + (unlabelled_rows + 0.5) * lat_pixel_size,
+            lon_min + (unlabelled_cols + 0.5) * lon_pixel_size,
+            nearest=False,
+        )
+        return cls(resolver, lon_min, lon_pixel_size, lat_max, lat_pixel_size, labels, pixel_blocks)
+
+    def locate(self, lats, lons, nearest=True):
+        """Returns the same block polygon indices as BlockResolver.locate, reading most of them off the raster."""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        with np.errstate(invalid='ignore'):
+            rows = np.floor((lats - self.lat_max) / self.lat_pixel_size)
+            cols = np.floor((lons - self.lon_min) / self.lon_pixel_size)
+        on_grid = (rows >= 0) & (rows < self.labels.shape[0]) & (cols >= 0) & (cols < self.labels.shape[1])
+
+        found = np.full(len(lats), -1, dtype=np.intp)
+        found[on_grid] = self.labels[rows[on_grid].astype(np.intp), cols[on_grid].astype(np.intp)]
+
+        # Border pixels, off-grid points, and missing lat/lons get the exact treatment.
+        exact = np.flatnonzero(found < 0)
+        found[exact] = self.resolver.locate(lats[exact], lons[exact], nearest)
+        return found
+
+    def resolve(self, lats, lons):
+        """Returns arrays of the corrected (District, Block) names for each lat/lon, as BlockResolver.resolve does."""
+        indices = self.locate(lats, lons)
+        return self.resolver.data_districts[indices], self.resolver.data_blocks[indices]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+''' This code indexes our District_Block tables (the ID codebook, loc_ids, and block production) on their "Combo"
+    column, so the generators can look up a block's row with a single hash lookup instead of filtering the whole table
+    with a boolean mask for every village, wholesaler, or group of retailers.
+
+    Each table is indexed once per run. Whole arrays of combos are then gathered at once, and a combo missing from the
+    table raises a KeyError naming every missing combo (rather than an IndexError from an empty filter). Where a combo
+    appears more than once, the first row wins, as it did with .values[0] and .iloc[0] on the filtered table.
+    '''
+
+
+def make_combos(districts, blocks):
+    """Returns the 'District_Block' combo for each pair of district and block names."""
+    return np.asarray(districts, dtype=object) + '_' + np.asarray(blocks, dtype=object)
+
+
+class ComboIndex:
+    """
+    Hash index over a table's Combo column.
+
+    aliases maps combos that should read another combo's row, such as a block with markets but no production of its
+        own ({'Cuttack_Cuttack Sadar': 'Cuttack_Cuttack'}).
+    """
+
+    def __init__(self, table, aliases=None, key='Combo', name=None):
+        self.table = table.reset_index(drop=True)
+        self.aliases = dict(aliases or {})
+        self.name = name or key
+        keys = self.table[key].values
+        first = np.flatnonzero(~pd.Series(keys).duplicated().values)
+        self.index = pd.Index(keys[first])
+        self.rows = first
+
+    def __contains__(self, combo):
+        return self.aliases.get(combo, combo) in self.index
+
+    def positions(self, combos, allow_missing=False):
+        """
+        Returns the table row for each combo. Missing combos get -1 if allow_missing is set, and raise a KeyError
+            otherwise.
+        """
+        combos = np.asarray(combos, dtype=object).ravel()
+        if self.aliases:
+            combos = np.array([self.aliases.get(combo, combo) for combo in combos], dtype=object)
+        found = self.index.get_indexer(combos)
+        missing = found < 0
+        if missing.any() and not allow_missing:
+            raise KeyError("No {} entry for: {}".format(self.name, ', '.join(sorted(set(map(str, combos[missing]))))))
+        positions = np.full(len(combos), -1, dtype=np.intp)
+        positions[~missing] = self.rows[found[~missing]]
+        return positions
+
+    def gather(self, column, combos, fill_value=None):
+        """
+        Returns the table's `column` value for each combo. Missing combos get fill_value, or raise a KeyError if no
+            fill_value is given.
+        """
+        positions = self.positions(combos, allow_missing=fill_value is not None)
+        column_values = self.table[column].values
+        if fill_value is None:
+            return column_values[positions]
+        found = positions >= 0
+        values = np.full(len(positions), fill_value, dtype=np.result_type(column_values, np.asarray(fill_value)))
+        values[found] = column_values[positions[found]]
+        return values
+
+    def row(self, combo):
+        """Returns the table row for a single combo as a Series, raising a KeyError if it's missing."""
+        return self.table.iloc[self.positions([combo])[0]]
+
+    def get(self, combo):
+        """Returns the table row for a single combo as a Series, or None if it's missing."""
+        position = self.positions([combo], allow_missing=True)[0]
+        return self.table.iloc[position] if position >= 0 else None
@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+''' This code benchmarks each of the distance methods available in utils.py (see utils.set_distance_method) against
+    real village coordinates, to help decide whether the faster approximations are accurate enough for a given run.
+
+    Every method computes the distances between all pairs of a random sample of villages. Throughput is the best of
+    several repeats, and errors are measured against the ellipsoidal geodesic, both overall and for the pairs under
+    100 km apart that make up most of our routes. The difference from haversine, which all existing outputs use, is
+    reported as well.
+
+    Runtime arguments:
+    village_data_file -- CSV file containing basic location and market data for villages within Odisha, India.
+    -s/--sample -- Number of villages to sample (default 2000, so about 4 million pairs).
+    -r/--repeats -- Number of timed runs per method (default 3).
+
+    Output:
+    A table of throughput and maximum absolute/relative error for each distance method, printed to screen.
+    '''
+
+
+def time_method(method, lats, lons, repeats):
+    """Returns the distances for all pairs of lat/lons using the given method, plus the best time across repeats."""
+    utils.set_distance_method(method)
+    out = np.empty((len(lats), len(lats)))
+    best_time = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        utils.compute_distance_chunked(lats, lons, lats, lons, out=out)
+        best_time = min(best_time, time.perf_counter() - start)
+    return out, best_time
+
+
+def main(villages, sample_size, repeats):
+    villages = villages.dropna(subset=['Latitude', 'Longitude'])
+    sample = villages.sample(n=min(sample_size, len(villages)), random_state=0)
+    lats = sample['Latitude'].values
+    lons = sample['Longitude'].values
+
+    original_method = utils.get_distance_method()
+    results = {}
+    try:
+        for method in utils.DISTANCE_METHODS:
+            results[method] = time_method(method, lats, lons, repeats)
+    finally:
+        utils.set_distance_method(original_method)
+
+    # Compare everything against the geodesic, ignoring each village's distance to itself.
+    reference = results['geodesic'][0]
+    haversine = results['haversine'][0]
+    pairs = ~np.eye(len(lats), dtype=bool)
+    nearby = pairs & (reference < 100.0)
+    summary = []
+    for method, (distances, seconds) in results.items():
+        errors = np.abs(distances - reference)
+        relative_errors = errors[pairs] / reference[pairs]
+        summary.append({
+            'Method': method,
+            'Pairs_Per_Second': distances.size / seconds,
+            'Max_Error_KM': errors[pairs].max(),
+            'Max_Relative_Error': relative_errors.max(),
+            'Max_Error_Under_100KM': errors[nearby].max() if nearby.any() else np.nan,
+            'Max_Diff_From_Haversine_KM': np.abs(distances - haversine)[pairs].max(),
+        })
+
+    print("Distance methods over {} villages ({} pairs):\n{}".format(
+        len(lats),
+        pairs.sum(),
+        pd.DataFrame(summary).set_index('Method').to_string(),
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmarks the speed and accuracy of each distance method on village locations.')
+    parser.add_argument('village_data_file', type=str, help='The path to the input csv file of village markets data.')
+    parser.add_argument('-s', '--sample', type=int, default=2000, help='Number of villages to sample.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of timed runs per method.')
+    args = parser.parse_args()
+
+    villages = pd.read_csv(args.village_data_file)
+
+    main(villages, args.sample, args.repeats)
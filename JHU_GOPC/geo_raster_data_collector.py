@@ -6,7 +6,8 @@ import random
 import sys
 sys.path.append('..')
 import geo_raster_viewer
-from utils import compute_distance as haversine
+from retailer_data_collector import GridLocator
+from utils import GeoPoints, NearestIndex
 
 ''' Very basic and hard-coded data processing lifted from a Jupyter Notebook. Produced as separate script to allow easy
     data generation for HERMES Agrifood post-processing/manipulation.
@@ -97,27 +98,15 @@ for market_index in range(0, len(villages)):
     else:
         villages_service.append(0)
 
-# From here, we want to find the closest Wholesaler to each Village.
-villages_closest_wm_name = []
-villages_closest_wm_lat = []
-villages_closest_wm_lon = []
-villages_closest_wm_distance = []
-for village in villages.itertuples():
-    # Amass distances, calculate the closest, and append the data to lists.
-    distances = haversine(village.Latitude, village.Longitude, wholesales["Latitude"], wholesales["Longitude"])
-    closest = np.argmin(np.ndarray.flatten(distances))
-    raw_distance = distances[closest][0][0]
-    closest_wm = wholesales.iloc[closest]
-
-    villages_closest_wm_name.append(closest_wm['Wholesale_Name'])
-    villages_closest_wm_lat.append(closest_wm['Latitude'])
-    villages_closest_wm_lon.append(closest_wm['Longitude'])
-    villages_closest_wm_distance.append(raw_distance)
+# From here, we want to find the closest Wholesaler to each Village, all at once through the spatial index.
+wholesale_index = NearestIndex(GeoPoints.from_frame(wholesales))
+villages_closest_wm_distance, closest = wholesale_index.nearest(GeoPoints.from_frame(villages))
+closest_wm = wholesales.iloc[closest]
 
 # And produce an accessible village market list with the population served and closest wholesaler data.
-villages["Closest_Wholesaler"] = villages_closest_wm_name
-villages["Wholesaler_Latitude"] = villages_closest_wm_lat
-villages["Wholesaler_Longitude"] = villages_closest_wm_lon
+villages["Closest_Wholesaler"] = closest_wm['Wholesale_Name'].values
+villages["Wholesaler_Latitude"] = closest_wm['Latitude'].values
+villages["Wholesaler_Longitude"] = closest_wm['Longitude'].values
 villages["Wholesaler_Distance"] = villages_closest_wm_distance
 villages["Population_Served"] = villages_service
 villages.to_csv("odisha_village_service.csv", index=False)
@@ -126,54 +115,13 @@ villages.to_csv("odisha_village_service.csv", index=False)
 # And it also doesn't hurt to add in something to assign urbanicity values to a file with lat-lons.
 # Particularly, we know we need it for Villages and for Wholesales
 odisha_pixels = pd.read_csv("odisha_village_data_aggregation.csv")
-village_urbanicity = []
-for village in villages.itertuples():
-    # Find the corresponding pixel-space block.
-    valid_up = village.Longitude <= odisha_pixels['Lon_Upper'].max()
-    valid_down = odisha_pixels['Lon_Lower'].min() <= village.Longitude
-    valid_left = odisha_pixels['Lat_Lower'].min() <= village.Latitude
-    valid_right = village.Latitude <= odisha_pixels['Lat_Upper'].max()
-    in_bounds = valid_up and valid_down and valid_left and valid_right
-
-    # An empty row indicates a village isn't contained within Odisha.
-    row = odisha_pixels.loc[
-        (odisha_pixels['Lat_Lower'] <= village.Latitude)
-        & (village.Latitude <= odisha_pixels['Lat_Upper'])
-        & (odisha_pixels['Lon_Lower'] <= village.Longitude)
-        & (village.Longitude <= odisha_pixels['Lon_Upper'])
-        ]
-
-    # Add the village's information to the list if it's within the region.
-    urbanicity = 0
-    if not row.empty:
-        # Record the Urbanicity
-        urbanicity = row['Density'].values[0]
-    village_urbanicity.append(urbanicity)
-villages['Urbanicity'] = village_urbanicity
+odisha_grid = GridLocator(odisha_pixels)
+
+# Locations outside of Odisha's pixels are given an Urbanicity of 0.
+villages['Urbanicity'] = odisha_grid.gather('Density', villages['Latitude'].values, villages['Longitude'].values, 0)
 villages.to_csv("odisha_village_urbanicity.csv", index=False)
 
-wholesale_urbanicity = []
-for wholesale in wholesales.itertuples():
-    # Find the corresponding pixel-space block.
-    valid_up = wholesale.Longitude <= odisha_pixels['Lon_Upper'].max()
-    valid_down = odisha_pixels['Lon_Lower'].min() <= wholesale.Longitude
-    valid_left = odisha_pixels['Lat_Lower'].min() <= wholesale.Latitude
-    valid_right = wholesale.Latitude <= odisha_pixels['Lat_Upper'].max()
-    in_bounds = valid_up and valid_down and valid_left and valid_right
-
-    # An empty row indicates a village isn't contained within Odisha.
-    row = odisha_pixels.loc[
-        (odisha_pixels['Lat_Lower'] <= wholesale.Latitude)
-        & (wholesale.Latitude <= odisha_pixels['Lat_Upper'])
-        & (odisha_pixels['Lon_Lower'] <= wholesale.Longitude)
-        & (wholesale.Longitude <= odisha_pixels['Lon_Upper'])
-        ]
-
-    # Add the village's information to the list if it's within the region.
-    urbanicity = 0
-    if not row.empty:
-        # Record the Urbanicity
-        urbanicity = row['Density'].values[0]
-    wholesale_urbanicity.append(urbanicity)
-wholesales['Urbanicity'] = wholesale_urbanicity
-wholesales.to_csv("odisha_wholesale_urbanicity.csv", index=False)
\ No newline at end of file
+wholesales['Urbanicity'] = odisha_grid.gather(
+    'Density', wholesales['Latitude'].values, wholesales['Longitude'].values, 0
+)
+wholesales.to_csv("odisha_wholesale_urbanicity.csv", index=False)
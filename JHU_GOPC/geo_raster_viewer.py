@@ -10,6 +10,7 @@ if speedups.available:
 from shapely.geometry import Point, shape
 
 from utils import compute_distance as haversine
+from utils import DISTANCE_CHUNK_MEMORY_MB, GeoPoints, closest_distances, compute_distance_chunked, within_radius
 
 
 def read_tif(tif_file):
@@ -54,6 +55,7 @@ class GeoRasterViewer:
         self.lon_pixel_size = lon_pixel_size
         self.lat_max = lat_max
         self.lat_pixel_size = lat_pixel_size
+        self._centroid_points = (None, None)
 
     @property
     def lon_max(self):
@@ -188,16 +190,38 @@ class GeoRasterViewer:
 
     def get_distances_to_coord(self, coord):
         """Computes the distance in kilometers of every pixel to a given lat/lon coordinate."""
-        start_lats, start_lons = self._get_pixel_centroids()
-        distances = haversine(start_lats, start_lons, coord[0], coord[1])
+        distances = haversine(self._get_pixel_centroid_points(), None, coord[0], coord[1])
         return distances
 
-    def get_distances_to_lat_lons(self, end_lats, end_lons):
-        """Computes the distance in kilometers of every pixel to arrays of lat/lons."""
-        start_lats, start_lons = self._get_pixel_centroids()
-        distances = haversine(start_lats, start_lons, end_lats, end_lons)
+    def get_distances_to_lat_lons(self, end_lats, end_lons=None, out=None, max_memory_mb=DISTANCE_CHUNK_MEMORY_MB,
+                                  dtype=np.float64):
+        """
+        Computes the distance in kilometers of every pixel to arrays of lat/lons (or a GeoPoints object).
+        Distances are filled in chunks, so beyond the returned (or given `out`) array, memory use stays under about
+            max_memory_mb. Use dtype=np.float32 to halve the size of the result.
+        """
+        distances = compute_distance_chunked(
+            self._get_pixel_centroid_points(),
+            None,
+            end_lats,
+            end_lons,
+            out=out,
+            max_memory_mb=max_memory_mb,
+            dtype=dtype,
+        )
         return distances
 
+    def get_pixels_within_radius(self, end_lats, end_lons, radius, max_memory_mb=DISTANCE_CHUNK_MEMORY_MB):
+        """Returns a boolean array of whether each pixel is within `radius` km of any of the given lat/lons."""
+        return within_radius(
+            self._get_pixel_centroid_points(),
+            None,
+            end_lats,
+            end_lons,
+            radius,
+            max_memory_mb=max_memory_mb,
+        )
+
     def match_to_closest_location(self, locations):
         """
         Computes which location each pixel is closest to.
@@ -208,17 +232,17 @@ class GeoRasterViewer:
         Note: If two locations have the same distance for a given pixel, the first index in the array is returned. This
             is a known limitation of this method of labeling.
         """
-        # Convert the list of locations to arrays.
-        end_lats = []
-        end_lons = []
-        for location in locations:
-            end_lats.append(location[0])
-            end_lons.append(location[1])
-        end_lats = np.array(end_lats)
-        end_lons = np.array(end_lons)
-
-        distances = self.get_distances_to_lat_lons(end_lats, end_lons)
-        closest_locations = np.argmin(distances, axis=0)
+        # Convert the list of locations to points, unless it's a GeoPoints object already.
+        if not isinstance(locations, GeoPoints):
+            end_lats = []
+            end_lons = []
+            for location in locations:
+                end_lats.append(location[0])
+                end_lons.append(location[1])
+            locations = GeoPoints(end_lats, end_lons)
+
+        # Only the running minimum is needed, so the pixels x locations distance array is never built.
+        _, closest_locations = closest_distances(self._get_pixel_centroid_points(), None, locations, None)
         return closest_locations
 
     def digitize(self, bins):
@@ -299,6 +323,35 @@ class GeoRasterViewer:
             sums[label] = label_sum
         return sums
 
+    def get_block_statistics(self, block_raster):
+        """
+        Returns a DataFrame of the pixel count, sum, and mean of pixel values for each District/Block, using a
+            BlockRaster (see block_resolver.py). Each pixel counts towards the block its centroid lies within, and
+            pixels outside every block aren't counted. A raster on this region's grid (BlockRaster.for_viewer) is used
+            as-is, anything else is sampled at this region's pixel centroids.
+        """
+        grid = (self.pixel_array.shape, self.lon_min, self.lon_pixel_size, self.lat_max, self.lat_pixel_size)
+        if block_raster.grid == grid:
+            labels = block_raster.pixel_blocks
+        else:
+            lat_centroids, lon_centroids = self._get_pixel_centroids()
+            labels = block_raster.locate(lat_centroids, lon_centroids, nearest=False).reshape(self.pixel_array.shape)
+
+        num_polygons = len(block_raster.resolver.polygons)
+        # Pixels inside no block are labelled -1.
+        counted = (labels >= 0) & np.isfinite(self.pixel_array)
+        statistics = pd.DataFrame({
+            'District': block_raster.resolver.data_districts[:num_polygons],
+            'Block': block_raster.resolver.data_blocks[:num_polygons],
+            'Pixels': np.bincount(labels[counted], minlength=num_polygons),
+            'Sum': np.bincount(labels[counted], weights=self.pixel_array[counted], minlength=num_polygons),
+        })
+
+        # Blocks split over several polygons (or renamed to the same thing) are combined.
+        statistics = statistics.groupby(['District', 'Block'], as_index=False, sort=False).sum()
+        statistics['Mean'] = statistics['Sum'] / statistics['Pixels'].where(statistics['Pixels'] > 0)
+        return statistics
+
     def _convert_coord_to_index(self, coord):
         """Converts a latitude longitude tuple into array indices."""
         lat, lon = coord
@@ -328,6 +381,18 @@ class GeoRasterViewer:
         lat_centroids, lon_centroids = np.meshgrid(lats, lons, indexing='ij')
         return lat_centroids, lon_centroids
 
+    def _get_pixel_centroid_points(self):
+        """
+        Returns the pixel centroids as GeoPoints, which are kept and reused until the region's grid changes so repeated
+            distance calculations skip the conversion.
+        """
+        grid = (self.pixel_array.shape, self.lon_min, self.lon_pixel_size, self.lat_max, self.lat_pixel_size)
+        cached_grid, points = self._centroid_points
+        if cached_grid != grid:
+            points = GeoPoints(*self._get_pixel_centroids())
+            self._centroid_points = (grid, points)
+        return points
+
     def pixels_to_file(self, filename):
         """Returns space-delimited file with each pixel's value. Access via pandas.read_csv if delim_whitespace=True."""
         df = pd.DataFrame(self.pixel_array)
@@ -0,0 +1,132 @@
+import hashlib
+import numpy as np
+import os
+import shapely
+
+''' This code keeps a parsed copy of a block shapefile on disk, so that repeated runs of the scripts using blocks
+    (village_geocoding, wholesale_data_collector, and Retailer_Generator via the BlockResolver) don't have to parse the
+    shapefile and rebuild every polygon from Python lists of points.
+
+    Each shapefile's block outlines are stored as one flat array of Lon/Lat coordinates plus the offset where each
+    block's outline starts, alongside every block's bounding box and District/Block names. These are plain .npy files
+    in a folder named by a hash of the shapefile (and the record fields used for names), so they can be memory-mapped
+    and turned back into shapely polygons in a single call. Editing the shapefile changes the hash, so a stale copy is
+    never used.
+    '''
+
+GEOMETRY_CACHE = 'geometry_cache'
+GEOMETRY_ARRAYS = ('coords', 'offsets', 'bboxes', 'districts', 'blocks')
+
+
+def shapefile_hash(block_shapes):
+    """Returns a hash of the .shp/.dbf/.shx files behind a shapefile.Reader, or None if it wasn't read from disk."""
+    digest = hashlib.sha1()
+    for part in ('shp', 'dbf', 'shx'):
+        path = getattr(getattr(block_shapes, part, None), 'name', None)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as part_file:
+            for chunk in iter(lambda: part_file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlockGeometries:
+    """
+    Block outlines and names from a shapefile, stored as flat arrays.
+
+    The outline of block i is coords[offsets[i]:offsets[i + 1]], in Lon/Lat order, and bboxes[i] is its
+        (min_lon, min_lat, max_lon, max_lat) as given by the shapefile. As in the original scripts, every point of a
+        shape goes into a single outline, and shapes without points become empty polygons.
+    """
+
+    def __init__(self, coords, offsets, bboxes, districts, blocks, source_hash=None):
+        self.coords = coords
+        self.offsets = offsets
+        self.bboxes = bboxes
+        self.districts = districts
+        self.blocks = blocks
+        self.source_hash = source_hash
+        self._polygons = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_reader(cls, block_shapes, district_field=3, block_field=5):
+        """Parses the shapes and District/Block names out of a shapefile.Reader."""
+        shapes = block_shapes.shapes()
+        records = block_shapes.records()
+        counts = [len(shape.points) for shape in shapes]
+        coords = np.array([p[:2] for shape in shapes for p in shape.points], dtype=np.float64).reshape(-1, 2)
+        bboxes = np.array([getattr(shape, 'bbox', [np.nan] * 4) for shape in shapes], dtype=np.float64).reshape(-1, 4)
+        return cls(
+            coords,
+            np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            bboxes,
+            np.array([rec[district_field] for rec in records], dtype=str),
+            np.array([rec[block_field] for rec in records], dtype=str),
+            shapefile_hash(block_shapes),
+        )
+
+    @classmethod
+    def cached(cls, block_shapes, cache_dir=GEOMETRY_CACHE, district_field=3, block_field=5, mmap=True):
+        """
+        Returns the geometries for a shapefile.Reader, loading them from cache_dir when this shapefile has been parsed
+            before and parsing (then saving) them otherwise. Pass cache_dir=None to always parse.
+        """
+        source_hash = shapefile_hash(block_shapes) if cache_dir is not None else None
+        if source_hash is None:
+            return cls.from_reader(block_shapes, district_field, block_field)
+
+        cache_path = os.path.join(cache_dir, '{}_{}_{}'.format(source_hash[:16], district_field, block_field))
+        if all(os.path.isfile(os.path.join(cache_path, name + '.npy')) for name in GEOMETRY_ARRAYS):
+            geometries = cls.load(cache_path, mmap)
+            geometries.source_hash = source_hash
+            return geometries
+
+        geometries = cls.from_reader(block_shapes, district_field, block_field)
+        geometries.save(cache_path)
+        return geometries
+
+    @classmethod
+    def load(cls, cache_path, mmap=True):
+        """Loads geometries saved by save(), memory-mapping the coordinate arrays unless mmap is False."""
+        arrays = {}
+        for name in GEOMETRY_ARRAYS:
+            mmap_mode = 'r' if mmap and name in ('coords', 'offsets', 'bboxes') else None
+            arrays[name] = np.load(os.path.join(cache_path, name + '.npy'), mmap_mode=mmap_mode)
+        return cls(**arrays)
+
+    def save(self, cache_path):
+        """Saves the arrays as .npy files in cache_path, writing to a temporary folder first so readers never see a
+            partly written cache."""
+        temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        os.makedirs(temp_path, exist_ok=True)
+        for name in GEOMETRY_ARRAYS:
+            np.save(os.path.join(temp_path, name + '.npy'), np.asarray(getattr(self, name)))
+        try:
+            os.replace(temp_path, cache_path)
+        except OSError:
+            # Another run got there first, so theirs is kept.
+            for name in GEOMETRY_ARRAYS:
+                os.remove(os.path.join(temp_path, name + '.npy'))
+            os.rmdir(temp_path)
+
+    @property
+    def polygons(self):
+        """Shapely Polygons of each block, built from the flat coordinates in one call (and kept for reuse)."""
+        if self._polygons is None:
+            counts = np.diff(self.offsets)
+            outlined = np.flatnonzero(counts > 0)
+            self._polygons = np.array([shapely.Polygon() for _ in counts], dtype=object)
+            if outlined.size:
+                # Shapes without points add nothing to coords, so it's exactly the outlined shapes' points in order.
+                rings = shapely.linearrings(self.coords, indices=np.repeat(np.arange(outlined.size), counts[outlined]))
+                self._polygons[outlined] = shapely.polygons(rings)
+        return self._polygons
+
+    @property
+    def exteriors(self):
+        """Shapely LinearRings of each block's outline."""
+        return shapely.get_exterior_ring(self.polygons)
@@ -0,0 +1,218 @@
+import gzip
+import io
+import os
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+''' This code writes the HERMES input files (routes, stores, manifest, factories) a block of rows at a time, so a file
+    never has to be held in memory as one huge DataFrame (or one huge string) before it's written. The odisha manifest,
+    at up to 336 days for each of ~5,500 villages, is by far the largest.
+
+    Each block is given as a DataFrame or a dict of equal-length columns, put into the file's HERMES column order (it's
+    an error for a block to be missing any of them), and formatted with pandas' C-backed to_csv, so the output is the
+    same as writing the whole table at once. Files can optionally be compressed with gzip or zstd (which needs the
+    zstandard package). Compression runs on a background thread fed through a short queue, so formatting the next
+    block overlaps with compressing the last, and at most a few blocks are ever waiting in memory.
+
+    Rows go to a temporary file next to the output, which only replaces it once the whole file has been written, so an
+    error part way through leaves any existing file as it was rather than a truncated one.
+    '''
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def get_export_path(path, compression=None):
+    """Returns the file name to write to, with the suffix for the given compression (if any) added."""
+    if compression is None:
+        return path
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression '{}', choose from {}.".format(
+            compression, ', '.join(COMPRESSION_SUFFIXES)))
+    return path + COMPRESSION_SUFFIXES[compression]
+
+
+class HermesWriter:
+    """
+    Streams blocks of rows into a CSV file with a fixed column order, as a context manager:
+
+        with HermesWriter('routes.csv', ROUTE_COLUMNS) as writer:
+            for block in blocks:
+                writer.write(block)
+
+    The header is written with the first block (or on closing, if no rows were written at all). compression may be
+        None, 'gzip', or 'zstd'; the path is used exactly as given. If anything raises inside the with
+        block, the partly written file is deleted and any existing file at the path is left as it was.
+    """
+
+    def __init__(self, path, columns, compression=None, queue_size=4):
+        if compression not in (None,) + tuple(COMPRESSION_SUFFIXES):
+            raise ValueError("Unknown compression '{}', choose from {}.".format(
+                compression, ', '.join(COMPRESSION_SUFFIXES)))
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package (pip install zstandard).")
+
+        self.path = path
+        self.columns = list(columns)
+        self.compression = compression
+        self.rows_written = 0
+        self._header_written = False
+        self._error = None
+
+        self._temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self._raw_file = open(self._temp_path, 'wb')
+        if compression == 'gzip':
+            # The gzip header records the final file name, not the temporary one.
+            self._file = gzip.GzipFile(filename=path, fileobj=self._raw_file, mode='wb')
+        elif compression == 'zstd':
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw_file)
+        else:
+            self._file = self._raw_file
+
+        # Only compression is worth a thread, since plain writes are already cheap next to formatting.
+        self._queue = None
+        self._thread = None
+        if compression is not None:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._drain, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, block):
+        """Writes a block of rows, given as a DataFrame or a dict of columns, in the writer's column order."""
+        if not isinstance(block, pd.DataFrame):
+            block = pd.DataFrame(block)
+        missing = [column for column in self.columns if column not in block.columns]
+        if missing:
+            raise ValueError("Block for {} is missing columns: {}".format(self.path, ', '.join(missing)))
+
+        buffer = io.StringIO()
+        block[self.columns].to_csv(buffer, header=not self._header_written, index=False)
+        self._header_written = True
+        self.rows_written += len(block)
+        self._put(buffer.getvalue().encode('utf-8'))
+
+    def write_formatted(self, text, rows):
+        """Writes rows that are already formatted (by format_rows(), in the writer's column order), e.g. saved from an
+            earlier run."""
+        if not self._header_written:
+            self._put(format_header(self.columns).encode('utf-8'))
+            self._header_written = True
+        self.rows_written += rows
+        self._put(text.encode('utf-8'))
+
+    def close(self):
+        """Writes the header if nothing else was written, finishes compressing, and moves the file into place."""
+        if self._raw_file.closed:
+            return
+        try:
+            if not self._header_written:
+                self.write(pd.DataFrame(columns=self.columns))
+            self._finish()
+            if self._error is not None:
+                raise self._error
+        except BaseException:
+            self._remove_temp()
+            raise
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Closes and deletes the partly written file, leaving any existing file at the path as it was."""
+        if self._raw_file.closed:
+            return
+        try:
+            self._finish()
+        except Exception:
+            pass
+        self._remove_temp()
+
+    def _finish(self):
+        """Stops the compression thread (after it's written everything queued) and closes the files."""
+        try:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+        finally:
+            try:
+                if self._file is not self._raw_file:
+                    self._file.close()
+            finally:
+                self._raw_file.close()
+
+    def _remove_temp(self):
+        if not self._raw_file.closed:
+            self._raw_file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+    def _put(self, data):
+        if self._thread is None:
+            self._file.write(data)
+            return
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def _drain(self):
+        """Background thread: compresses and writes each block of encoded rows until it's handed None."""
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is None:
+                try:
+                    self._file.write(data)
+                except Exception as error:
+                    self._error = error
+
+
+def format_header(columns):
+    """Returns the CSV header line for the given columns, as written with the first block."""
+    return pd.DataFrame(columns=list(columns)).to_csv(index=False)
+
+
+def format_rows(block, columns):
+    """Returns a block of rows formatted exactly as HermesWriter.write() would, without the header."""
+    buffer = io.StringIO()
+    block[list(columns)].to_csv(buffer, header=False, index=False)
+    return buffer.getvalue()
+
+
+def iter_row_blocks(frame, chunk_rows=DEFAULT_CHUNK_ROWS, step=1):
+    """Yields consecutive row blocks of a DataFrame of about chunk_rows rows, each starting on a multiple of step."""
+    chunk_rows = max(step, chunk_rows - chunk_rows % step)
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+
+def write_frame(frame, path, columns, compression=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Writes a whole DataFrame to path in HERMES column order, a block of chunk_rows rows at a time."""
+    with HermesWriter(path, columns, compression) as writer:
+        for block in iter_row_blocks(frame, chunk_rows):
+            writer.write(block)
+    return writer.rows_written
+
+
+def get_chunk_slices(num_items, items_per_chunk):
+    """Returns slices covering range(num_items) in chunks of items_per_chunk, for streaming per-item (e.g. per-route)
+        arrays through a writer."""
+    starts = np.arange(0, num_items, max(1, items_per_chunk))
+    return [slice(start, min(start + items_per_chunk, num_items)) for start in starts]
@@ -0,0 +1,283 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from Factory_Generator import FACTORY_COLUMNS, build_village_factories, finish_factories
+from Manifest_Generator import BLOCK_PRODUCTION_DTYPES
+from Routes_Generator import build_village_routes, build_wholesale_routes, finish_routes
+from Routes_Generator import get_closest_wholesales, get_routes_per_vm, write_routes
+from Stores_Generator import FILE_BOOKEND, STORES_COLUMNS
+from Stores_Generator import build_village_stores, build_wholesale_stores, finish_stores
+from hermes_export import COMPRESSION_SUFFIXES, HermesWriter, format_rows, get_chunk_slices, get_export_path
+from hermes_export import write_frame
+from location_registry import LocationRegistry, read_location_files
+from manifest_tables import MANIFEST_COLUMNS, expand_manifest, get_import_production, get_manifest_routes
+from manifest_tables import get_market_calendars, get_village_production
+from route_tables import get_topology_key
+
+''' This code rebuilds the HERMES input files (factories, stores, routes, and the manifest) after a change to the
+    village data, redoing only the rows of the villages whose inputs changed. Changing one village's census row or
+    coordinates then rebuilds that village's factory, stores, routes and manifest block, rather than every file from
+    scratch.
+
+    Each stage gives every village a content hash of everything its rows are built from, and keeps its rows from the
+    last run (in the cache file) along with their hashes. On the next run, villages with a hash seen last time reuse
+    their rows, and only the rest are rebuilt and spliced in, in village order. What goes into each hash:
+        factories -- the village's ID, name and Market Frequency.
+        stores -- the village's ID, name, Market Frequency, Lat/Lon and population.
+        routes -- the village's ID, name, Market Frequency and Lat/Lon, its closest wholesale (ID, name, distance),
+            and its routes per VM.
+        manifest -- the route's RouteId, market calendar and daily amounts (Aiginia Imports' route too). A block's
+            amounts are split evenly across its villages, so they (and the hash) change for every village of a block
+            that gains or loses a village.
+    The rows that don't belong to a village (wholesales and their clinics, retailers, and the routes between them)
+    are reused as a whole while the wholesale, retailer and loc_id files are unchanged. Every file comes out exactly
+    as the generator scripts would write it.
+
+    Villages are matched between runs by content, so they keep their rows as long as they keep their IDs: rerun
+    village_data_collector.py with --previous when the census changes. It isn't run as part of the build, since it
+    works from the geocoded census rather than the village data file the build starts from, and its output still needs
+    Population_Served added from the GPW raster (geo_raster_data_collector.py) before the build can use it.
+
+    Runtime arguments:
+    village_data_file -- CSV file containing basic location and market data for villages within Odisha, India.
+    wholesale_data_file -- CSV file containing data for wholesale markets within each district of Odisha, India.
+    retailer_data_file -- CSV file containing data for retailers within Odisha, India.
+    loc_id_file -- CSV file containing location-based ID codes, route-per-VM and trucks-per-block info.
+    block_production_file -- CSV file containing data on produce quantities from each block in Odisha.
+    seasonality_file -- CSV denoting whether given produce items are in season at each month.
+    --cache -- file keeping each stage's rows between runs (default incremental_cache.pkl).
+    --rebuild -- ignore the cache and rebuild every row (e.g. after changing a generator).
+
+    Output:
+    factories, odisha_stores, routes, odisha_manifest -- as written by the generator scripts.
+    '''
+
+
+def hash_rows(*columns):
+    """
+    Returns a 64-bit hash of each row of the given equal-length columns. Identical rows are told apart by how many
+        came before them.
+    """
+    frame = pd.DataFrame({str(number): np.asarray(column) for number, column in enumerate(columns)})
+    hashes = pd.util.hash_pandas_object(frame, index=False).values
+    occurrence = pd.Series(hashes).groupby(hashes).cumcount().values
+    if occurrence.any():
+        hashes = pd.util.hash_pandas_object(pd.DataFrame({'hash': hashes, 'occurrence': occurrence}), index=False)
+        hashes = hashes.values
+    return hashes
+
+
+def hash_tables(*frames, **parameters):
+    """Returns a single entity's hash (as for hash_rows) for rows built from whole tables and parameters."""
+    return np.array([int(get_topology_key(*frames, **parameters)[:16], 16)], dtype=np.uint64)
+
+
+def splice_sections(previous, hashes, build_sections):
+    """
+    Returns (stage, rebuilt), where stage holds the entities' hashes and {section: rows} for the entities with the
+        given hashes, in order. Rows saved by an earlier run (previous, a stage returned then, or None) are reused
+        where the hash is the same. Each section's rows carry their entity's hash in an Entity_Hash column.
+    build_sections(positions) builds the sections' rows for the entities at those positions, with the index into
+        positions of each row's entity in an Entity column. rebuilt gives the positions it was called for.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    known = pd.Index(previous['hashes'] if previous is not None else np.array([], dtype=np.uint64))
+    rebuilt = np.flatnonzero(~pd.Index(hashes).isin(known))
+    built = build_sections(rebuilt) if rebuilt.size or previous is None else None
+
+    sections = {}
+    for name in (built if built is not None else previous['sections']):
+        parts = []
+        if previous is not None:
+            old_rows = previous['sections'][name]
+            parts.append(old_rows[old_rows['Entity_Hash'].isin(hashes).values])
+        if built is not None:
+            new_rows = built[name].drop(columns='Entity')
+            new_rows['Entity_Hash'] = hashes[rebuilt][built[name]['Entity'].values]
+            parts.append(new_rows)
+        # Empty parts are left out, so they can't change the column types.
+        rows = pd.concat([part for part in parts if len(part)] or parts[-1:], ignore_index=True)
+
+        # Put the rows in entity order, keeping each entity's rows in the order they were built.
+        entity_rows = rows.groupby('Entity_Hash', sort=False).indices
+        order = [entity_rows[entity_hash] for entity_hash in hashes if entity_hash in entity_rows]
+        sections[name] = rows.take(np.concatenate(order) if order else []).reset_index(drop=True)
+    return {'hashes': hashes, 'sections': sections}, rebuilt
+
+
+def get_rows(stage):
+    """Returns a spliced stage's sections without their Entity_Hash column, in order."""
+    return {name: rows.drop(columns='Entity_Hash') for name, rows in stage['sections'].items()}
+
+
+def with_entities(sections, rows_per_entity=1):
+    """
+    Numbers the rows of freshly built sections by entity, for entities with rows_per_entity rows in each, or for a
+        single entity holding every row if rows_per_entity is None.
+    """
+    for rows in sections.values():
+        rows['Entity'] = 0 if rows_per_entity is None else np.arange(len(rows)) // rows_per_entity
+    return sections
+
+
+def build_factories(villages, registry, previous):
+    """Splices the villages' factories."""
+    hashes = hash_rows(villages['Location_ID'], villages['Village_Name'], villages['Market_Frequency'])
+
+    def build(positions):
+        return with_entities({'factories': build_village_factories(
+            villages.iloc[positions], registry.take_villages(positions))})
+    return splice_sections(previous, hashes, build)
+
+
+def build_stores(villages, wholesales, retailers, loc_ids, registry, previous):
+    """Splices the villages' stores, then the wholesales' and retailers' (rebuilt only if their inputs changed)."""
+    hashes = hash_rows(
+        villages['Location_ID'], villages['Village_Name'], villages['Market_Frequency'], villages['Latitude'],
+        villages['Longitude'], villages['Population_Served'],
+    )
+
+    def build(positions):
+        return with_entities(build_village_stores(villages.iloc[positions], registry.take_villages(positions)))
+
+    def build_wholesales(positions):
+        return with_entities(build_wholesale_stores(wholesales, retailers, loc_ids, registry), rows_per_entity=None)
+
+    village_stage, rebuilt = splice_sections(previous and previous['villages'], hashes, build)
+    wholesale_stage, _ = splice_sections(
+        previous and previous['wholesales'], hash_tables(wholesales, retailers, loc_ids), build_wholesales)
+    return {'villages': village_stage, 'wholesales': wholesale_stage}, rebuilt
+
+
+def build_routes(villages, wholesales, retailers, loc_ids, registry, previous, **mesh):
+    """Splices the villages' routes, then the wholesales' routes (rebuilt only if their inputs changed)."""
+    min_distances, closest = get_closest_wholesales(
+        registry.lats('village_market'), registry.lons('village_market'), wholesales)
+    hashes = hash_rows(
+        villages['Location_ID'], villages['Village_Name'], villages['Market_Frequency'], villages['Latitude'],
+        villages['Longitude'], registry.ids('wholesale')[closest], registry.names('wholesale')[closest],
+        min_distances, get_routes_per_vm(villages, loc_ids),
+    )
+
+    def build(positions):
+        # Each village has a start and an end row in each section.
+        return with_entities(build_village_routes(
+            villages.iloc[positions], wholesales, loc_ids, registry.take_villages(positions)), rows_per_entity=2)
+
+    def build_wholesales(positions):
+        return with_entities(build_wholesale_routes(wholesales, retailers, registry, **mesh), rows_per_entity=None)
+
+    village_stage, rebuilt = splice_sections(previous and previous['villages'], hashes, build)
+    wholesale_stage, _ = splice_sections(
+        previous and previous['wholesales'], hash_tables(wholesales, retailers, **mesh), build_wholesales)
+    return {'villages': village_stage, 'wholesales': wholesale_stage}, rebuilt
+
+
+def build_manifest(villages, block_production, seasonality, previous, calendars=None, routes_per_chunk=500):
+    """
+    Splices each route's block of formatted manifest rows. The village routes come first, then Aiginia Imports, as
+        written by Manifest_Generator.py.
+    """
+    calendars = calendars or get_market_calendars()
+    shipping, village_production = get_village_production(villages, block_production, seasonality, 1.0, calendars)
+    import_production = get_import_production(block_production, seasonality, calendars)
+    route_ids, weekly_market, _ = get_manifest_routes(villages, shipping)
+    daily_production = np.concatenate([village_production, import_production])
+    amounts = np.ascontiguousarray(daily_production.reshape(len(route_ids), -1)).view(np.uint64)
+    hashes = hash_rows(route_ids, weekly_market, *amounts.T)
+
+    calendar_lengths = np.array([len(market_calendar) for market_calendar in calendars])
+
+    def build(positions):
+        texts = []
+        route_lengths = calendar_lengths[weekly_market[positions].astype(int)]
+        for routes in get_chunk_slices(len(positions), routes_per_chunk):
+            chunk = positions[routes]
+            manifest = expand_manifest(route_ids[chunk], weekly_market[chunk], daily_production[chunk], calendars)
+            lines = format_rows(manifest, MANIFEST_COLUMNS).splitlines(True)
+            ends = np.cumsum(route_lengths[routes])
+            texts += [''.join(lines[start:end]) for start, end in zip(ends - route_lengths[routes], ends)]
+        return with_entities({'manifest': pd.DataFrame({'Text': texts, 'Rows': route_lengths})})
+    return splice_sections(previous, hashes, build)
+
+
+def write_manifest_rows(manifest, path, compression=None, routes_per_chunk=500):
+    """Writes the spliced manifest rows, a block of routes at a time, returning the number of rows written."""
+    with HermesWriter(get_export_path(path, compression), MANIFEST_COLUMNS, compression) as writer:
+        for routes in get_chunk_slices(len(manifest), routes_per_chunk):
+            block = manifest.iloc[routes]
+            writer.write_formatted(''.join(block['Text'].values), int(block['Rows'].sum()))
+    return writer.rows_written
+
+
+def main(villages, wholesales, retailers, loc_ids, block_production, seasonality, cache_file, compression=None,
+         rebuild=False):
+    previous = {}
+    if not rebuild and os.path.isfile(cache_file):
+        previous = pd.read_pickle(cache_file)
+    # One registry of every location, shared by all of the stages (and their subsets of villages).
+    registry = LocationRegistry.from_frames(villages, wholesales, retailers)
+    num_villages = len(villages)
+
+    factories, rebuilt = build_factories(villages, registry, previous.get('factories'))
+    write_frame(finish_factories(get_rows(factories)['factories']), get_export_path('factories.csv', compression),
+                FACTORY_COLUMNS, compression)
+    print("Factories: rebuilt {} of {} villages".format(len(rebuilt), num_villages))
+
+    stores, rebuilt = build_stores(villages, wholesales, retailers, loc_ids, registry, previous.get('stores'))
+    sections = get_rows(stores['villages'])
+    sections.update(get_rows(stores['wholesales']))
+    write_frame(finish_stores(sections), get_export_path('odisha_stores{}.csv'.format(FILE_BOOKEND), compression),
+                STORES_COLUMNS, compression)
+    print("Stores: rebuilt {} of {} villages".format(len(rebuilt), num_villages))
+
+    routes, rebuilt = build_routes(villages, wholesales, retailers, loc_ids, registry, previous.get('routes'))
+    sections = get_rows(routes['villages'])
+    sections.update(get_rows(routes['wholesales']))
+    write_routes(finish_routes(sections), 'routes.csv', compression)
+    print("Routes: rebuilt {} of {} villages".format(len(rebuilt), num_villages))
+
+    manifest, rebuilt = build_manifest(villages, block_production, seasonality, previous.get('manifest'))
+    rows = write_manifest_rows(manifest['sections']['manifest'], 'odisha_manifest.csv', compression)
+    print("Manifest: rebuilt {} of {} routes, {} rows".format(len(rebuilt), len(manifest['hashes']), rows))
+
+    # Only keep the cache once every file has been written.
+    temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    pd.to_pickle({'factories': factories, 'stores': stores, 'routes': routes, 'manifest': manifest}, temp_file)
+    os.replace(temp_file, cache_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Rebuilds the HERMES input files, redoing only the rows of changed villages.')
+    parser.add_argument('village_data_file', type=str, help='The path to the input csv file of village markets data.')
+    parser.add_argument('wholesale_data_file', type=str,
+                        help='The path to the input csv file of the wholesale market data.')
+    parser.add_argument('retailer_data_file', type=str, help='The path to the input csv file of the retailer data.')
+    parser.add_argument('loc_id_file', type=str,
+                        help='The path to the csv file containing location-based ID codes and route-per-VM info.')
+    parser.add_argument('block_production_file', type=str,
+                        help='The path to the input csv file of block production amounts.')
+    parser.add_argument('seasonality_file', type=str,
+                        help='The path to the input csv file of seasonal produce availability.')
+    parser.add_argument('--cache', type=str, default='incremental_cache.pkl', help='The path of the cache file.')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore the cache and rebuild every row.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the output files.')
+    args = parser.parse_args()
+
+    village_file, wholesale_file, retailer_file = read_location_files(
+        args.village_data_file, args.wholesale_data_file, args.retailer_data_file)
+
+    main(
+        village_file,
+        wholesale_file,
+        retailer_file,
+        pd.read_csv(args.loc_id_file),
+        pd.read_csv(args.block_production_file, dtype=BLOCK_PRODUCTION_DTYPES),
+        pd.read_csv(args.seasonality_file, index_col=0),
+        args.cache,
+        args.compression,
+        args.rebuild,
+    )
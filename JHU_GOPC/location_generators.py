@@ -0,0 +1,79 @@
+import argparse
+import pandas as pd
+
+import Factory_Generator
+import Routes_Generator
+import Stores_Generator
+from hermes_export import COMPRESSION_SUFFIXES
+from location_registry import LocationRegistry, read_location_files
+from region_set import RegionSet
+from wholesale_hierarchy import TIER_ONE_MESHES
+
+''' This code runs Factory_Generator, Stores_Generator and Routes_Generator together, off a single LocationRegistry.
+    Run one at a time, each generator reads the village, wholesale and retailer files and builds its own registry from
+    them. Here the files are read once, the registry is built once, and the same registry is handed to all three, so
+    their IDs, names and Lat/Lons come from the one place.
+
+    Runtime arguments:
+    village_data_file -- CSV file containing basic location and market data for villages within Odisha, India.
+    wholesale_data_file -- CSV file containing data for wholesale markets within each district of Odisha, India.
+    retailer_data_file -- CSV file containing data for retailers within Odisha, India.
+    loc_id_file -- CSV file containing location-based ID codes, route-per-VM and trucks-per-block info.
+    --test_regions, --tier_one_mesh, --mesh_neighbours, --mesh_radius, --topology_cache, --compression -- as for
+        Stores_Generator.py and Routes_Generator.py.
+
+    Output:
+    factories, odisha_stores, routes -- as written by the generator scripts.
+    '''
+
+def main(villages, wholesales, retailers, loc_ids, compression=None, test_regions=None, tier_one_mesh='full',
+         mesh_neighbours=3, mesh_radius=50.0, topology_cache=None):
+    registry = LocationRegistry.from_frames(villages, wholesales, retailers)
+    Factory_Generator.main(villages, compression, registry)
+    Stores_Generator.main(villages, wholesales, retailers, loc_ids, compression, test_regions, registry)
+    Routes_Generator.main(
+        villages,
+        wholesales,
+        retailers,
+        loc_ids,
+        tier_one_mesh,
+        mesh_neighbours,
+        mesh_radius,
+        topology_cache=topology_cache,
+        compression=compression,
+        registry=registry,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Produces the factories, stores and routes files from one location registry.')
+    parser.add_argument('village_data_file', type=str, help='The path to the input csv file of village markets data.')
+    parser.add_argument('wholesale_data_file', type=str,
+                        help='The path to the input csv file of the wholesale market data.')
+    parser.add_argument('retailer_data_file', type=str, help='The path to the input csv file of the retailer data.')
+    parser.add_argument('loc_id_file', type=str,
+                        help='The path to the csv file containing location-based ID codes and route-per-VM info.')
+    parser.add_argument('--test_regions', type=str, help='The path to a csv file of test regions.')
+    parser.add_argument('--tier_one_mesh', type=str, default='full', choices=TIER_ONE_MESHES,
+                        help='How to link Tier 1 wholesales with each other.')
+    parser.add_argument('--mesh_neighbours', type=int, default=3, help='Nearest Tier 1s to link in the knn mesh.')
+    parser.add_argument('--mesh_radius', type=float, default=50.0, help='Max km between linked Tier 1s for threshold.')
+    parser.add_argument('--topology_cache', type=str, help='Path of a file for caching the route topology.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the output files.')
+    args = parser.parse_args()
+
+    village_file, wholesale_file, retailer_file = read_location_files(
+        args.village_data_file, args.wholesale_data_file, args.retailer_data_file)
+
+    main(
+        village_file,
+        wholesale_file,
+        retailer_file,
+        pd.read_csv(args.loc_id_file),
+        args.compression,
+        RegionSet.read_csv(args.test_regions) if args.test_regions else None,
+        args.tier_one_mesh,
+        args.mesh_neighbours,
+        args.mesh_radius,
+        args.topology_cache,
+    )
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from combo_lookup import ComboIndex
+
+''' This code allocates HERMES Location_IDs for the collectors and generators (villages, wholesales, retailers). An ID
+    is a type digit (3 for village markets, 7 for wholesales, 9 for retailers, ...), the 2-digit District_Code and
+    Block_Code of the location's District_Block combo in the ID codebook, and a 3-digit number counting locations
+    within the block from 001, in row order.
+
+    IDs are allocated for every row at once: the codebook is looked up for each row's combo in one gather, numbers come
+    from a grouped cumulative count, and the zero-padded parts are formatted as whole columns.
+
+    In stable mode, rows that already had an ID (e.g. matched to the previous run's output with match_existing_ids())
+    keep it, and only new rows are numbered, after the highest number already used in their block. Adding locations
+    then leaves every existing ID, and so the routes, stores and manifest rows built on them, unchanged.
+    '''
+
+ID_CODE_WIDTHS = (2, 2, 3)
+KEY_DECIMALS = 9
+
+
+def zero_pad(values, width):
+    """Formats a column of integers as strings of at least width digits, like '{:0width}'.format() would."""
+    return pd.Series(np.asarray(values, dtype=object)).astype(str).str.zfill(width).values
+
+
+def get_block_numbers(ids, prefix):
+    """Splits existing IDs into their block prefix (type digit, district and block codes) and number (-1 if it isn't
+        one)."""
+    ids = pd.Series(np.asarray(ids, dtype=object)).astype(str)
+    block_length = len(prefix) + ID_CODE_WIDTHS[0] + ID_CODE_WIDTHS[1]
+    numbers = pd.to_numeric(ids.str[block_length:], errors='coerce').fillna(-1).values.astype(np.int64)
+    return ids.str[:block_length].values, numbers
+
+
+def allocate_location_ids(combos, codebook, prefix, existing_ids=None, reserved_ids=None):
+    """
+    Returns the Location_ID and number within its block of every row, given each row's District_Block combo and the
+        ID codebook (Combo, District_Code, Block_Code). Rows without a combo (e.g. outside every block) get an ID of
+        '' and number -1. A combo missing from the codebook raises a KeyError.
+
+    Stable mode: existing_ids gives each row's current ID (or NaN/'' for new rows). Existing IDs are kept if they're
+        still in the row's block, and new rows are numbered after the highest number used by any existing or
+        reserved_ids (e.g. every ID of the previous run, including removed locations) in their block.
+    """
+    combos = pd.Series(np.asarray(combos, dtype=object))
+    has_combo = combos.notna().values
+    code_index = ComboIndex(codebook, name='ID codebook')
+    district_codes = code_index.gather('District_Code', combos[has_combo].values)
+    block_codes = code_index.gather('Block_Code', combos[has_combo].values)
+    block_prefixes = prefix + zero_pad(district_codes, ID_CODE_WIDTHS[0]) + zero_pad(block_codes, ID_CODE_WIDTHS[1])
+
+    ids = np.full(len(combos), '', dtype=object)
+    numbers = np.full(len(combos), -1, dtype=np.int64)
+    combo_ids = np.full(has_combo.sum(), '', dtype=object)
+    combo_numbers = np.zeros(has_combo.sum(), dtype=np.int64)
+    new = np.ones(has_combo.sum(), dtype=bool)
+    first_numbers = np.zeros(has_combo.sum(), dtype=np.int64)
+
+    if existing_ids is not None:
+        existing = pd.Series(np.asarray(existing_ids, dtype=object)[has_combo])
+        kept = np.array(existing.notna() & (existing.astype(str) != ''))
+        if kept.any():
+            # An ID is only kept while the row is still in the same block (and hasn't been given to an earlier row).
+            existing_blocks, existing_numbers = get_block_numbers(existing[kept].values, prefix)
+            still_kept = (existing_blocks == block_prefixes[kept]) & (existing_numbers > 0)
+            still_kept &= ~existing[kept].astype(str).duplicated().values
+            combo_numbers[np.flatnonzero(kept)[still_kept]] = existing_numbers[still_kept]
+            kept[kept] = still_kept
+            combo_ids[kept] = existing[kept].astype(str).values
+        new = ~kept
+
+        # New rows continue from the highest number used in their block.
+        used_blocks, used_numbers = get_block_numbers(combo_ids[kept], prefix)
+        if reserved_ids is not None:
+            reserved = pd.Series(np.asarray(reserved_ids, dtype=object)).dropna().astype(str)
+            reserved = reserved[reserved.str.startswith(prefix)]
+            reserved_blocks, reserved_numbers = get_block_numbers(reserved.values, prefix)
+            used_blocks = np.concatenate([used_blocks, reserved_blocks])
+            used_numbers = np.concatenate([used_numbers, reserved_numbers])
+        highest = pd.Series(used_numbers).groupby(used_blocks).max()
+        first_numbers = highest.reindex(block_prefixes).fillna(0).values.astype(np.int64)
+
+    # Number new rows in order within each block.
+    new_blocks = pd.Series(block_prefixes[new])
+    combo_numbers[new] = first_numbers[new] + new_blocks.groupby(new_blocks.values).cumcount().values + 1
+    combo_ids[new] = (block_prefixes[new] + zero_pad(combo_numbers[new], ID_CODE_WIDTHS[2])).astype(object)
+
+    ids[has_combo] = combo_ids
+    numbers[has_combo] = combo_numbers
+    return ids, numbers
+
+
+def match_existing_ids(frame, previous, keys, id_column='Location_ID'):
+    """
+    Returns the ID each row of frame had in previous (e.g. the last run's output file), matching rows on the key
+        columns, or NaN for rows not in previous. Rows with identical keys are matched in order. Float columns (like
+        Lat/Lons) are compared to 9 decimal places, since they don't always read back from a CSV bit-for-bit.
+    """
+    def keyed(table):
+        keyed_table = table[keys].copy()
+        for column in keys:
+            if pd.api.types.is_float_dtype(keyed_table[column]):
+                keyed_table[column] = keyed_table[column].round(KEY_DECIMALS)
+        keyed_table = keyed_table.astype(str)
+        keyed_table['Occurrence'] = keyed_table.groupby(keys, dropna=False).cumcount().values
+        return keyed_table
+
+    previous_ids = keyed(previous)
+    previous_ids['Previous_ID'] = previous[id_column].values
+    matched = keyed(frame).merge(previous_ids, how='left', on=keys + ['Occurrence'])
+    return matched['Previous_ID'].values
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+''' This code keeps one registry of every HERMES location derived from the village, wholesale and retailer files, for
+    Factory_Generator, Stores_Generator and Routes_Generator. Each of those used to derive the same families of IDs
+    ('2' + id for farms, '4' + id for village clinics, '8' + id for wholesale clinics, 'f_1' + id for factories) and
+    names ('wh_', 'vm_', 'vc_', 'wm_', 'wc_', 're_') itself, with string operations on the input DataFrames.
+
+    The registry is a structured NumPy array with one row per location: its ID and name (as indices into a single table
+    of interned strings), its type, its Lat/Lon, and its parent location (a village's farm and clinic have its village
+    market as their parent, its factory has the farm it targets, and a retailer has its wholesaler). It's built once,
+    and then every generator reads the same IDs from it, so they're guaranteed to agree between files.
+
+    The generators also share read_location_files, which reads the input files with the column types every generator
+    needs, so a location's Lat/Lon is the same float in every file (Stores used to copy the village file's text).
+    '''
+
+# Location type -> (ID prefix, replacing the first digit of the source location's ID, or None to keep it as is;
+# name prefix). Names are prefixed when read, since the files don't all agree (Stores names retailers 're_Retailer').
+LOCATION_TYPES = {
+    'farm': ('2', 'wh_'),
+    'village_market': (None, 'vm_'),
+    'village_clinic': ('4', 'vc_'),
+    'factory': ('f_1', ''),
+    'wholesale': (None, 'wm_'),
+    'wholesale_clinic': ('8', 'wc_'),
+    'retailer': (None, 're_'),
+}
+TYPE_CODES = {location_type: code for code, location_type in enumerate(LOCATION_TYPES)}
+VILLAGE_TYPES = ('farm', 'village_market', 'village_clinic', 'factory')
+
+# Column types of the input files, as read by the generators' command lines (see read_location_files).
+VILLAGE_DTYPES = {
+    'Location_ID': str,
+    'Village_Name': str,
+    'District_Name': str,
+    'Block': str,
+    'Market_Frequency': str,
+    'Longitude': float,
+    'Latitude': float,
+}
+WHOLESALE_DTYPES = {
+    'Location_ID': str,
+    'Name': str,
+    'Wholesale_Name': str,
+    'District_Name': str,
+    'Longitude': float,
+    'Latitude': float,
+    'Population_Served': float,
+}
+RETAILER_DTYPES = {
+    'Location_ID': str,
+    'Name': str,
+    'Latitude': float,
+    'Longitude': float,
+    'Urbanicity': int,
+    'Closest Wholesaler': str,
+    'Wholesaler Name': str,
+    'Distance': float,
+    'Population_Served': float,
+}
+
+REGISTRY_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('type', np.int8),
+    ('name', np.int32),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('parent', np.int32),
+])
+
+
+class LocationRegistry:
+    """
+    Every HERMES location, in a structured array (REGISTRY_DTYPE) with IDs and names interned in `strings`.
+
+    Locations of each type are stored together, in the order of their source file, so reading a type's IDs, names or
+        Lat/Lons is a slice. Locations without a parent have -1.
+    """
+
+    def __init__(self, locations, strings):
+        self.locations = locations
+        self.strings = strings
+        types = locations['type']
+        self._slices = {}
+        for location_type, code in TYPE_CODES.items():
+            rows = np.flatnonzero(types == code)
+            self._slices[location_type] = slice(rows[0], rows[-1] + 1) if rows.size else slice(0, 0)
+
+    def __len__(self):
+        return len(self.locations)
+
+    @classmethod
+    def from_frames(cls, villages, wholesales=None, retailers=None):
+        """
+        Builds the registry from the village, wholesale and retailer data (with Location_ID/ID, name, and Lat/Lon
+            columns as written by the collectors). Wholesales and retailers can be left out for generators that only
+            need villages.
+        """
+        village_ids = villages['Location_ID'].astype(str).values
+        village_names = villages['Village_Name'].astype(str).values
+        village_lats = villages['Latitude'].astype(float).values
+        village_lons = villages['Longitude'].astype(float).values
+
+        sources = [
+            ('village_market', village_ids, village_names, village_lats, village_lons),
+            ('farm', village_ids, village_names, village_lats, village_lons),
+            ('factory', village_ids, village_names, village_lats, village_lons),
+            ('village_clinic', village_ids, village_names, village_lats, village_lons),
+        ]
+        if wholesales is not None:
+            wholesale_ids = wholesales['Location_ID'].astype(str).values
+            wholesale_names = wholesales['Wholesale_Name'].astype(str).values
+            wholesale_lats = wholesales['Latitude'].astype(float).values
+            wholesale_lons = wholesales['Longitude'].astype(float).values
+            sources += [
+                ('wholesale', wholesale_ids, wholesale_names, wholesale_lats, wholesale_lons),
+                ('wholesale_clinic', wholesale_ids, wholesale_names, wholesale_lats, wholesale_lons),
+            ]
+        if retailers is not None:
+            sources.append((
+                'retailer',
+                retailers['ID'].astype(str).values,
+                retailers['Name'].astype(str).values,
+                retailers['Latitude'].astype(float).values,
+                retailers['Longitude'].astype(float).values,
+            ))
+
+        # Types are stored in LOCATION_TYPES order, each in its source file's order.
+        sources.sort(key=lambda source: TYPE_CODES[source[0]])
+        ids = []
+        for location_type, source_ids, _, _, _ in sources:
+            id_prefix = LOCATION_TYPES[location_type][0]
+            ids.append(source_ids if id_prefix is None else id_prefix + pd.Series(source_ids).str[1:].values)
+
+        # Intern every ID and name in one table.
+        id_codes, strings = pd.factorize(np.concatenate(ids + [source[2] for source in sources]).astype(object))
+        num_locations = sum(len(source[1]) for source in sources)
+        locations = np.zeros(num_locations, dtype=REGISTRY_DTYPE)
+        locations['id'] = id_codes[:num_locations]
+        locations['name'] = id_codes[num_locations:]
+        locations['type'] = np.repeat([TYPE_CODES[source[0]] for source in sources], [len(s[1]) for s in sources])
+        locations['lat'] = np.concatenate([source[3] for source in sources])
+        locations['lon'] = np.concatenate([source[4] for source in sources])
+        locations['parent'] = -1
+
+        registry = cls(locations, np.asarray(strings, dtype=object))
+        registry._link_parents('village_market', ['farm', 'village_clinic'])
+        registry._link_parents('farm', ['factory'])
+        registry._link_parents('wholesale', ['wholesale_clinic'])
+        if retailers is not None and wholesales is not None:
+            parents = pd.Index(registry.ids('wholesale')).get_indexer(retailers['Wholesaler_ID'].astype(str).values)
+            registry.locations['parent'][registry.rows('retailer')] = np.where(
+                parents >= 0, parents + registry.rows('wholesale').start, -1)
+        return registry
+
+    def take_villages(self, positions):
+        """
+        Returns a registry holding only the villages at the given positions (in that order) and their farms, clinics
+            and factories, along with every wholesale and retailer location. It shares this registry's strings, so
+            generators can build a subset of villages' rows with the same IDs.
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        rows = []
+        for location_type in LOCATION_TYPES:
+            type_rows = np.arange(self._slices[location_type].start, self._slices[location_type].stop)
+            rows.append(type_rows[positions] if location_type in VILLAGE_TYPES else type_rows)
+        rows = np.concatenate(rows)
+        locations = self.locations[rows]
+
+        # Point the parents at their new rows.
+        new_rows = np.full(len(self.locations), -1, dtype=np.int32)
+        new_rows[rows] = np.arange(len(rows))
+        parents = locations['parent']
+        parents[parents >= 0] = new_rows[parents[parents >= 0]]
+        return LocationRegistry(locations, self.strings)
+
+    def _link_parents(self, parent_type, child_types):
+        """Sets the parent of each location of the child types to the parent type's location from the same source."""
+        parents = np.arange(self._slices[parent_type].start, self._slices[parent_type].stop)
+        for child_type in child_types:
+            self.locations['parent'][self._slices[child_type]] = parents
+
+    def rows(self, location_type):
+        """Returns the slice of the registry holding a type's locations."""
+        return self._slices[location_type]
+
+    def ids(self, location_type):
+        """Returns the IDs of a type's locations."""
+        return self.strings[self.locations['id'][self._slices[location_type]]]
+
+    def names(self, location_type, prefix=None):
+        """Returns the names of a type's locations, with the type's name prefix (or the given one) added."""
+        prefix = LOCATION_TYPES[location_type][1] if prefix is None else prefix
+        names = self.strings[self.locations['name'][self._slices[location_type]]]
+        return prefix + names if prefix else names
+
+    def lats(self, location_type):
+        return self.locations['lat'][self._slices[location_type]]
+
+    def lons(self, location_type):
+        return self.locations['lon'][self._slices[location_type]]
+
+    def parent_ids(self, location_type):
+        """Returns the IDs of the parents of a type's locations, with '' for those without one."""
+        parents = self.locations['parent'][self._slices[location_type]]
+        parent_ids = np.full(len(parents), '', dtype=object)
+        parent_ids[parents >= 0] = self.strings[self.locations['id'][parents[parents >= 0]]]
+        return parent_ids
+
+
+def read_location_files(village_data_file, wholesale_data_file=None, retailer_data_file=None):
+    """Returns the (villages, wholesales, retailers) DataFrames read from their files, with None for files not given."""
+    def read(path, dtypes):
+        return None if path is None else pd.read_csv(path, dtype=dtypes)
+    return (
+        read(village_data_file, VILLAGE_DTYPES),
+        read(wholesale_data_file, WHOLESALE_DTYPES),
+        read(retailer_data_file, RETAILER_DTYPES),
+    )
@@ -0,0 +1,130 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from hermes_export import COMPRESSION_SUFFIXES
+from manifest_tables import MONTHS, PRODUCTS, get_market_calendars, write_manifest
+
+''' This code keeps a run-length encoded copy of the produce manifest. Within each month a route ships the same amount
+    of each product on every market day, and that amount is often the same for several months in a row (off seasons
+    especially), so nearly all of the day-by-day manifest is repeated values.
+
+    Instead, each row here is one run: a RouteId, a product, the first and last market day it covers, and the daily
+    amount shipped. Runs are stored as plain columns in a compressed .npz file, which is a small fraction of the CSV's
+    size and quick to load and compare between scenarios. Expanding the runs writes exactly the same manifest CSV that
+    Manifest_Generator does.
+
+    Runtime arguments:
+    runs_file -- .npz file of manifest runs, as saved by Manifest_Generator --runs.
+    manifest_file -- path of the day-by-day manifest CSV to write.
+    '''
+
+RUN_ARRAYS = ('route_ids', 'weekly_market', 'route', 'product', 'first_day', 'last_day', 'value')
+
+
+class ManifestRuns:
+    """
+    Run-length encoded manifest.
+
+    route_ids and weekly_market are per route, giving its RouteId and whether it ships on the Weekly (else Daily)
+        market calendar. Every other array is per run, with runs sorted by route, then product (in PRODUCTS order),
+        then day. A route's runs for each product cover all of its market days, and first_day/last_day are numbered
+        as in the Day column of the market calendars.
+    """
+
+    def __init__(self, route_ids, weekly_market, route, product, first_day, last_day, value):
+        self.route_ids = np.asarray(route_ids, dtype=str)
+        self.weekly_market = np.asarray(weekly_market, dtype=bool)
+        self.route = np.asarray(route, dtype=np.int32)
+        self.product = np.asarray(product, dtype=np.int8)
+        self.first_day = np.asarray(first_day, dtype=np.int16)
+        self.last_day = np.asarray(last_day, dtype=np.int16)
+        self.value = np.asarray(value, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.value)
+
+    @classmethod
+    def from_production(cls, route_ids, weekly_market, daily_production, calendars=None):
+        """
+        Encodes a (routes, months, products) array of daily amounts, as used by manifest_tables.write_manifest. Runs
+            only merge months whose amounts are bit-for-bit equal, so expanding them gives back the same values.
+        """
+        calendars = calendars or get_market_calendars()
+        weekly_market = np.asarray(weekly_market, dtype=bool)
+
+        # (routes, products, months), so each route/product's months are consecutive once flattened.
+        values = np.ascontiguousarray(np.asarray(daily_production, dtype=np.float64).transpose(0, 2, 1))
+        bits = values.view(np.int64)
+        starts = np.ones(values.shape, dtype=bool)
+        starts[:, :, 1:] = bits[:, :, 1:] != bits[:, :, :-1]
+
+        # Each run ends the month before the next one starts, and every route/product starts a new run.
+        run_starts = np.flatnonzero(starts.ravel())
+        run_ends = np.append(run_starts[1:], values.size) - 1
+        route, product, first_month = np.unravel_index(run_starts, values.shape)
+        last_month = run_ends % len(MONTHS)
+
+        # First and last market day of each month, on each calendar ([Daily, Weekly], month).
+        first_days = np.stack([cal.groupby('Month')['Day'].min().reindex(range(1, 13)).values for cal in calendars])
+        last_days = np.stack([cal.groupby('Month')['Day'].max().reindex(range(1, 13)).values for cal in calendars])
+        route_calendars = weekly_market[route].astype(int)
+        return cls(
+            route_ids,
+            weekly_market,
+            route,
+            product,
+            first_days[route_calendars, first_month],
+            last_days[route_calendars, last_month],
+            values.ravel()[run_starts],
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Loads runs saved by save()."""
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in RUN_ARRAYS})
+
+    def save(self, path):
+        """Saves the runs as a compressed .npz file of their columns."""
+        np.savez_compressed(path, **{name: getattr(self, name) for name in RUN_ARRAYS})
+
+    def to_production(self, calendars=None):
+        """Returns the (routes, months, products) array of daily amounts that the runs encode."""
+        daily, _ = calendars or get_market_calendars()
+        month_of_day = np.zeros(daily['Day'].max() + 1, dtype=np.int64)
+        month_of_day[daily['Day'].values] = daily['Month'].values - 1
+        months_per_run = month_of_day[self.last_day] - month_of_day[self.first_day] + 1
+        values = np.repeat(self.value, months_per_run)
+        return values.reshape(len(self.route_ids), len(PRODUCTS), len(MONTHS)).transpose(0, 2, 1)
+
+    def to_frame(self):
+        """Returns the runs as a DataFrame of RouteId, Product, StartDay, EndDay and Value, e.g. for comparing two
+            scenarios' runs."""
+        return pd.DataFrame({
+            'RouteId': self.route_ids[self.route],
+            'Product': np.asarray(PRODUCTS)[self.product],
+            'StartDay': self.first_day.astype(np.int64) + 0.1,
+            'EndDay': self.last_day.astype(np.int64) + 0.1 + 0.1,
+            'Value': self.value,
+        })
+
+    def expand(self, path, compression=None, calendars=None):
+        """Writes the day-by-day HERMES manifest CSV that the runs encode, returning the number of rows written."""
+        calendars = calendars or get_market_calendars()
+        return write_manifest(
+            path, self.route_ids.astype(object), self.weekly_market, self.to_production(calendars), calendars,
+            compression,
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Expands a run-length encoded manifest into the day-by-day manifest.csv file.')
+    parser.add_argument('runs_file', type=str, help='The path to the .npz file of manifest runs.')
+    parser.add_argument('manifest_file', type=str, help='The path of the manifest csv file to write.')
+    parser.add_argument('--compression', type=str, choices=COMPRESSION_SUFFIXES, help='Compress the manifest file.')
+    args = parser.parse_args()
+
+    runs = ManifestRuns.load(args.runs_file)
+    rows = runs.expand(args.manifest_file, args.compression)
+    print("Expanded {} runs into {} manifest rows".format(len(runs), rows))
@@ -0,0 +1,186 @@
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+from manifest_tables import MANIFEST_COLUMNS, PRODUCTS, ManifestDays, expand_manifest, get_market_calendars
+
+''' This code keeps the produce manifest as a folder of binary arrays that can be read a route at a time, so looking up
+    the shipping schedule of a few RouteIds doesn't mean scanning the whole manifest CSV.
+
+    The manifest's rows are stored with each district's routes together (and each route's days together), as
+    memory-mapped .npy columns of StartDay, EndDay, and the product amounts. Alongside them, an index gives the
+    offset of each route's first row and of each district's first route. Reading a route (or a district) then only
+    touches that slice of the files, and the rows come back exactly as they appear in the manifest CSV.
+
+    Runtime arguments:
+    store_path -- folder of a manifest store, as saved by Manifest_Generator --store.
+    --routes -- RouteIds to read.
+    --district -- district whose routes to read.
+    --days -- first and last day (numbered from 0) of the rows to read.
+    '''
+
+STORE_ARRAYS = ('route_ids', 'route_offsets', 'districts', 'district_offsets', 'start_days', 'end_days', 'amounts')
+MMAP_ARRAYS = ('start_days', 'end_days', 'amounts')
+
+
+class ManifestStore:
+    """
+    Manifest rows grouped by district and route, with an index of where each starts.
+
+    Route i's rows are start_days/end_days/amounts[route_offsets[i]:route_offsets[i + 1]], and district j's routes are
+        route_ids[district_offsets[j]:district_offsets[j + 1]]. Within a district, routes keep their manifest order.
+    """
+
+    def __init__(self, route_ids, route_offsets, districts, district_offsets, start_days, end_days, amounts):
+        self.route_ids = np.asarray(route_ids, dtype=str)
+        self.route_offsets = route_offsets
+        self.districts = np.asarray(districts, dtype=str)
+        self.district_offsets = district_offsets
+        self.start_days = start_days
+        self.end_days = end_days
+        self.amounts = amounts
+        self.route_index = pd.Index(self.route_ids)
+
+    @staticmethod
+    def get_route_order(districts):
+        """Returns the order routes are stored in: each district's routes together, keeping their order otherwise."""
+        return np.argsort(np.asarray(districts, dtype=str), kind='stable')
+
+    @classmethod
+    def build(cls, path, route_ids, weekly_market, daily_production, districts, calendars=None, routes_per_chunk=500,
+              days=None):
+        """
+        Writes the store for the given routes (as passed to manifest_tables.write_manifest) into the folder at path,
+            and returns it. districts gives each route's district. The arrays are filled a block of routes at a time,
+            straight into memory-mapped files, so the whole manifest is never held in memory.
+
+        days can pass in the ManifestDays of the routes taken in get_route_order(districts), if they've already been
+            worked out (e.g. for building several scenarios' stores).
+        """
+        calendars = calendars or get_market_calendars()
+        route_ids = np.asarray(route_ids, dtype=object)
+        weekly_market = np.asarray(weekly_market, dtype=bool)
+        districts = np.asarray(districts, dtype=str)
+
+        order = cls.get_route_order(districts)
+        unique_districts, district_starts = np.unique(districts[order], return_index=True)
+        if days is None:
+            days = ManifestDays.for_routes(weekly_market[order], calendars)
+        route_offsets = days.row_offsets
+        num_rows = int(route_offsets[-1])
+
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        os.makedirs(temp_path, exist_ok=True)
+        np.save(os.path.join(temp_path, 'route_ids.npy'), route_ids[order].astype(str))
+        np.save(os.path.join(temp_path, 'route_offsets.npy'), route_offsets)
+        np.save(os.path.join(temp_path, 'districts.npy'), unique_districts)
+        district_offsets = np.append(district_starts, len(order)).astype(np.int64)
+        np.save(os.path.join(temp_path, 'district_offsets.npy'), district_offsets)
+        columns = {
+            'start_days': np.lib.format.open_memmap(
+                os.path.join(temp_path, 'start_days.npy'), mode='w+', dtype=np.float64, shape=(num_rows,)),
+            'end_days': np.lib.format.open_memmap(
+                os.path.join(temp_path, 'end_days.npy'), mode='w+', dtype=np.float64, shape=(num_rows,)),
+            'amounts': np.lib.format.open_memmap(
+                os.path.join(temp_path, 'amounts.npy'), mode='w+', dtype=np.float64, shape=(num_rows, len(PRODUCTS))),
+        }
+        for first in range(0, len(order), routes_per_chunk):
+            chunk = slice(first, min(first + routes_per_chunk, len(order)))
+            routes = order[chunk]
+            block = expand_manifest(
+                route_ids[routes], weekly_market[routes], daily_production[routes], days=days.slice(chunk))
+            rows = slice(route_offsets[chunk.start], route_offsets[chunk.stop])
+            columns['start_days'][rows] = block['StartDay'].values
+            columns['end_days'][rows] = block['EndDay'].values
+            columns['amounts'][rows] = block[PRODUCTS].values
+        for column in columns.values():
+            column.flush()
+        del columns
+
+        # Move the old store aside before swapping the new one in, so it's only deleted once the new one is in place.
+        old_path = '{}.{}.old'.format(path, os.getpid())
+        if os.path.isdir(path):
+            os.replace(path, old_path)
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.isdir(old_path):
+                os.replace(old_path, path)
+            raise
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a store, memory-mapping its rows."""
+        arrays = {}
+        for name in STORE_ARRAYS:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if name in MMAP_ARRAYS else None)
+        return cls(**arrays)
+
+    def __len__(self):
+        return len(self.route_ids)
+
+    def get_district_routes(self, district):
+        """Returns the RouteIds of a district's routes, raising a KeyError for a district not in the store."""
+        position = np.searchsorted(self.districts, district)
+        if position == len(self.districts) or self.districts[position] != district:
+            raise KeyError("No routes stored for district: {}".format(district))
+        return self.route_ids[self.district_offsets[position]:self.district_offsets[position + 1]]
+
+    def read(self, route_ids=None, district=None, days=None):
+        """
+        Returns the manifest rows (MANIFEST_COLUMNS) of the given RouteIds, or of a district's routes, in that order.
+            days can limit the rows to a (first, last) range of days, numbered from 0. Unknown RouteIds raise a
+            KeyError.
+        """
+        if route_ids is None:
+            route_ids = self.get_district_routes(district) if district is not None else self.route_ids
+        route_ids = np.atleast_1d(np.asarray(route_ids, dtype=str))
+        positions = self.route_index.get_indexer(route_ids)
+        if (positions < 0).any():
+            raise KeyError("No manifest rows stored for: {}".format(', '.join(route_ids[positions < 0])))
+
+        starts = self.route_offsets[positions]
+        lengths = self.route_offsets[positions + 1] - starts
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        if days is not None:
+            first_day, last_day = days
+            # Only each selected route's slice of the start days is read from disk.
+            day_numbers = np.floor(self.start_days[rows])
+            kept = (day_numbers >= first_day) & (day_numbers <= last_day)
+            rows = rows[kept]
+            route_names = np.repeat(route_ids, lengths)[kept]
+        else:
+            route_names = np.repeat(route_ids, lengths)
+
+        manifest = pd.DataFrame({
+            'RouteId': route_names.astype(object),
+            'StartDay': self.start_days[rows],
+            'EndDay': self.end_days[rows],
+        })
+        amounts = self.amounts[rows]
+        for product, column in enumerate(PRODUCTS):
+            manifest[column] = amounts[:, product]
+        manifest['Notes'] = ''
+        return manifest[MANIFEST_COLUMNS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Reads the shipping schedule of selected routes from a manifest store.')
+    parser.add_argument('store_path', type=str, help='The path to the manifest store folder.')
+    parser.add_argument('--routes', type=str, nargs='+', help='RouteIds to read.')
+    parser.add_argument('--district', type=str, help='District whose routes to read.')
+    parser.add_argument('--days', type=int, nargs=2, help='First and last day of the rows to read.')
+    parser.add_argument('--output', type=str, help='Path of a csv file to write the rows to, instead of printing them.')
+    args = parser.parse_args()
+
+    store = ManifestStore.load(args.store_path)
+    rows = store.read(args.routes, args.district, args.days)
+    if args.output:
+        rows.to_csv(args.output, index=False)
+    else:
+        print(rows.to_string(index=False))
@@ -0,0 +1,268 @@
+import calendar
+import itertools
+import numpy as np
+import pandas as pd
+
+from combo_lookup import ComboIndex, make_combos
+from hermes_export import HermesWriter, get_chunk_slices, get_export_path
+
+''' This code works out the produce shipping manifest for Manifest_Generator (and the run-length encoded copies of it
+    in manifest_rle) as whole arrays, rather than one DataFrame per village.
+
+    Each village ships on every day of its market calendar (all days for Daily markets, Mondays for Weekly ones), and a
+    village's daily amount of each product only changes from month to month. So the whole manifest is worked out as one
+    villages x months x products array of daily amounts, gathered from the block production and seasonality tables,
+    which is then repeated out over each village's market days in a single step. Villages in blocks with no production
+    don't ship at all.
+
+    Since the multiplying factor for production surplus/deficit studies is applied last, the daily amounts can be
+    worked out once and then scaled for a whole grid of scenarios, each multiplying all production or just that of one
+    product and/or district. Aiginia Imports are never scaled.
+    '''
+
+PRODUCTS = ['Potato', 'Onion', 'Tomato', 'Brinjal', 'Cabbage']
+MONTHS = calendar.month_abbr[1:]
+MANIFEST_COLUMNS = ['RouteId', 'StartDay', 'EndDay'] + PRODUCTS + ['Notes']
+IMPORT_COMBO = 'Aiginia_Imports'
+IMPORT_ROUTE = 'f10000001_wm71905002'
+
+# "Cuttack_Cuttack Sadar" has VMs but no production, "Cuttack_Cuttack" has production but no VMs, so combine.
+PRODUCTION_ALIASES = {'Cuttack_Cuttack Sadar': 'Cuttack_Cuttack'}
+
+
+def get_market_calendars():
+    """
+    Returns the (Daily, Weekly) market calendars as DataFrames of Day (numbered from 0), Start_Days, End_Days and
+        Month, in day order. The year is simplified to 12 months of 28 days, with every 7th day a Monday.
+    """
+    # Create the year data to handle Daily and Weekly Markets
+    year_range = pd.date_range(start='1/1/2019', end='12/28/2019')
+    year = year_range.to_frame(index=False)
+
+    year["Month"] = year_range.month
+    year["Days"] = year_range.day
+    # Remove any days numbered 29, 30, 31 and reset the index to accommodate the missing rows
+    year = year[(year.Days <= 28)]
+    year = year.reset_index(drop=True)
+    # Manually set the Weekday using the index
+    year["Weekdays"] = year.index % 7
+    # Deliveries must be bumped to X.1 to X.2 since time 0.0 breaks HERMES
+    year["Start_Days"] = year.index + 0.1
+    year["End_Days"] = year["Start_Days"] + 0.1
+
+    year["Day"] = year.index
+    columns = ['Day', 'Start_Days', 'End_Days', 'Month']
+    mondays = year.loc[year["Weekdays"].values == 0, columns].reset_index(drop=True)
+    return year[columns], mondays
+
+
+def get_days_per_month(market_calendar):
+    """Returns the number of market days in each month of a calendar, as an array of 12."""
+    return np.bincount(market_calendar['Month'].values - 1, minlength=len(MONTHS))
+
+
+def get_production_columns(seasonality, include_off=False):
+    """
+    Returns a (months, products) array of which block production column (e.g. 'Potato_peak') each product's supply is
+        read from in each month. Off season months give None, unless include_off is set.
+    """
+    availability = seasonality.loc[PRODUCTS, MONTHS].values.T.astype(str)
+    columns = np.char.add(np.char.add(np.array(PRODUCTS, dtype=str), '_'), availability).astype(object)
+    if not include_off:
+        columns[availability == 'off'] = None
+    return columns
+
+
+def gather_monthly_production(production, production_columns):
+    """Returns a (rows, months, products) array of each row of production's amounts under the given column layout."""
+    monthly = np.zeros((len(production), len(MONTHS), len(PRODUCTS)))
+    for month, product in zip(*np.nonzero(production_columns != None)):  # noqa: E711 -- elementwise test
+        monthly[:, month, product] = production[production_columns[month, product]].values
+    return monthly
+
+
+def get_village_production(villages, block_production, seasonality, multiplying_factor=1.0, calendars=None):
+    """
+    Returns (shipping, daily_production) for the villages: a boolean array of which villages ship at all (those in a
+        block with production), and a (shipping villages, months, products) array of the amount each of those ships
+        per market day. A block's monthly production is split evenly across its villages and their market days.
+    """
+    daily, weekly = calendars or get_market_calendars()
+    weekly_market = villages['Market_Frequency'].values != 'Daily'
+
+    production_index = ComboIndex(block_production, aliases=PRODUCTION_ALIASES, name='block production')
+    positions = production_index.positions(
+        make_combos(villages['District_Name'].values, villages['Block_Name'].values), allow_missing=True)
+    shipping = positions >= 0
+
+    # Villages are counted by Block_Name alone, across all villages whether or not their block has production.
+    villages_per_block = villages.groupby('Block_Name')['Block_Name'].transform('size').values[shipping]
+    market_days = np.where(
+        weekly_market[shipping, np.newaxis], get_days_per_month(weekly), get_days_per_month(daily))
+
+    monthly_production = gather_monthly_production(
+        production_index.table.take(positions[shipping]), get_production_columns(seasonality))
+    daily_production_fraction = 1 / (villages_per_block[:, np.newaxis] * market_days)
+    daily_production = daily_production_fraction[:, :, np.newaxis] * monthly_production * multiplying_factor
+    return shipping, daily_production
+
+
+def get_import_production(block_production, seasonality, calendars=None):
+    """
+    Returns a (1, months, products) array of the amount Aiginia Imports ship per day. Unlike with the block production,
+        imports are read from the peak/lean/off column for every month, and they have only the one importing location.
+    """
+    daily, _ = calendars or get_market_calendars()
+    production_index = ComboIndex(block_production, name='block production')
+    import_production = production_index.table.take(production_index.positions([IMPORT_COMBO]))
+    monthly_production = gather_monthly_production(import_production, get_production_columns(seasonality, True))
+    daily_production_fraction = 1 / get_days_per_month(daily)
+    return daily_production_fraction[np.newaxis, :, np.newaxis] * monthly_production
+
+
+def get_production_scenarios(multipliers=(1.0,), products=None, districts=None):
+    """
+    Returns a DataFrame with one row per scenario in the grid of every combination of the given multipliers, products
+        (from PRODUCTS) and districts. A scenario multiplies the production of its Product in its District, where
+        'All' (the default when products or districts aren't given) covers every product or district.
+    """
+    products = list(products or ['All'])
+    unknown = [product for product in products if product not in PRODUCTS + ['All']]
+    if unknown:
+        raise ValueError("Unknown products {}, choose from {}.".format(', '.join(unknown), ', '.join(PRODUCTS)))
+    grid = list(itertools.product(multipliers, products, districts or ['All']))
+    scenarios = pd.DataFrame(grid, columns=['Multiplier', 'Product', 'District'])
+    scenarios.insert(0, 'Scenario', ['{:03}'.format(number) for number in range(len(scenarios))])
+    return scenarios
+
+
+def get_scenario_multipliers(scenario, districts):
+    """
+    Returns a (villages, 1, products) array of multiplying factors for a scenario (a row of get_production_scenarios),
+        given each village's district, for scaling get_village_production's daily amounts.
+    """
+    multipliers = np.ones((len(districts), 1, len(PRODUCTS)))
+    villages = slice(None) if scenario.District == 'All' else np.asarray(districts) == scenario.District
+    if not np.any(villages):
+        raise ValueError("No shipping villages in district '{}'.".format(scenario.District))
+    products = slice(None) if scenario.Product == 'All' else PRODUCTS.index(scenario.Product)
+    multipliers[villages, :, products] = scenario.Multiplier
+    return multipliers
+
+
+def get_tonnage(weekly_market, daily_production, calendars=None):
+    """Returns the total amount of each product shipped over the year by routes with the given daily amounts."""
+    calendars = calendars or get_market_calendars()
+    days_per_month = np.stack([get_days_per_month(market_calendar) for market_calendar in calendars])
+    market_days = days_per_month[np.asarray(weekly_market, dtype=bool).astype(int)]
+    return (daily_production * market_days[:, :, np.newaxis]).sum(axis=(0, 1))
+
+
+class ManifestDays:
+    """
+    The market days of the day-by-day manifest rows of a set of routes, worked out once so that many blocks of routes
+        (or many scenarios' manifests) can share them.
+
+    Route i's rows have the StartDay/EndDay values start_days/end_days[row_offsets[i]:row_offsets[i + 1]], and
+        month_days[i * 12:(i + 1) * 12] gives how many of those rows fall in each month, for repeating the daily
+        amounts over them.
+    """
+
+    def __init__(self, start_days, end_days, row_offsets, month_days):
+        self.start_days = start_days
+        self.end_days = end_days
+        self.row_offsets = row_offsets
+        self.month_days = month_days
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    @classmethod
+    def for_routes(cls, weekly_market, calendars=None):
+        """Lays out the rows of routes on the given market calendars (Weekly where weekly_market is set, else Daily)."""
+        calendars = calendars or get_market_calendars()
+        route_calendars = np.asarray(weekly_market, dtype=bool).astype(int)
+
+        # Each route's row in the stacked (Daily then Weekly) calendar for each of its market days.
+        calendar_lengths = np.array([len(market_calendar) for market_calendar in calendars])
+        calendar_starts = np.cumsum(calendar_lengths) - calendar_lengths
+        route_lengths = calendar_lengths[route_calendars]
+        row_offsets = np.concatenate([[0], np.cumsum(route_lengths)]).astype(np.int64)
+        route_starts = calendar_starts[route_calendars] - row_offsets[:-1]
+        days = np.repeat(route_starts, route_lengths) + np.arange(row_offsets[-1])
+        stacked = pd.concat(calendars, ignore_index=True)
+
+        # Market days come in month order in the calendars.
+        days_per_month = np.stack([get_days_per_month(market_calendar) for market_calendar in calendars])
+        return cls(
+            stacked['Start_Days'].values[days],
+            stacked['End_Days'].values[days],
+            row_offsets,
+            days_per_month[route_calendars].ravel(),
+        )
+
+    def slice(self, routes):
+        """Returns the days of a contiguous slice of the routes, as views of these arrays."""
+        first, stop, _ = routes.indices(len(self))
+        rows = slice(self.row_offsets[first], self.row_offsets[stop])
+        return ManifestDays(
+            self.start_days[rows],
+            self.end_days[rows],
+            self.row_offsets[first:stop + 1] - self.row_offsets[first],
+            self.month_days[first * len(MONTHS):stop * len(MONTHS)],
+        )
+
+
+def expand_manifest(route_ids, weekly_market, daily_production, calendars=None, days=None):
+    """
+    Returns the day-by-day manifest (MANIFEST_COLUMNS) for routes shipping the given (routes, months, products) daily
+        amounts, with each route's rows covering its market calendar (Weekly where weekly_market is set, else Daily).
+        days can pass in the routes' ManifestDays, if they've already been worked out.
+    """
+    if days is None:
+        days = ManifestDays.for_routes(weekly_market, calendars)
+
+    # Repeat each month's daily amounts over that month's market days.
+    amounts = np.repeat(daily_production.reshape(-1, len(PRODUCTS)), days.month_days, axis=0)
+
+    manifest = pd.DataFrame({
+        'RouteId': np.repeat(np.asarray(route_ids, dtype=object), np.diff(days.row_offsets)),
+        'StartDay': days.start_days,
+        'EndDay': days.end_days,
+    })
+    for product, column in enumerate(PRODUCTS):
+        manifest[column] = amounts[:, product]
+    manifest['Notes'] = ''
+    return manifest
+
+
+def get_village_route_ids(villages):
+    """Returns the wholesale -> village market RouteId each village's produce ships on."""
+    location_ids = villages['Location_ID'].astype(str)
+    return ('wh2' + location_ids.str[1:] + '_vm' + location_ids).values
+
+
+def get_manifest_routes(villages, shipping):
+    """
+    Returns the RouteIds, Weekly market flags, and districts of the manifest's routes: each shipping village's, then
+        Aiginia Imports' on a daily market schedule, after all of the villages.
+    """
+    route_ids = np.append(get_village_route_ids(villages)[shipping], IMPORT_ROUTE)
+    weekly_market = np.append(villages['Market_Frequency'].values[shipping] != 'Daily', False)
+    districts = np.append(villages['District_Name'].values[shipping], IMPORT_COMBO.split('_')[0])
+    return route_ids, weekly_market, districts
+
+
+def write_manifest(path, route_ids, weekly_market, daily_production, calendars=None, compression=None,
+                   routes_per_chunk=500, days=None):
+    """
+    Writes the manifest for the given routes to path, expanding and writing a block of routes at a time. days can pass
+        in the routes' ManifestDays, if they've already been worked out (e.g. for writing several scenarios).
+    """
+    if days is None:
+        days = ManifestDays.for_routes(weekly_market, calendars)
+    with HermesWriter(get_export_path(path, compression), MANIFEST_COLUMNS, compression) as writer:
+        for routes in get_chunk_slices(len(route_ids), routes_per_chunk):
+            writer.write(expand_manifest(
+                route_ids[routes], weekly_market[routes], daily_production[routes], days=days.slice(routes)))
+    return writer.rows_written
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from utils import DISTANCE_CHUNK_MEMORY_MB, iter_distance_chunks
+
+''' This code describes the test regions used when generating stores and retailers: the areas where a study is run,
+    whose wholesale-attached clinics serve only 5% of their population. Originally this was the single Bhadrak circle
+    (21.0583, 86.4658, 34 km), hard-coded where it was used.
+
+    A RegionSet is a table of any number of named regions, each either a circle (centre Lat/Lon and a radius in km) or
+    a polygon. Membership of every point in every region is worked out in a single pass: all circles together through
+    the chunked distance functions in utils.py, and all polygons together through one STRtree query. So dozens of test
+    regions can be set up in one run of the generators, rather than one run per region.
+
+    Regions can be read from a CSV with columns Name, Latitude, Longitude, Radius_KM for circles, and/or a Polygon
+    column of WKT (in Lon/Lat order) for polygons. Rows with a Polygon ignore the circle columns.
+    '''
+
+REGION_COLUMNS = ['Name', 'Latitude', 'Longitude', 'Radius_KM', 'Polygon']
+
+
+class RegionSet:
+    """
+    Named test regions, each a circle or a polygon.
+
+    Points exactly on a circle's edge are inside it, as with the original distance <= radius check. Points on a
+        polygon's border are not.
+    """
+
+    def __init__(self, names, lats=None, lons=None, radii=None, polygons=None):
+        self.names = np.asarray(names, dtype=object)
+        num_regions = len(self.names)
+        if len(set(self.names)) != num_regions:
+            raise ValueError("Test region names must be unique.")
+
+        def per_region(values):
+            return np.full(num_regions, np.nan) if values is None else np.asarray(values, dtype=np.float64)
+
+        self.lats = per_region(lats)
+        self.lons = per_region(lons)
+        self.radii = per_region(radii)
+        self.polygons = np.full(num_regions, None, dtype=object) if polygons is None else np.asarray(polygons, object)
+
+        self.is_polygon = ~shapely.is_missing(self.polygons)
+        bad_circles = ~self.is_polygon & ~(np.isfinite(self.lats) & np.isfinite(self.lons) & (self.radii >= 0))
+        if bad_circles.any():
+            raise ValueError("Test regions need a Polygon or a Latitude, Longitude and Radius_KM: {}".format(
+                ', '.join(map(str, self.names[bad_circles]))))
+        self.polygon_tree = shapely.STRtree(self.polygons[self.is_polygon])
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_circles(cls, names, lats, lons, radii):
+        """Returns a set of circular regions."""
+        return cls(names, lats, lons, radii)
+
+    @classmethod
+    def from_frame(cls, regions):
+        """Returns the regions in a DataFrame with REGION_COLUMNS (the circle or polygon columns can be left out)."""
+        polygons = None
+        if 'Polygon' in regions.columns:
+            wkt = regions['Polygon'].to_numpy(dtype=object)
+            wkt[pd.isna(wkt)] = None
+            polygons = shapely.from_wkt(wkt)
+
+        def column(name):
+            return regions[name].values if name in regions.columns else None
+
+        return cls(regions['Name'].values, column('Latitude'), column('Longitude'), column('Radius_KM'), polygons)
+
+    @classmethod
+    def read_csv(cls, path):
+        """Reads the regions from a CSV file with REGION_COLUMNS."""
+        return cls.from_frame(pd.read_csv(path, dtype={'Name': str, 'Polygon': str}))
+
+    def membership(self, lats, lons, max_memory_mb=DISTANCE_CHUNK_MEMORY_MB):
+        """Returns a (points, regions) boolean array of whether each lat/lon lies within each region."""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        inside = np.zeros((len(lats), len(self)), dtype=bool)
+        if len(lats) == 0:
+            return inside
+
+        circles = np.flatnonzero(~self.is_polygon)
+        if circles.size:
+            for end_slice, start_slice, distances in iter_distance_chunks(
+                    lats, lons, self.lats[circles], self.lons[circles], max_memory_mb):
+                within = distances <= self.radii[circles][end_slice, np.newaxis]
+                inside[start_slice, circles[end_slice]] = within.T
+
+        if self.is_polygon.any():
+            point_indices, polygon_indices = self.polygon_tree.query(shapely.points(lons, lats), predicate='within')
+            inside[point_indices, np.flatnonzero(self.is_polygon)[polygon_indices]] = True
+        return inside
+
+    def contains_any(self, lats, lons, max_memory_mb=DISTANCE_CHUNK_MEMORY_MB):
+        """Returns a boolean array of whether each lat/lon lies within any of the regions."""
+        return self.membership(lats, lons, max_memory_mb).any(axis=1)
+
+    def membership_frame(self, ids, lats, lons, id_column='idcode'):
+        """Returns a DataFrame of each location's id, followed by a 0/1 column per region of whether it's inside."""
+        inside = self.membership(lats, lons)
+        frame = pd.DataFrame({id_column: np.asarray(ids)})
+        for region, name in enumerate(self.names):
+            frame['In_{}'.format(name)] = inside[:, region].astype(int)
+        return frame
+
+
+# Bhadrak region's centerpoint: 21.0583 lat, 86.4658 lon, 34.0 km radius
+BHADRAK = RegionSet.from_circles(['Bhadrak'], [21.0583], [86.4658], [34.0])
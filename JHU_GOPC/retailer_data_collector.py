@@ -3,6 +3,7 @@ import numpy as np
 import os
 import pandas as pd
 
+from region_set import RegionSet
 from utils import compute_distance as haversine
 
 ''' This code aggregates a list of villages using two approaches.
@@ -30,6 +31,8 @@ from utils import compute_distance as haversine
     Runtime arguments: 
         -r/range: Enables range mode, which uses [villages, center_lat, center_lon, radius] to create a list of villages
             in [radius] km from the center. Ignores [header, population, population_density, population_distance].
+        --regions: In range mode, a CSV of further test regions (see region_set.py). Villages within the center's
+            radius or any of these regions are listed, with a column per region of whether they're inside it.
     
     Always required:    
         villages -- CSV file containing basic location and market data for villages within area in question.
@@ -45,6 +48,7 @@ from utils import compute_distance as haversine
 
     Output: 
         villages_within_[radius].csv -- all villages from input file within [radius] km of the center point.
+        villages_within_regions.csv -- with --regions, all villages from input file within any of the regions.
         [name]_aggregation.csv -- consolidation of Georasterviewer-created files into dataframe for retailer generation.
 
     '''
@@ -61,7 +65,21 @@ def villages_in_range(villages, origin):
 
     within_range = villages.loc[villages["From_Center"] <= origin['radius']]
     within_range.to_csv("villages_within_{}.csv".format(origin['radius']), index=False)
+    print_georaster_bounds(within_range)
 
+
+def villages_in_regions(villages, regions):
+    """Lists the villages within any of a RegionSet's regions, with a 0/1 In_[name] column for each region."""
+    inside = regions.membership(villages.Latitude.values, villages.Longitude.values)
+    for region, name in enumerate(regions.names):
+        villages['In_{}'.format(name)] = inside[:, region].astype(int)
+
+    within_regions = villages.loc[inside.any(axis=1)]
+    within_regions.to_csv("villages_within_regions.csv", index=False)
+    print_georaster_bounds(within_regions)
+
+
+def print_georaster_bounds(within_range):
     # Now we print out some quick data for the user to feed into georasterviewer, with a little extra buffer space
     print("\nGeoraster Values:\n===================\nMin Lat: {}\nMax Lat: {}\nMin Lon: {}\nMax Lon: {}".format(
         within_range['Latitude'].min() + 0.15,
@@ -105,6 +123,67 @@ def grid_data_aggregation(origin, header, population, population_density, distan
     aggregate.to_csv("{}_aggregation.csv".format(file_name), index=False)
 
 
+class GridLocator:
+    """
+    Finds which pixel of an aggregation (as written by grid_data_aggregation) holds each of a set of lat/lons, using
+        arithmetic on the regular grid rather than filtering the whole aggregation once per point.
+
+    Pixels are located by their Row/Column, so an aggregation that's been trimmed to a radius or filtered by Density
+        still works; points landing in a missing pixel or outside the grid are reported as not found (position -1).
+        Points exactly on a shared edge go to the northern/western pixel, as the old row filtering did.
+    """
+
+    def __init__(self, aggregate):
+        if aggregate.empty:
+            raise ValueError("Cannot locate points within an empty aggregation.")
+        self.aggregate = aggregate
+        rows = aggregate['Row'].values.astype(int)
+        cols = aggregate['Column'].values.astype(int)
+
+        # Recover the grid's corner and cell size from any one pixel.
+        self.cell_size = aggregate['Lat_Upper'].values[0] - aggregate['Lat_Lower'].values[0]
+        self.lat_upper_left = aggregate['Lat_Upper'].values[0] + rows[0] * self.cell_size
+        self.lon_lower_left = aggregate['Lon_Lower'].values[0] - cols[0] * self.cell_size
+        self.num_rows = rows.max() + 1
+        self.num_cols = cols.max() + 1
+
+        # Dense (Row, Column) -> position within the aggregation, with -1 for pixels that aren't in it.
+        self.positions = np.full((self.num_rows, self.num_cols), -1, dtype=np.intp)
+        self.positions[rows, cols] = np.arange(len(aggregate))
+
+    def get_rows_and_columns(self, lats, lons):
+        """Returns the grid Row and Column holding each lat/lon, which may fall outside the grid's bounds."""
+        row_offsets = (self.lat_upper_left - np.asarray(lats, dtype=np.float64)) / self.cell_size
+        col_offsets = (np.asarray(lons, dtype=np.float64) - self.lon_lower_left) / self.cell_size
+        rows = np.maximum(np.ceil(row_offsets) - 1, 0).astype(int)
+        cols = np.maximum(np.ceil(col_offsets) - 1, 0).astype(int)
+
+        # Only a point exactly on the top/left edge is nudged up to 0, anything beyond it stays outside.
+        rows[row_offsets < 0] = -1
+        cols[col_offsets < 0] = -1
+        return rows, cols
+
+    def locate(self, lats, lons):
+        """Returns the position (as in .iloc) within the aggregation of each lat/lon's pixel, or -1 if not found."""
+        rows, cols = self.get_rows_and_columns(lats, lons)
+        in_grid = (rows >= 0) & (rows < self.num_rows) & (cols >= 0) & (cols < self.num_cols)
+        positions = np.full(rows.shape, -1, dtype=np.intp)
+        positions[in_grid] = self.positions[rows[in_grid], cols[in_grid]]
+        return positions
+
+    def gather(self, column, lats, lons, fill_value=None):
+        """
+        Returns the aggregation's `column` value (Density, Population, has_retailer, etc.) for each lat/lon's pixel.
+        Points without a pixel get fill_value, or raise a ValueError if no fill_value is given.
+        """
+        positions = self.locate(lats, lons)
+        found = positions >= 0
+        if fill_value is None and not found.all():
+            raise ValueError("{} of {} points fall outside the aggregation's pixels.".format((~found).sum(), len(found)))
+        values = self.aggregate[column].values[np.where(found, positions, 0)]
+        return np.where(found, values, fill_value) if fill_value is not None else values
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Produces a list of retailers based on population surrounding a center village.')
     parser.add_argument('-r', '--range', help='Generate villages within range of radius', action='store_true')
@@ -117,6 +196,7 @@ if __name__ == '__main__':
     parser.add_argument('--population', type=str, help="The path to the population csv file.")
     parser.add_argument('--urbanicity', type=str, help='The path to the population density csv file.')
     parser.add_argument('--distance', type=str, help='Path to file of distances from pixel to origin.')
+    parser.add_argument('--regions', type=str, help='In range mode, the path to a csv file of further test regions.')
     args = parser.parse_args()
 
     villages = pd.read_csv(
@@ -139,7 +219,16 @@ if __name__ == '__main__':
 
     # if we're in --range mode, we don't need additional input files, we're just running villages_in_range()
     range_mode = args.range
-    if range_mode:
+    if range_mode and args.regions:
+        origin_region = pd.DataFrame({
+            'Name': ['Origin'],
+            'Latitude': [origin['lat']],
+            'Longitude': [origin['lon']],
+            'Radius_KM': [origin['radius']],
+        })
+        regions = pd.read_csv(args.regions, dtype={'Name': str, 'Polygon': str})
+        villages_in_regions(villages, RegionSet.from_frame(pd.concat([origin_region, regions], ignore_index=True)))
+    elif range_mode:
         villages_in_range(villages, origin)
 
     # if we aren't in --range mode, we need all of the files
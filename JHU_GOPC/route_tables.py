@@ -0,0 +1,202 @@
+import hashlib
+import itertools
+import numpy as np
+import os
+import pandas as pd
+
+from utils import get_distance_method
+
+''' This code builds the route tables written by Routes_Generator as whole columns at a time, rather than as one pair of
+    Python dicts per route. Each family of routes (village warehouse to market, wholesale to retailer, etc.) is given
+    as per-route arrays, which are expanded into the start leg (RouteOrder 0) and end leg (RouteOrder 1) of each route,
+    interleaved exactly as the dict-based code appended them.
+
+    Column values follow the same types the dict-based code produced, so the combined routes file is unchanged: a value
+    given as a Python int stays an integer column, a float stays a float column, and '' marks a blank column.
+
+    The table also keeps each leg's TransitDistanceKM (the distance its TransitHours came from, or NaN where the hours
+    are fixed), so the route topology can be built once and then re-timed for a whole grid of scenarios: detour indices,
+    speeds for each truck type, and scalings of ShipLatencyDays. Each scenario only recomputes those numeric columns. A
+    cached topology is keyed by its inputs and the utils distance method its distances were computed with.
+
+    Routes driven several times a day (village markets to wholesales, DailyRoutesPerVM/WeeklyRoutesPerVM) are kept as
+    a single route with a Multiplicity count until export, where expand_routes() writes out each copy with a _0, _1, ...
+    suffix on its RouteName. So generating and re-timing them costs no more than a single route each.
+    '''
+
+DEFAULT_DETOUR_INDEX = 1.425
+DEFAULT_TRUCK_SPEEDS_KMPH = {'4wheel': 30.0, 'moto': 30.0, 'multi': 30.0}
+
+ROUTE_COLUMNS = [
+    'RouteName', 'idcode', 'LocName', 'Type', 'RouteOrder', 'TransitHours', 'DistanceKM', 'TruckType',
+    'ShipIntervalDays',
+    'PullOrderAmountDays', 'ShipLatencyDays', 'PerDiemType', 'PickupDelayFrequency', 'PickupDelayMagnitude',
+    'PickupDelaySigma', 'Conditions', 'Notes',
+]
+
+
+def interleave(start_values, end_values):
+    """Returns one array alternating start_values[0], end_values[0], start_values[1], end_values[1], ..."""
+    start_values = np.asarray(start_values)
+    end_values = np.asarray(end_values)
+    dtype = start_values.dtype if start_values.dtype == end_values.dtype else object
+    legs = np.empty(len(start_values) + len(end_values), dtype=dtype)
+    legs[0::2] = start_values
+    legs[1::2] = end_values
+    return legs
+
+
+def round_hours(hours, decimals=3):
+    """
+    Rounds an array of hours exactly as Python's round() would, which numpy's round doesn't guarantee for values that
+        land right next to a tie once scaled. Only those few values are passed through round() itself.
+    """
+    hours = np.asarray(hours, dtype=np.float64)
+    scale = 10.0 ** decimals
+    scaled = hours * scale
+    rounded = np.rint(scaled) / scale
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= 4 * np.spacing(np.abs(scaled))
+    rounded[near_tie] = [round(float(value), decimals) for value in hours[near_tie]]
+    return rounded
+
+
+def transit_hours(distances, detour_index=DEFAULT_DETOUR_INDEX, speed_kmph=30.0):
+    """Returns the rounded transit time in hours for each straight-line distance, after applying the detour index."""
+    return round_hours(np.asarray(distances, dtype=np.float64) * detour_index / speed_kmph)
+
+
+def build_route_table(route_names, start_ids, start_names, end_ids, end_names, route_type, transit_hours='',
+                      distance_km='', truck_type='', ship_latency_days='', ship_interval_days='',
+                      pull_order_amount_days='', per_diem_type='', transit_distance_km=np.nan, multiplicity=None):
+    """
+    Returns a family of routes as a DataFrame, with each route's start leg followed by its end leg.
+
+    The names/ids are per-route arrays for each end of the route. Every other argument is either a per-route array
+        (shared by both legs, e.g. np.where(weekly, 7, 1) for the Weekly market overrides) or a single value broadcast
+        to every leg. An empty family gives an empty DataFrame, as pd.DataFrame([]) did.
+
+    If multiplicity is given, it's the number of copies of each route to export (see expand_routes), numbered by
+        suffixing the route names. Otherwise every route is exported once, as named.
+    """
+    num_routes = len(route_names)
+    if num_routes == 0:
+        return pd.DataFrame()
+
+    def legs(value):
+        value = np.asarray(value)
+        if value.ndim == 0:
+            return np.full(2 * num_routes, value[()], dtype=value.dtype)
+        return np.repeat(value, 2)
+
+    return pd.DataFrame({
+        'RouteName': legs(route_names),
+        'idcode': interleave(start_ids, end_ids),
+        'LocName': interleave(start_names, end_names),
+        'Type': legs(route_type),
+        'RouteOrder': np.tile([0, 1], num_routes),
+        'TransitHours': legs(transit_hours),
+        'DistanceKM': legs(distance_km),
+        'TruckType': legs(truck_type),
+        'ShipLatencyDays': legs(ship_latency_days),
+        'ShipIntervalDays': legs(ship_interval_days),
+        'PullOrderAmountDays': legs(pull_order_amount_days),
+        'PerDiemType': legs(per_diem_type),
+        'TransitDistanceKM': legs(np.asarray(transit_distance_km, dtype=np.float64)),
+        'Multiplicity': legs(np.asarray(1 if multiplicity is None else multiplicity, dtype=np.int64)),
+        'Numbered': multiplicity is not None,
+    })
+
+
+def expand_routes(routes):
+    """
+    Returns the routes with each one repeated Multiplicity times (dropping those with none), start and end legs kept
+        together. Copies of Numbered routes get a _{copy number} suffix on their RouteName, counting from 0.
+    """
+    if 'Multiplicity' not in routes.columns:
+        return routes
+
+    # Every route is a start leg followed by its end leg, so repeat whole pairs of rows.
+    copies = routes['Multiplicity'].values[0::2]
+    pairs = np.repeat(np.arange(len(copies)), copies)
+    expanded = routes.take((2 * pairs[:, np.newaxis] + [0, 1]).ravel())
+
+    numbered = expanded['Numbered'].values.astype(bool)
+    if numbered.any():
+        copy_numbers = np.arange(len(pairs)) - np.repeat(np.cumsum(copies) - copies, copies)
+        suffixes = '_' + pd.Series(np.repeat(copy_numbers, 2)[numbered]).astype(str)
+        route_names = expanded['RouteName'].to_numpy(copy=True)
+        route_names[numbered] = (expanded['RouteName'][numbered].reset_index(drop=True) + suffixes).values
+        expanded = expanded.assign(RouteName=route_names)
+    return expanded.reset_index(drop=True)
+
+
+def get_topology_key(*frames, **parameters):
+    """
+    Returns a hash of the contents of the given DataFrames and parameters, and of the active utils distance method, for
+        telling whether a cache is stale.
+    """
+    parameters = dict(parameters, distance_method=get_distance_method())
+    digest = hashlib.sha1(repr(sorted(parameters.items())).encode())
+    for frame in frames:
+        digest.update(repr(list(frame.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def load_topology(cache_file, key):
+    """Returns the route topology saved in cache_file, or None if there isn't one or it was built from other inputs."""
+    if cache_file is None or not os.path.isfile(cache_file):
+        return None
+    cached = pd.read_pickle(cache_file)
+    return cached['routes'] if cached.get('key') == key else None
+
+
+def save_topology(cache_file, key, routes):
+    """Saves the route topology to cache_file, along with the key of the inputs it was built from."""
+    pd.to_pickle({'key': key, 'routes': routes}, cache_file)
+
+
+def get_route_scenarios(detour_indices=(DEFAULT_DETOUR_INDEX,), truck_speeds=None, latency_scales=(1.0,)):
+    """
+    Returns a DataFrame with one row per scenario in the grid of every combination of the given detour indices, truck
+        speeds (a dict of truck type -> list of speeds in km/h, defaulting to DEFAULT_TRUCK_SPEEDS_KMPH), and latency
+        scales. Speeds are in columns named Speed_<truck type>.
+    """
+    speeds = {truck: [speed] for truck, speed in DEFAULT_TRUCK_SPEEDS_KMPH.items()}
+    speeds.update(truck_speeds or {})
+    trucks = sorted(speeds)
+    grid = list(itertools.product(detour_indices, *[speeds[truck] for truck in trucks], latency_scales))
+    columns = ['Detour_Index'] + ['Speed_' + truck for truck in trucks] + ['Latency_Scale']
+    scenarios = pd.DataFrame(grid, columns=columns)
+    scenarios.insert(0, 'Scenario', ['{:03}'.format(number) for number in range(len(scenarios))])
+    return scenarios
+
+
+def iter_route_scenarios(routes, scenarios):
+    """
+    Yields (scenario, routes) for each row of scenarios, re-timing the given route topology. Each leg's truck type is
+        looked up once, so a scenario's TransitHours are a single array expression over the legs, and all other columns
+        are shared unchanged.
+    """
+    transit_legs = np.flatnonzero(routes['TransitDistanceKM'].notna().values)
+    truck_codes, trucks = pd.factorize(routes['TruckType'].values[transit_legs])
+    missing = set(trucks) - {column[len('Speed_'):] for column in scenarios.columns if column.startswith('Speed_')}
+    if missing:
+        raise KeyError("No speeds given for truck types: {}".format(', '.join(sorted(missing))))
+
+    # A (scenarios x truck types) table of speeds, indexed by each leg's truck type in turn.
+    speed_table = scenarios[['Speed_' + truck for truck in trucks]].to_numpy(dtype=np.float64)
+    distances = routes['TransitDistanceKM'].values[transit_legs]
+    detour_indices = scenarios['Detour_Index'].values
+
+    base_latencies = pd.to_numeric(routes['ShipLatencyDays'], errors='coerce').values
+    latency_legs = np.flatnonzero(~np.isnan(base_latencies))
+
+    for position, scenario in enumerate(scenarios.itertuples(index=False)):
+        transit_column = routes['TransitHours'].to_numpy(dtype=object, copy=True)
+        # Same order of operations as transit_hours().
+        transit_column[transit_legs] = round_hours(
+            distances * detour_indices[position] / speed_table[position, truck_codes])
+        latency_column = routes['ShipLatencyDays'].to_numpy(dtype=object, copy=True)
+        latency_column[latency_legs] = round_hours(base_latencies[latency_legs] * scenario.Latency_Scale)
+        yield scenario, routes.assign(TransitHours=transit_column, ShipLatencyDays=latency_column)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The JHU_GOPC modules are scripts rather than a package, so the tests import them from the script directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator_runs import data_path  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def manifest_inputs():
+    """Returns the test data's manifest routes as (route_ids, weekly_market, districts, daily_production, calendars),
+        as Manifest_Generator.py works them out."""
+    from Manifest_Generator import BLOCK_PRODUCTION_DTYPES
+    from location_registry import read_location_files
+    from manifest_tables import get_import_production, get_manifest_routes, get_market_calendars
+    from manifest_tables import get_village_production
+
+    villages, _, _ = read_location_files(data_path('villages.csv'))
+    block_production = pd.read_csv(data_path('block_production.csv'), dtype=BLOCK_PRODUCTION_DTYPES)
+    seasonality = pd.read_csv(data_path('seasonality.csv'), index_col=0)
+    calendars = get_market_calendars()
+    shipping, village_production = get_village_production(villages, block_production, seasonality, 1.0, calendars)
+    route_ids, weekly_market, districts = get_manifest_routes(villages, shipping)
+    daily_production = np.concatenate(
+        [village_production, get_import_production(block_production, seasonality, calendars)])
+    return route_ids, weekly_market, districts, daily_production, calendars
@@ -0,0 +1,80 @@
+import gzip
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+''' Helpers for the regression tests: running the generator scripts on the synthetic inputs in tests/data, the way
+    they're run from the command line, and comparing what they write with the expected outputs.
+
+    The expected outputs in tests/data/expected were written by the original (pre-vectorisation) generators, with
+    pandas 1.5 and numpy 1.24. Other numpy versions can round trig functions differently in the last place, so a
+    file that isn't byte-for-byte identical is compared again cell by cell, allowing float cells a relative difference
+    of FLOAT_RTOL (a few units in the last place) and nothing else.
+    '''
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+EXPECTED_DIR = os.path.join(DATA_DIR, 'expected')
+OUTPUT_FILES = ['routes.csv', 'odisha_manifest.csv', 'odisha_stores.csv', 'factories.csv']
+FLOAT_RTOL = 1e-13
+
+
+def data_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def run_script(script, args, cwd):
+    """Runs one of the JHU_GOPC scripts with the given arguments in cwd, failing with its output if it fails."""
+    result = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script)] + [str(arg) for arg in args],
+                            cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, '{} failed:\n{}'.format(script, result.stdout)
+    return result.stdout
+
+
+def run_generators(villages, cwd):
+    """Runs Routes, Manifest, Stores and Factory generators on a village file and the other test inputs, in cwd."""
+    wholesales, retailers = data_path('wholesales.csv'), data_path('retailers.csv')
+    loc_ids = data_path('loc_ids.csv')
+    run_script('Routes_Generator.py', [villages, wholesales, retailers, loc_ids], cwd)
+    run_script('Manifest_Generator.py', [villages, data_path('block_production.csv'), data_path('seasonality.csv')], cwd)
+    run_script('Stores_Generator.py', [villages, wholesales, retailers, loc_ids], cwd)
+    run_script('Factory_Generator.py', [villages], cwd)
+
+
+def read_output(path):
+    """Reads an output file's bytes, decompressing it if it's gzipped."""
+    if not os.path.exists(path) and os.path.exists(path + '.gz'):
+        path += '.gz'
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as output_file:
+        return output_file.read()
+
+
+def cells_match(actual, expected):
+    if actual == expected:
+        return True
+    try:
+        return bool(np.isclose(float(actual), float(expected), rtol=FLOAT_RTOL, atol=0))
+    except ValueError:
+        return False
+
+
+def assert_same_output(actual_path, expected_path):
+    """Asserts that an output file matches the expected one byte for byte, or failing that, cell by cell with only
+        last-place float differences."""
+    actual, expected = read_output(actual_path), read_output(expected_path)
+    if actual == expected:
+        return
+    actual_lines = actual.decode('utf-8').splitlines()
+    expected_lines = expected.decode('utf-8').splitlines()
+    name = os.path.basename(expected_path)
+    assert len(actual_lines) == len(expected_lines), '{}: {} lines, expected {}'.format(
+        name, len(actual_lines), len(expected_lines))
+    for line_number, (actual_line, expected_line) in enumerate(zip(actual_lines, expected_lines), 1):
+        if actual_line == expected_line:
+            continue
+        actual_cells, expected_cells = actual_line.split(','), expected_line.split(',')
+        assert len(actual_cells) == len(expected_cells) and all(map(cells_match, actual_cells, expected_cells)), \
+            '{} line {}:\n  got      {}\n  expected {}'.format(name, line_number, actual_line, expected_line)
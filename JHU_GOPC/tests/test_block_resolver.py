@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from block_resolver import BlockRaster, BlockResolver
+
+''' Behaviour checks for block_resolver.py, on square blocks laid out in plain lat/lon degrees. '''
+
+
+def make_resolver(boxes):
+    """Builds a resolver over (lon_min, lat_min, lon_max, lat_max) boxes, named D0/B0, D1/B1, ..."""
+    polygons = [shapely.box(*bounds) for bounds in boxes]
+    names = [str(index) for index in range(len(boxes))]
+    return BlockResolver(polygons, ['D' + name for name in names], ['B' + name for name in names])
+
+
+def test_resolver_gives_border_and_offshore_points_the_nearest_block():
+    # Two blocks sharing the border at lon 1, with the shapefile's spelling of B1 corrected.
+    resolver = BlockResolver(
+        [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1)], ['D0', 'D1'], ['B0', 'B1'],
+        pd.DataFrame({'Shape_Block': ['B1'], 'Data_Block': ['Block 1'], 'Shape_Dist': ['D9'], 'Data_Dist': ['D9']}),
+    )
+    lats = [0.5, 0.5, 0.5, 0.5, 5.0, np.nan]
+    lons = [0.5, 1.5, 1.0, 2.25, 1.9, 0.5]
+
+    # Inside each block, on the shared border (first block wins), off the map to the east and north, and missing.
+    np.testing.assert_array_equal(resolver.locate(lats, lons), [0, 1, 0, 1, 1, -1])
+    np.testing.assert_array_equal(resolver.locate(lats, lons, nearest=False), [0, 1, -1, -1, -1, -1])
+    districts, blocks = resolver.resolve(lats, lons)
+    assert districts.tolist() == ['D0', 'D1', 'D0', 'D1', 'D1', '']
+    assert blocks.tolist() == ['B0', 'Block 1', 'B0', 'Block 1', 'Block 1', '']
+
+
+def test_raster_locates_points_as_the_resolver_does():
+    resolver = make_resolver([(0, 0, 0.8, 1), (0.8, 0, 1.5, 1)])
+    raster = BlockRaster.for_bounds(resolver, 0.1, cache_dir=None)
+    lats = np.random.default_rng(0).uniform(-0.5, 1.5, 500)
+    lons = np.random.default_rng(1).uniform(-0.5, 2.0, 500)
+    np.testing.assert_array_equal(raster.locate(lats, lons), resolver.locate(lats, lons))
+
+
+def test_raster_leaves_pixels_outside_every_block_unlabelled():
+    # One 1x1 degree block in the middle of a 2x2 degree grid of half degree pixels.
+    resolver = make_resolver([(0, 0, 1, 1)])
+    raster = BlockRaster.for_grid(resolver, (4, 4), -0.5, 0.5, 1.5, -0.5, cache_dir=None)
+
+    expected = np.full((4, 4), -1)
+    expected[1:3, 1:3] = 0
+    np.testing.assert_array_equal(raster.pixel_blocks, expected)
+
+    # Point lookups off the block still fall back to the nearest one.
+    np.testing.assert_array_equal(raster.locate([1.25, -0.25], [-0.25, 1.25]), [0, 0])
+    np.testing.assert_array_equal(raster.locate([1.25, -0.25], [-0.25, 1.25], nearest=False), [-1, -1])
+
+
+def test_raster_gives_border_pixels_the_block_holding_their_centroid():
+    # Blocks meeting at lon 0.8, so the middle column of pixels is split between them.
+    resolver = make_resolver([(0, 0, 0.8, 1), (0.8, 0, 1.5, 1)])
+    raster = BlockRaster.for_grid(resolver, (2, 3), 0, 0.5, 1, -0.5, cache_dir=None)
+
+    np.testing.assert_array_equal(raster.pixel_blocks, [[0, 0, 1], [0, 0, 1]])
+
+
+def test_block_statistics_skip_pixels_outside_every_block():
+    pytest.importorskip('gdal')
+    from geo_raster_viewer import GeoRasterViewer
+
+    resolver = make_resolver([(0, 0, 1, 1)])
+    viewer = GeoRasterViewer(np.arange(16, dtype=np.float64).reshape(4, 4), -0.5, 0.5, 1.5, -0.5)
+    for raster in (BlockRaster.for_viewer(resolver, viewer, cache_dir=None),
+                   BlockRaster.for_bounds(resolver, 0.25, cache_dir=None)):
+        statistics = viewer.get_block_statistics(raster)
+        assert statistics[['District', 'Block', 'Pixels']].values.tolist() == [['D0', 'B0', 4]]
+        assert statistics['Sum'].tolist() == [5 + 6 + 9 + 10]
+        assert statistics['Mean'].tolist() == [7.5]
@@ -0,0 +1,50 @@
+import os
+import re
+
+import pandas as pd
+
+from generator_runs import OUTPUT_FILES, data_path, read_output, run_generators, run_script
+
+''' Checks incremental_build.py's contract: after the village data changes, a warm run (reusing the cache of the last
+    run) writes exactly what the generators write when run from scratch on the new data.
+    '''
+
+
+def run_incremental_build(villages, cwd):
+    return run_script('incremental_build.py', [
+        villages, data_path('wholesales.csv'), data_path('retailers.csv'), data_path('loc_ids.csv'),
+        data_path('block_production.csv'), data_path('seasonality.csv')], cwd)
+
+
+def edit_villages(path):
+    """Writes a copy of the test villages with one village moved, one's population and one's market frequency
+        changed, one removed, and a new one added to an existing block."""
+    villages = pd.read_csv(data_path('villages.csv'), dtype=str)
+    villages.loc[5, 'Latitude'] = str(float(villages.loc[5, 'Latitude']) + 0.001)
+    villages.loc[9, 'Population_Served'] = '999.0'
+    villages.loc[12, 'Market_Frequency'] = 'Weekly' if villages.loc[12, 'Market_Frequency'] == 'Daily' else 'Daily'
+    added = villages.iloc[[20]].copy()
+    added['Village_Name'] = 'Added'
+    added['Location_ID'] = added['Location_ID'].str[:5] + '999'
+    villages = pd.concat([villages.drop(index=[30]), added], ignore_index=True)
+    villages.to_csv(path, index=False)
+
+
+def test_warm_run_matches_cold_generators(tmp_path):
+    build_dir, fresh_dir = tmp_path / 'build', tmp_path / 'fresh'
+    build_dir.mkdir()
+    fresh_dir.mkdir()
+    edited_villages = str(tmp_path / 'villages.csv')
+    edit_villages(edited_villages)
+
+    run_incremental_build(data_path('villages.csv'), build_dir)
+    log = run_incremental_build(edited_villages, build_dir)
+    run_generators(edited_villages, fresh_dir)
+
+    # The warm run should only have rebuilt the changed villages' rows.
+    rebuilt, total = map(int, re.search(r'Routes: rebuilt (\d+) of (\d+) villages', log).groups())
+    assert 0 < rebuilt < total
+
+    for name in OUTPUT_FILES:
+        assert read_output(os.path.join(str(build_dir), name)) == read_output(os.path.join(str(fresh_dir), name)), \
+            '{} from the warm run differs from the generators\' output'.format(name)
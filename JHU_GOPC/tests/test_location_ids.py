@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from location_ids import allocate_location_ids, match_existing_ids
+
+''' Behaviour checks for location_ids.py's allocation of Location_IDs, fresh and stable. '''
+
+CODEBOOK = pd.DataFrame({'Combo': ['Puri_A', 'Puri_B'], 'District_Code': [3, 3], 'Block_Code': [1, 12]})
+
+
+def test_fresh_ids_count_within_each_block():
+    ids, numbers = allocate_location_ids(['Puri_A', 'Puri_B', np.nan, 'Puri_A'], CODEBOOK, '3')
+    assert ids.tolist() == ['30301001', '30312001', '', '30301002']
+    assert numbers.tolist() == [1, 1, -1, 2]
+    with pytest.raises(KeyError):
+        allocate_location_ids(['Puri_A', 'Puri_Z'], CODEBOOK, '3')
+
+
+def test_stable_ids_keep_old_ids_and_number_new_rows_after_reserved_ones():
+    # The previous run had 30301001-30301004 in block A (30301004 since removed) and 30312001 in block B.
+    reserved = ['30301001', '30301002', '30301003', '30301004', '30312001', '70301009']
+    combos = ['Puri_A', 'Puri_A', 'Puri_B', 'Puri_A', 'Puri_B', 'Puri_A', 'Puri_A']
+    existing = ['30301003', np.nan, '30312001', '30301001', '30301002', '30301001', '']
+    ids, numbers = allocate_location_ids(combos, CODEBOOK, '3', existing, reserved)
+
+    # Rows keep their IDs unless they've moved block (row 4) or repeat an earlier row's ID (row 5). New rows are
+    # numbered after the highest ID in their block, kept or reserved, in row order; other types' IDs don't count.
+    assert ids.tolist() == ['30301003', '30301005', '30312001', '30301001', '30312002', '30301006', '30301007']
+    assert numbers.tolist() == [3, 5, 1, 1, 2, 6, 7]
+
+
+def test_stable_ids_without_reserved_ids_continue_from_kept_ones():
+    ids, _ = allocate_location_ids(['Puri_A', 'Puri_A', 'Puri_A'], CODEBOOK, '3', ['30301007', None, '30301002'])
+    assert ids.tolist() == ['30301007', '30301008', '30301002']
+
+
+def test_match_existing_ids_on_keys_and_rounded_lat_lons():
+    previous = pd.DataFrame({
+        'Village_Name': ['V0', 'V1', 'V1', 'V2'],
+        'Latitude': [20.1, 20.2, 20.2, 20.3],
+        'Location_ID': ['30301001', '30301002', '30301003', '30301004'],
+    })
+    frame = pd.DataFrame({
+        'Village_Name': ['V1', 'V0', 'V1', 'V1', 'V2'],
+        'Latitude': [20.2, 20.1 + 1e-12, 20.2, 20.2, 20.31],
+    })
+    matched = match_existing_ids(frame, previous, ['Village_Name', 'Latitude'])
+    assert pd.Series(matched).fillna('').tolist() == ['30301002', '30301001', '30301003', '', '']
@@ -0,0 +1,35 @@
+import numpy as np
+
+from manifest_rle import ManifestRuns
+from manifest_tables import write_manifest
+
+''' Behaviour checks for manifest_rle.py: the runs must expand back into exactly the manifest they encode. '''
+
+
+def test_runs_expand_to_the_same_manifest(manifest_inputs, tmp_path):
+    route_ids, weekly_market, _, daily_production, calendars = manifest_inputs
+    write_manifest(str(tmp_path / 'manifest.csv'), route_ids, weekly_market, daily_production, calendars)
+
+    runs = ManifestRuns.from_production(route_ids, weekly_market, daily_production, calendars)
+    runs.save(str(tmp_path / 'runs.npz'))
+    loaded = ManifestRuns.load(str(tmp_path / 'runs.npz'))
+    loaded.expand(str(tmp_path / 'expanded.csv'), calendars=calendars)
+
+    # Months with the same daily amount are merged, so there are far fewer runs than manifest rows.
+    assert len(loaded) < daily_production.size
+    np.testing.assert_array_equal(loaded.to_production(calendars), daily_production)
+    assert (tmp_path / 'expanded.csv').read_bytes() == (tmp_path / 'manifest.csv').read_bytes()
+
+
+def test_runs_cover_each_route_and_product_without_gaps(manifest_inputs):
+    route_ids, weekly_market, _, daily_production, calendars = manifest_inputs
+    frame = ManifestRuns.from_production(route_ids, weekly_market, daily_production, calendars).to_frame()
+
+    for (route_id, _), runs in frame.groupby(['RouteId', 'Product'], sort=False):
+        weekly = weekly_market[list(route_ids).index(route_id)]
+        market_days = calendars[int(weekly)]['Start_Days'].values
+        assert runs['StartDay'].iloc[0] == market_days[0]
+        assert np.isclose(runs['EndDay'].iloc[-1], market_days[-1] + 0.1)
+        # Each run starts on the market day after the previous run ends.
+        next_starts = market_days[np.searchsorted(market_days, runs['EndDay'].values[:-1] - 0.1) + 1]
+        np.testing.assert_allclose(runs['StartDay'].values[1:], next_starts)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from hermes_export import format_rows
+from manifest_store import ManifestStore
+from manifest_tables import MANIFEST_COLUMNS, write_manifest
+
+''' Behaviour checks for manifest_store.py: rows read from the store must be the manifest's own rows. '''
+
+
+@pytest.fixture(scope='module')
+def manifest_lines(manifest_inputs, tmp_path_factory):
+    """Returns the written manifest's rows (without the header) as {RouteId: [line, ...]}."""
+    route_ids, weekly_market, _, daily_production, calendars = manifest_inputs
+    path = tmp_path_factory.mktemp('manifest') / 'manifest.csv'
+    write_manifest(str(path), route_ids, weekly_market, daily_production, calendars)
+    lines = {}
+    for line in path.read_text().splitlines(True)[1:]:
+        lines.setdefault(line.split(',', 1)[0], []).append(line)
+    return lines
+
+
+@pytest.fixture(scope='module')
+def store(manifest_inputs, tmp_path_factory):
+    route_ids, weekly_market, districts, daily_production, calendars = manifest_inputs
+    path = str(tmp_path_factory.mktemp('store') / 'store')
+    ManifestStore.build(path, route_ids, weekly_market, daily_production, districts, calendars, routes_per_chunk=7)
+    return ManifestStore.load(path)
+
+
+def test_read_routes_matches_manifest(store, manifest_inputs, manifest_lines):
+    route_ids, weekly_market = manifest_inputs[:2]
+    # A Weekly and a Daily route, out of manifest order, and Aiginia Imports' route.
+    selected = [route_ids[7], route_ids[0], route_ids[-1]]
+    assert weekly_market[7] and not weekly_market[0]
+    expected = ''.join(line for route_id in selected for line in manifest_lines[route_id])
+    assert format_rows(store.read(selected), MANIFEST_COLUMNS) == expected
+
+
+def test_read_district_matches_manifest(store, manifest_inputs, manifest_lines):
+    route_ids, _, districts, _, _ = manifest_inputs
+    district_routes = route_ids[districts == 'Puri']
+    np.testing.assert_array_equal(store.get_district_routes('Puri'), district_routes)
+    expected = ''.join(line for route_id in district_routes for line in manifest_lines[route_id])
+    assert format_rows(store.read(district='Puri'), MANIFEST_COLUMNS) == expected
+
+
+def test_read_day_range_keeps_only_those_days(store, manifest_inputs, manifest_lines):
+    route_ids = manifest_inputs[0]
+    selected = list(route_ids[:4])
+    rows = store.read(selected, days=(30, 60))
+    expected = ''.join(
+        line for route_id in selected for line in manifest_lines[route_id]
+        if 30 <= int(float(line.split(',')[1])) <= 60
+    )
+    assert len(rows) and format_rows(rows, MANIFEST_COLUMNS) == expected
+
+
+def test_read_unknown_routes_and_districts_raise(store):
+    with pytest.raises(KeyError):
+        store.read(['wh_nowhere'])
+    with pytest.raises(KeyError):
+        store.get_district_routes('Nowhere')
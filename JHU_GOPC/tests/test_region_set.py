@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from region_set import BHADRAK, RegionSet
+from utils import compute_distance
+
+''' Behaviour checks for region_set.py: points on a circle's edge are inside it, those on a polygon's border aren't. '''
+
+
+def test_point_on_circle_edge_is_inside():
+    edge_lat, edge_lon = 21.25, 86.3
+    radius = float(compute_distance(np.array([edge_lat]), np.array([edge_lon]), 21.0583, 86.4658).ravel()[0])
+    regions = RegionSet.from_circles(['Edge'], [21.0583], [86.4658], [radius])
+    lats = [edge_lat, 21.0583, edge_lat + 1e-6]
+    lons = [edge_lon, 86.4658, edge_lon - 1e-6]
+    np.testing.assert_array_equal(regions.membership(lats, lons)[:, 0], [True, True, False])
+
+
+def test_point_on_polygon_border_is_outside():
+    regions = RegionSet.from_frame(pd.DataFrame({
+        'Name': ['Square', 'Circle'],
+        'Latitude': [np.nan, 20.5],
+        'Longitude': [np.nan, 86.0],
+        'Radius_KM': [np.nan, 10.0],
+        'Polygon': ['POLYGON ((85 20, 86 20, 86 21, 85 21, 85 20))', None],
+    }))
+    # Inside the square, on its border, at a corner, inside both the square's corner and the circle, and in neither.
+    lats = [20.5, 20.5, 21.0, 20.5, 22.0]
+    lons = [85.5, 86.0, 85.0, 85.999, 87.0]
+    np.testing.assert_array_equal(regions.membership(lats, lons), [
+        [True, False],
+        [False, True],
+        [False, False],
+        [True, True],
+        [False, False],
+    ])
+    frame = regions.membership_frame(['a', 'b', 'c', 'd', 'e'], lats, lons)
+    assert frame.columns.tolist() == ['idcode', 'In_Square', 'In_Circle']
+    assert frame['In_Square'].tolist() == [1, 0, 0, 1, 0]
+    np.testing.assert_array_equal(regions.contains_any(lats, lons), [True, True, False, True, False])
+
+
+def test_default_region_is_bhadrak():
+    np.testing.assert_array_equal(BHADRAK.contains_any([21.0583, 21.5, 20.0], [86.4658, 86.4658, 86.4658]),
+                                  [True, False, False])
+
+
+def test_regions_need_a_polygon_or_a_whole_circle():
+    with pytest.raises(ValueError):
+        RegionSet.from_circles(['Broken'], [21.0], [np.nan], [5.0])
+    with pytest.raises(ValueError):
+        RegionSet.from_circles(['Twin', 'Twin'], [21.0, 22.0], [86.0, 86.0], [5.0, 5.0])
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from generator_runs import EXPECTED_DIR, OUTPUT_FILES, assert_same_output, data_path, run_generators, run_script
+
+''' Regression check for the generators: running them on the synthetic inputs in tests/data must reproduce the
+    outputs of the original generators in tests/data/expected, whether they're run one at a time or together off one
+    location registry (location_generators.py).
+    '''
+
+
+@pytest.fixture(scope='module')
+def output_dir(tmp_path_factory):
+    cwd = tmp_path_factory.mktemp('generators')
+    run_generators(data_path('villages.csv'), cwd)
+    return cwd
+
+
+@pytest.mark.parametrize('name', OUTPUT_FILES)
+def test_output_matches_expected(output_dir, name):
+    assert_same_output(os.path.join(str(output_dir), name), os.path.join(EXPECTED_DIR, name))
+
+
+@pytest.fixture(scope='module')
+def shared_registry_dir(tmp_path_factory):
+    cwd = tmp_path_factory.mktemp('location_generators')
+    run_script('location_generators.py', [
+        data_path('villages.csv'), data_path('wholesales.csv'), data_path('retailers.csv'), data_path('loc_ids.csv')],
+        cwd)
+    return cwd
+
+
+@pytest.mark.parametrize('name', ['factories.csv', 'odisha_stores.csv', 'routes.csv'])
+def test_shared_registry_output_matches_expected(shared_registry_dir, name):
+    assert_same_output(os.path.join(str(shared_registry_dir), name), os.path.join(EXPECTED_DIR, name))
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import utils
+from route_tables import build_route_table, get_route_scenarios, get_topology_key, iter_route_scenarios, transit_hours
+
+''' Behaviour checks for route_tables.py's cached topologies and scenario re-timing. '''
+
+
+def test_topology_key_depends_on_distance_method():
+    frame = pd.DataFrame({'Latitude': [20.0, 21.0], 'Longitude': [85.0, 86.0]})
+    haversine_key = get_topology_key(frame, tier_one_mesh='full')
+    try:
+        utils.set_distance_method('equirectangular')
+        assert get_topology_key(frame, tier_one_mesh='full') != haversine_key
+    finally:
+        utils.set_distance_method('haversine')
+    assert get_topology_key(frame, tier_one_mesh='full') == haversine_key
+
+
+def test_scenarios_retime_each_truck_type():
+    distances = np.array([10.0, 25.5, 40.25])
+    routes = build_route_table(
+        ['a', 'b', 'c'], ['1', '2', '3'], ['A', 'B', 'C'], ['4', '5', '6'], ['D', 'E', 'F'], 'varpush',
+        transit_hours=transit_hours(distances), truck_type=np.array(['4wheel', 'moto', '4wheel']),
+        ship_latency_days=0.833, transit_distance_km=distances,
+    )
+    scenarios = get_route_scenarios([1.2, 1.5], {'4wheel': [20.0, 40.0], 'moto': [25.0]}, [1.0, 2.0])
+
+    for scenario, scenario_routes in iter_route_scenarios(routes, scenarios):
+        speeds = np.array([scenario.Speed_4wheel, scenario.Speed_moto, scenario.Speed_4wheel])
+        expected = np.repeat(transit_hours(distances, scenario.Detour_Index, speeds), 2)
+        assert scenario_routes['TransitHours'].tolist() == expected.tolist()
+        assert scenario_routes['ShipLatencyDays'].tolist() == [round(0.833 * scenario.Latency_Scale, 3)] * 6
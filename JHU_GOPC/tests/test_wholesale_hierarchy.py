@@ -0,0 +1,20 @@
+import numpy as np
+
+from utils import GeoPoints
+from wholesale_hierarchy import get_tier_one_mesh
+
+''' Behaviour checks for the sparse Tier 1 meshes in wholesale_hierarchy.py. '''
+
+
+def test_delaunay_duplicates_share_all_links_of_their_vertex():
+    # A square with a point in the middle, and a second wholesaler on one of the corners.
+    lats = np.array([20.0, 20.0, 20.2, 20.2, 20.1, 20.0])
+    lons = np.array([85.0, 85.2, 85.2, 85.0, 85.1, 85.2])
+    linked = get_tier_one_mesh(GeoPoints(lats, lons), 'delaunay')
+
+    assert (linked == linked.T).all()
+    assert not linked[1, 5] and not linked[5, 1]
+    others = [0, 2, 3, 4]
+    np.testing.assert_array_equal(linked[5, others], linked[1, others])
+    np.testing.assert_array_equal(linked[others, 5], linked[others, 1])
+    assert linked[1, others].sum() == 3
@@ -1,6 +1,8 @@
 import argparse
 import pandas as pd
 
+from location_ids import allocate_location_ids, match_existing_ids
+
 ''' This code parses a file of Odisha Villages to assign HERMES-accessible village IDs. These IDs are created using the
     according to the key defined in the ID file. 
     
@@ -11,13 +13,19 @@ import pandas as pd
     Runtime arguments: 
     village_file -- CSV file containing basic, location, and block data for village markets within Odisha, India.
     id_file -- CSV file with ID numbers corresponding to specific districts and blocks within Odisha.
+    --previous -- village_data CSV from an earlier run, whose villages keep their IDs (new villages are numbered after
+        them), so files built on the old IDs stay valid.
 
     Output: 
     village_data -- CSV file with new Location ID, Village/District/Block Names, Market Frequency, and Lat/Longitude. 
     village_master_file -- CSV file with Census Data, Lat/Lons, Block, Market Frequency, and Hermes Location IDs.  
     '''
 
-def main(villages, codes):
+# Columns identifying the same village between runs.
+VILLAGE_KEYS = ['Village_Name', 'District_Name', 'Block_Name', 'Latitude', 'Longitude']
+
+
+def main(villages, codes, previous=None):
     # Strip and trim the names for comparison, also port CD Block Name over to Block column
     villages['District_Name'] = villages['District_Name'].apply(lambda x: x.strip())
     villages['Block_Name'] = villages['CD_Block_Name'].apply(lambda x: x.strip())
@@ -27,25 +35,14 @@ def main(villages, codes):
     villages['Market_Frequency'] = 'Weekly'
     villages.loc[villages['Mandis/Regular Market (Status A(1)/NA(0))'] == 1, 'Market_Frequency'] = 'Daily'
 
-    # Create IDs for each village based on district and block
+    # Create IDs for each village based on district and block: 3 (village market) + dist/block codes + 3 digits for
+    # index. Villages from a previous run keep their IDs.
     villages['code'] = villages.District_Name + "_" + villages.Block_Name
-    villages['Location_ID'] = ''
-    for code in villages.groupby('code').groups.items():
-        # set index to 1 and isolate dist_block codes and indices of relevant villages
-        index = 1
-        unique_code = code[0]
-        villages_with_code = list(code[1])
-
-        # access the ID directory and get the four digits code set up
-        combo = codes.loc[codes["Combo"] == unique_code]
-        district_code = combo.iloc[0]['District_Code']
-        block_code = combo.iloc[0]['Block_Code']
-
-        # now we assign the full code, 3 (village market) + dist/block codes + 3 digits for index
-        for village_index in villages_with_code:
-            full_id = '3{:02}{:02}{:03}'.format(district_code, block_code, index)
-            villages.loc[village_index, 'Location_ID'] = full_id
-            index = index + 1
+    existing_ids = reserved_ids = None
+    if previous is not None:
+        existing_ids = match_existing_ids(villages, previous, VILLAGE_KEYS)
+        reserved_ids = previous['Location_ID'].values
+    villages['Location_ID'], _ = allocate_location_ids(villages['code'].values, codes, '3', existing_ids, reserved_ids)
 
     useful_columns = ['Location_ID', 'Village_Name', 'Block_Name', 'District_Name',
                       'Market_Frequency', 'Latitude', 'Longitude', ]
@@ -58,9 +55,11 @@ if __name__ == '__main__':
                                      'demographic census and assigns each village a unique ID')
     parser.add_argument('village_file', type=str, help='The path to the CSV file of village markets with lat/lons.')
     parser.add_argument('id_file', type=str, help='The path to the CSV file of district/block names to numbers')
+    parser.add_argument('--previous', type=str, help='The path to a village_data CSV whose IDs should be kept.')
     args = parser.parse_args()
 
     villages = pd.read_csv(args.village_file)
     codes = pd.read_csv(args.id_file)
+    previous_villages = pd.read_csv(args.previous, dtype={'Location_ID': str}) if args.previous else None
 
-    main(villages, codes)
+    main(villages, codes, previous_villages)
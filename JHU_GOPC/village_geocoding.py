@@ -3,9 +3,12 @@ import argparse
 import json
 
 import googlemaps
+import numpy as np
 import pandas as pd
 import shapefile as sf
 
+from geometry_cache import BlockGeometries
+
 ''' This code creates a series of JSON files based upon census and location data for villages in Odisha, India. 
 
     Runtime arguments: 
@@ -119,9 +122,9 @@ def main(villages, shapes, api_key):
     problems = pd.read_csv('data\\problem_villages.csv')
     problems = problems['Village_Code'].values.tolist()
 
-    # Then refine the read shapefile into records and the list of shapes.
-    shape_rec = shapes.records()
-    shape_list = shapes.shapes()
+    # Then get each shape's block_id and bounding box, from the geometry cache if the shapefile has been read before.
+    geometries = BlockGeometries.cached(shapes)
+    shape_names = np.char.add(np.char.add(geometries.districts, '_'), geometries.blocks)
 
     # Set up the google maps client and lists for lat/lons to be recorded and later appended.
     gmaps = googlemaps.Client(key=api_key)
@@ -153,12 +156,10 @@ def main(villages, shapes, api_key):
         block_id = dist_name + '_' + block_name
         added = False
 
-        for shape, bindex in zip(shape_rec, range(len(shape_rec))):
-            # If the shape's name (shape[-1]) matches block_id, we've got a match.
-            shape_name = shape[3] + "_" + shape[5]
+        for shape_name, bbox in zip(shape_names, geometries.bboxes):
+            # If the shape's name (shape[3] + '_' + shape[5]) matches block_id, we've got a match.
             if shape_name == block_id:
-                # Grab the bounding box and use it to pass the village into the geo-coding function.
-                bbox = shape_list[bindex].bbox
+                # Pass the village into the geo-coding function, using the shape's bounding box.
                 latitude, longitude, search = get_lat_lon(
                     client=gmaps,
                     village_name=village_name,
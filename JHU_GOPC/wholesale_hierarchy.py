@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+from scipy.spatial import Delaunay, QhullError
+
+from utils import compute_distance as haversine
+from utils import EARTH_RADIUS_KM, GeoPoints, NearestIndex, closest_distances
+
+''' This code lays out the trade links between tiers of wholesale markets, as used by Routes_Generator:
+        1) Every Tier 1 wholesaler trades with every other Tier 1 (a full mesh, one route each way).
+        2) Every Tier 2 wholesaler trades with its closest Tier 1, up and back down.
+        3) Every Tier 3 wholesaler trades with its closest Tier 1 or 2, up and back down.
+
+    Distances are computed once for the whole hierarchy: the Tier 1 pairwise distance matrix, then one batched
+    closest-parent query per lower tier, rather than a distance call (and a scan of the results) per wholesaler.
+    Wholesalers at zero distance from each other aren't linked, as that would be a route from a market to itself.
+
+    Since the Tier 1 mesh grows as O(n^2) routes, it can instead be made sparse, linking each pair of Tier 1s (in both
+    directions) only if they are:
+        knn -- among each other's k nearest Tier 1s (either way round).
+        delaunay -- neighbours in a Delaunay triangulation of the Tier 1s, which is always connected.
+        threshold -- within a given distance of each other.
+    Goods between unlinked Tier 1s then travel over several hops, so a summary reports how many routes were saved and
+    the most distance that adds to any Tier 1 to Tier 1 trip compared with the direct route.
+    '''
+
+UPWARD_LATENCY_DAYS = 0.833
+DOWNWARD_LATENCY_DAYS = 0.854
+HIERARCHY_COLUMNS = ['Route', 'Start_ID', 'Start_Name', 'End_ID', 'End_Name', 'Distance', 'Latency']
+TIER_ONE_MESHES = ('full', 'knn', 'delaunay', 'threshold')
+
+
+def get_hierarchy_links(wholesales, points=None, mesh_type='full', neighbours=3, radius=50.0):
+    """
+    Returns a DataFrame with one row per hierarchy route (HIERARCHY_COLUMNS), ordered as Routes_Generator writes them:
+        the Tier 1 mesh by start then end wholesaler, then each Tier 2's routes up and down, then each Tier 3's.
+    points can pass in GeoPoints of the wholesalers, if they've already been made.
+
+    mesh_type picks how Tier 1s are linked (see TIER_ONE_MESHES), using `neighbours` for knn and `radius` (km) for
+        threshold. For anything but the full mesh, a dict summarising the savings (see summarise_tier_one_mesh) is
+        returned alongside the links; the full mesh gives None.
+    """
+    if points is None:
+        points = GeoPoints.from_frame(wholesales)
+    tiers = wholesales['Tier'].values
+    tier_ones = np.flatnonzero(tiers == 1)
+
+    # All Tier 1 to Tier 1 distances at once, as [start, end].
+    mesh = np.empty((0, 0))
+    if len(tier_ones):
+        mesh = haversine(points[tier_ones], None, points[tier_ones], None).reshape(len(tier_ones), len(tier_ones)).T
+    linked = get_tier_one_mesh(points[tier_ones], mesh_type, neighbours, radius) & (mesh != 0)
+    mesh_starts, mesh_ends = np.nonzero(linked)
+    links = [
+        _make_links(
+            wholesales,
+            'wm',
+            tier_ones[mesh_starts],
+            tier_ones[mesh_ends],
+            mesh[mesh_starts, mesh_ends],
+            np.full(len(mesh_starts), UPWARD_LATENCY_DAYS),
+        ),
+        _make_parent_links(wholesales, points, 'wm', np.flatnonzero(tiers == 2), tier_ones),
+        _make_parent_links(wholesales, points, 'wm_', np.flatnonzero(tiers == 3), np.flatnonzero(tiers != 3)),
+    ]
+    links = pd.concat(links, ignore_index=True)
+
+    if mesh_type == 'full':
+        return links, None
+    return links, summarise_tier_one_mesh(mesh, linked)
+
+
+def get_tier_one_mesh(points, mesh_type='full', neighbours=3, radius=50.0):
+    """
+    Returns an (n, n) symmetric boolean matrix of which Tier 1 wholesalers (given as GeoPoints) are linked with each
+        other under the given mesh_type. Delaunay needs at least three Tier 1s that aren't in a line, and links all of
+        them otherwise.
+    """
+    if mesh_type not in TIER_ONE_MESHES:
+        raise ValueError("Unknown Tier 1 mesh '{}', choose from {}.".format(mesh_type, ', '.join(TIER_ONE_MESHES)))
+    num_points = len(points)
+    if mesh_type == 'full' or num_points < 2:
+        return np.ones((num_points, num_points), dtype=bool)
+
+    linked = np.zeros((num_points, num_points), dtype=bool)
+    if mesh_type == 'knn':
+        # The closest match for each wholesaler is itself, hence the extra neighbour.
+        _, closest = NearestIndex(points).k_nearest(points, k=neighbours + 1)
+        linked[np.repeat(np.arange(num_points), closest.shape[1]), closest.ravel()] = True
+    elif mesh_type == 'threshold':
+        # Straight-line (chord) distances through the sphere rank the same as haversine distances.
+        chord = 2 * np.sin(radius / (2 * EARTH_RADIUS_KM))
+        pairs = NearestIndex(points).tree.query_pairs(chord, output_type='ndarray')
+        linked[pairs[:, 0], pairs[:, 1]] = True
+    else:
+        # Triangulate on a local equirectangular projection, which is close enough to keep the right neighbours.
+        projected = np.column_stack([points.lons_rad * np.cos(np.mean(points.lats_rad)), points.lats_rad])
+        try:
+            triangulation = Delaunay(projected)
+        except QhullError:
+            return np.ones((num_points, num_points), dtype=bool)
+        triangles = triangulation.simplices
+        for first, second in [(0, 1), (1, 2), (2, 0)]:
+            linked[triangles[:, first], triangles[:, second]] = True
+
+        # Points left out of the triangulation (repeated locations) share the links of the vertex they sit on, both
+        # ways, so the vertex's links need to be made symmetric first.
+        linked |= linked.T
+        duplicates, vertices = triangulation.coplanar[:, 0], triangulation.coplanar[:, 2]
+        linked[duplicates] = linked[vertices]
+        linked[:, duplicates] = linked[:, vertices]
+
+    return linked | linked.T
+
+
+def summarise_tier_one_mesh(mesh, linked):
+    """
+    Compares a sparse Tier 1 mesh against the full one, given the [start, end] distance matrix between all Tier 1s and
+        the boolean matrix of which are linked. The added hop distance for a pair of Tier 1s is the shortest path over
+        the sparse routes less their direct distance; pairs with no path at all are counted as unreachable.
+    """
+    full_routes = np.count_nonzero(mesh != 0)
+    sparse_routes = np.count_nonzero(linked)
+    hops = shortest_path(csr_matrix(np.where(linked, mesh, 0)), method='D', directed=True)
+    pairs = mesh != 0
+    reachable = pairs & np.isfinite(hops)
+    added = hops[reachable] - mesh[reachable]
+    return {
+        'Full_Mesh_Routes': full_routes,
+        'Sparse_Mesh_Routes': sparse_routes,
+        'Routes_Saved': full_routes - sparse_routes,
+        'Max_Added_Hop_KM': max(added.max(), 0.0) if added.size else 0.0,
+        'Max_Hop_Ratio': (hops[reachable] / mesh[reachable]).max() if added.size else 1.0,
+        'Unreachable_Pairs': np.count_nonzero(pairs & ~np.isfinite(hops)),
+    }
+
+
+def _make_parent_links(wholesales, points, route_prefix, children, parents):
+    """Links each child wholesaler with its closest parent, giving the route up followed by the route back down."""
+    if not len(children):
+        return _make_links(wholesales, route_prefix, children, children, [], [])
+    if not len(parents):
+        raise ValueError("Tier {} wholesalers have no higher tier wholesalers to trade with.".format(
+            wholesales['Tier'].values[children[0]]))
+
+    distances, closest = closest_distances(points[children], None, points[parents], None)
+    linked = distances != 0
+    children = children[linked]
+    parents = parents[closest[linked]]
+
+    # Alternate each child's upward route with its downward one.
+    starts = np.column_stack([children, parents]).ravel()
+    ends = np.column_stack([parents, children]).ravel()
+    latencies = np.tile([UPWARD_LATENCY_DAYS, DOWNWARD_LATENCY_DAYS], len(children))
+    return _make_links(wholesales, route_prefix, starts, ends, np.repeat(distances[linked], 2), latencies)
+
+
+def _make_links(wholesales, route_prefix, starts, ends, distances, latencies):
+    """Returns the links between the given start/end rows of wholesales, named like '{prefix}{start}_{prefix}{end}'."""
+    ids = wholesales['Location_ID'].values
+    names = wholesales['Wholesale_Name'].values
+    start_ids = pd.Series(ids[starts], dtype=object).astype(str)
+    end_ids = pd.Series(ids[ends], dtype=object).astype(str)
+    return pd.DataFrame({
+        'Route': (route_prefix + start_ids + '_' + route_prefix + end_ids).values,
+        'Start_ID': ids[starts],
+        'Start_Name': names[starts],
+        'End_ID': ids[ends],
+        'End_Name': names[ends],
+        'Distance': np.asarray(distances, dtype=np.float64),
+        'Latency': np.asarray(latencies, dtype=np.float64),
+    }, columns=HIERARCHY_COLUMNS)